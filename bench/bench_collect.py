@@ -0,0 +1,269 @@
+import argparse
+import gzip
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from typing import Callable, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main  # sets up the lib path
+
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.core import Metric
+
+from fixture_server import FixtureServer
+from fixtures import FIXTURES, scaled
+from history_store import HistoryStore
+from json_decoder import DECODERS
+from log_fixtures import check_log_fixture
+from log_tailer import LogOffsets, MinerLogCollector
+from lolminer_collector import LolminerCollector
+from metric_wrappers import WrMetric
+from miner_discovery import DiscoveredMiner
+from scoped_exposition import MetricsView
+from text_exposition import DirectExposition, TextRenderer
+from trex_collector import TrexCollector
+import transformers
+
+
+COLLECTOR_CLASSES = {
+    't-rex': TrexCollector,
+    'lolminer': LolminerCollector,
+}
+SAMPLE_LOGS = os.path.join(os.path.dirname(__file__), '..', 'sample-logs')
+
+
+def fixture_collector(miner: str, url: str, config=None):
+    collector_class = COLLECTOR_CLASSES[miner]
+    bench_class = type(f'Bench{collector_class.__name__}', (collector_class,), {'local_api_url': url})
+    return bench_class(config)
+
+
+def fixture_mining_collector(collector) -> main.MiningCollector:
+    mining_collector = main.MiningCollector()
+    # Pretend the miner was already discovered, the same way the DEBUG_MOCK_* miners are
+    mining_collector.discovery._cached = [DiscoveredMiner(collector, None, None)]
+    return mining_collector
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def peak_memory_bytes(func: Callable) -> int:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(name: str, func: Callable, iterations: int, warmup: int = 5) -> None:
+    for _ in range(warmup):
+        func()
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f'{name:<44} {iterations:>7} {iterations / elapsed:>10.1f} '
+          f'{statistics.median(latencies) * 1000:>9.3f} {percentile(latencies, 99) * 1000:>9.3f} '
+          f'{peak_memory_bytes(func) / 1024:>9.1f}')
+
+
+def print_header(title: str) -> None:
+    print()
+    print(title)
+    print(f'{"benchmark":<44} {"iters":>7} {"ops/s":>10} {"p50 ms":>9} {"p99 ms":>9} {"peak KiB":>9}')
+
+
+def bench_end_to_end(miner: str, gpu_count: int, algorithm_count: int, iterations: int) -> None:
+    data = scaled(miner, gpu_count, algorithm_count)
+    with FixtureServer(data) as fixture_server:
+        collector = fixture_collector(miner, fixture_server.url(FIXTURES[miner][1]))
+        mining_collector = fixture_mining_collector(collector)
+        registry = CollectorRegistry()
+        registry.register(mining_collector)
+
+        suffix = f'{miner} gpus={gpu_count}' + (f' algos={algorithm_count}' if miner == 'lolminer' else '')
+        run(f'collect {suffix}', lambda: list(mining_collector.collect()), iterations)
+        run(f'exposition {suffix}', lambda: generate_latest(registry), iterations)
+        renderer = TextRenderer()
+        run(f'exposition direct {suffix}', lambda: renderer.render(registry.collect()), iterations)
+
+        # a polled snapshot: prometheus_client renders and gzips it again on every scrape, the direct renderer once
+        metrics = list(mining_collector.collect())
+        run(f'gzip {suffix}', lambda: gzip.compress(generate_latest(MetricsView(metrics))), iterations)
+        exposition = DirectExposition(MetricsView(metrics), snapshot=lambda: metrics)
+        run(f'gzip cached {suffix}', lambda: exposition.encode('gzip'), iterations)
+
+
+def bench_farm(target_count: int, gpu_count: int, iterations: int) -> None:
+    # One central collector polling many rigs; every target is served by the same fixture server under its own host
+    servers = {miner: FixtureServer(scaled(miner, gpu_count)) for miner in FIXTURES}
+    for fixture_server in servers.values():
+        fixture_server.__enter__()
+    try:
+        miners = sorted(servers)
+        targets = [{
+            'miner': miners[index % len(miners)],
+            'url': servers[miners[index % len(miners)]].url(FIXTURES[miners[index % len(miners)]][1]),
+            'host': f'rig-{index:03d}',
+        } for index in range(target_count)]
+        mining_collector = main.MiningCollector({'targets': targets})
+        run(f'collect targets={target_count} gpus={gpu_count}', mining_collector.live_collect, iterations, warmup=2)
+    finally:
+        for fixture_server in servers.values():
+            fixture_server.__exit__()
+
+
+def bench_micro(miner: str, gpu_count: int, iterations: int) -> None:
+    data = scaled(miner, gpu_count)
+    collector = fixture_collector(miner, 'http://127.0.0.1:1/')
+    miner_label_plan = collector.descriptor.miner_label_plan
+    gpu_label_plan = collector.gpu_label_plan
+    gpu_schema = collector.gpu_schema
+
+    if miner == 't-rex':
+        gpu_bases = [(gpu, None) for gpu in data['gpus']]
+    else:
+        gpu_bases = [(data, i) for i in range(gpu_count)]
+
+    label_values = WrMetric.parse_label_values(data, miner_label_plan)
+    gpu_labels = [gpu_schema.labels_for(label_values + gpu_label_plan.values(base, i)) for base, i in gpu_bases]
+
+    def parse_labels():
+        WrMetric.parse_label_values(data, miner_label_plan)
+        for base, i in gpu_bases:
+            WrMetric.parse_label_values(base, gpu_label_plan, i)
+
+    def add_values():
+        families = gpu_schema.new_families()
+        for (base, i), labels in zip(gpu_bases, gpu_labels):
+            for metric, family in zip(gpu_schema.metrics, families):
+                metric.add_value(family, base, labels, None, i)
+
+    run(f'parse_label_values {miner} gpus={gpu_count}', parse_labels, iterations)
+    run(f'add_value {miner} gpus={gpu_count}', add_values, iterations)
+
+
+def bench_history(miner: str, gpu_count: int, iterations: int) -> None:
+    data = scaled(miner, gpu_count)
+    with FixtureServer(data) as fixture_server:
+        collector = fixture_collector(miner, fixture_server.url(FIXTURES[miner][1]))
+        # stamped by the store instead, so the same scrape can be recorded over and over
+        metrics = []
+        for metric in fixture_mining_collector(collector).collect():
+            unstamped = Metric(metric.name, metric.documentation, metric.type, metric.unit)
+            unstamped.samples = [sample._replace(timestamp=None) for sample in metric.samples]
+            metrics.append(unstamped)
+
+    store = HistoryStore(6 * 3600, 30, 256 * 1024 * 1024)
+    timestamps = itertools.count(time.time() - store.retention_sec, store.resolution_sec)
+    for _ in range(store.capacity):
+        store.append(metrics, next(timestamps))
+
+    suffix = f'{miner} gpus={gpu_count}'
+    run(f'history append {suffix}', lambda: store.append(metrics, next(timestamps)), iterations)
+    matchers = {'device_pci_id': store.series('mining_gpu_hashrate')[0]['device_pci_id']}
+    run(f'history query 6h 1 gpu {suffix}', lambda: store.query('mining_gpu_hashrate', matchers), iterations)
+    run(f'history query 6h step=5m {suffix}', lambda: store.query('mining_gpu_hashrate', step=300), iterations)
+    print(f'{"":<44} {len(store)} series, {store.capacity} points each, {store.memory_bytes / 1024 / 1024:.1f} MiB')
+
+
+def bench_logs(miner: str, iterations: int) -> None:
+    # what's timed below is first checked to parse the recorded log right
+    check_log_fixture(miner)
+    with FixtureServer(scaled(miner, 8)) as fixture_server:
+        collector = fixture_collector(miner, fixture_server.url(FIXTURES[miner][1]))
+        collector.collect()
+    discovery = type('BenchDiscovery', (), {'collectors': [collector]})
+
+    with open(os.path.join(SAMPLE_LOGS, f'{miner}.log'), 'rb') as f:
+        chunk = f.read() * 100
+    line_count = chunk.count(b'\n')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f'{miner}.log')
+        open(path, 'wb').close()
+        log_collector = MinerLogCollector(miner, path, COLLECTOR_CLASSES[miner], discovery, LogOffsets())
+        log_collector.collect()
+        with open(path, 'ab') as log:
+            def append_and_collect():
+                log.write(chunk)
+                log.flush()
+                return log_collector.collect()
+
+            run(f'log tail {miner} {line_count} new lines', append_and_collect, iterations)
+            run(f'log tail {miner} idle', log_collector.collect, iterations * 10)
+
+
+def bench_decode(miner: str, gpu_count: int, iterations: int) -> None:
+    body = json.dumps(scaled(miner, gpu_count)).encode()
+    for name, loads in DECODERS.items():
+        run(f'decode {name} {miner} gpus={gpu_count} ({len(body) // 1024} KiB)', lambda: loads(body), iterations)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks against the sample miner API results')
+    parser.add_argument('--miners', nargs='+', choices=sorted(FIXTURES), default=sorted(FIXTURES))
+    parser.add_argument('--gpus', nargs='+', type=int, default=[1, 8, 16, 32])
+    parser.add_argument('--algorithms', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--targets', nargs='+', type=int, default=[10, 100])
+    parser.add_argument('--sections', nargs='+', choices=['end-to-end', 'farm', 'micro', 'decode', 'history', 'logs'],
+                        default=['end-to-end', 'farm', 'micro', 'decode', 'history', 'logs'])
+    args = parser.parse_args()
+
+    if 'end-to-end' in args.sections:
+        print_header('End-to-end (fixture server -> MiningCollector.collect / exposition)')
+        for miner in args.miners:
+            for gpu_count in args.gpus:
+                for algorithm_count in args.algorithms if miner == 'lolminer' else [1]:
+                    bench_end_to_end(miner, gpu_count, algorithm_count, args.iterations)
+
+    if 'farm' in args.sections:
+        print_header('Farm (one collector polling many miner targets)')
+        for target_count in args.targets:
+            bench_farm(target_count, 8, max(1, args.iterations // 10))
+
+    if 'micro' in args.sections:
+        print_header('Micro (label parsing / sample extraction)')
+        for miner in args.miners:
+            for gpu_count in args.gpus:
+                bench_micro(miner, gpu_count, args.iterations * 5)
+
+    print()
+    print('Transformer caches')
+    for name, info in transformers.cache_stats().items():
+        lookups = info.hits + info.misses
+        print(f'{name:<44} hits={info.hits:<8} misses={info.misses:<8} size={info.currsize}/{info.maxsize} '
+              f'hit rate={info.hits / lookups if lookups else 0:.1%}')
+
+    if 'decode' in args.sections:
+        print_header('JSON decoding (installed decoders)')
+        for miner in args.miners:
+            for gpu_count in args.gpus:
+                bench_decode(miner, gpu_count, args.iterations * 5)
+
+    if 'history' in args.sections:
+        print_header('Recent-history store (6h at 30s resolution, filled)')
+        for miner in args.miners:
+            bench_history(miner, 32, args.iterations)
+
+    if 'logs' in args.sections:
+        print_header('Miner log tailer (replayed sample-logs, 8 GPUs)')
+        for miner in args.miners:
+            bench_logs(miner, args.iterations)
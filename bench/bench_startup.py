@@ -0,0 +1,122 @@
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+import yaml
+
+from typing import Dict, List, Optional, Tuple
+
+from fixture_server import FixtureServer
+from fixtures import scaled
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MAIN = os.path.join(ROOT, 'main.py')
+LIB = os.path.join(ROOT, 'lib')
+# the local T-Rex API the collector looks for when DEBUG_MOCK_TREX is set
+TREX_PORT = 4068 if sys.platform != 'linux' else 3333
+
+IMPORTED_MODULES = ['mining_collector', 'trex_collector', 'lolminer_collector', 'async_engine', 'push_exporter',
+                    'requests']
+ENGINES: Dict[str, Optional[Dict]] = {
+    'threaded, live': None,
+    'threaded, polled': {'polling': {'interval_sec': 5}},
+    'async': {'engine': 'async', 'polling': {'interval_sec': 5}},
+}
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def report(name: str, latencies: List[float]) -> None:
+    latencies = sorted(latencies)
+    print(f'{name:<44} {len(latencies):>7} {statistics.median(latencies) * 1000:>9.1f} '
+          f'{percentile(latencies, 99) * 1000:>9.1f}')
+
+
+def print_header(title: str) -> None:
+    print()
+    print(title)
+    print(f'{"benchmark":<44} {"runs":>7} {"p50 ms":>9} {"p99 ms":>9}')
+
+
+def import_time(module: str) -> float:
+    # A fresh interpreter per run, so nothing is already imported
+    code = (f'import sys, time; sys.path.insert(0, {LIB!r}); started = time.perf_counter(); import {module}; '
+            f'print(time.perf_counter() - started)')
+    return float(subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_once(config_path: Optional[str], timeout_sec: float) -> Tuple[float, float]:
+    # (time until the port accepts connections, time until the first scrape with miner metrics), from process start
+    port = free_port()
+    env = dict(os.environ, MINING_COLLECTOR_PORT=str(port), DEBUG_MOCK_TREX='1')
+    if config_path:
+        env['MINING_COLLECTOR_CONFIG'] = config_path
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, MAIN], env=env, stdout=subprocess.DEVNULL)
+    try:
+        bound_sec = None
+        while bound_sec is None:
+            if time.perf_counter() - started > timeout_sec or process.poll() is not None:
+                raise RuntimeError('the collector did not bind its port')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+                bound_sec = time.perf_counter() - started
+            except OSError:
+                time.sleep(0.001)
+
+        while time.perf_counter() - started < timeout_sec:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=timeout_sec) as response:
+                    if b'mining_hashrate' in response.read():
+                        return bound_sec, time.perf_counter() - started
+            except (OSError, urllib.error.URLError):
+                pass
+            time.sleep(0.005)
+        raise RuntimeError('no successful scrape before the timeout')
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def bench_startup(name: str, config: Optional[Dict], runs: int, timeout_sec: float) -> None:
+    with tempfile.NamedTemporaryFile('w', suffix='.yaml') as f:
+        yaml.safe_dump(config or {}, f)
+        f.flush()
+        results = [start_once(f.name, timeout_sec) for _ in range(runs)]
+    report(f'{name}: port bound', [bound for bound, _ in results])
+    report(f'{name}: first successful scrape', [scraped for _, scraped in results])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time and time-to-first-scrape of a fresh collector process')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--gpus', type=int, default=8)
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument('--timeout-sec', type=float, default=30.0)
+    args = parser.parse_args()
+
+    print_header('Import time (fresh interpreter per run)')
+    for module in IMPORTED_MODULES:
+        report(f'import {module}', [import_time(module) for _ in range(args.runs)])
+
+    print_header(f'Startup (python main.py -> local T-Rex fixture on :{TREX_PORT})')
+    with FixtureServer(scaled('t-rex', args.gpus), port=TREX_PORT):
+        for engine in args.engines:
+            bench_startup(engine, ENGINES[engine], args.runs, args.timeout_sec)
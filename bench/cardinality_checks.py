@@ -0,0 +1,93 @@
+import os
+import sys
+
+from typing import List, Optional, Set, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main  # sets up the lib path
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import GaugeMetricFamily, Metric
+
+from cardinality_guard import CardinalityGuard
+from fixture_server import FixtureServer
+from fixtures import FIXTURES, scaled
+from scrape_scope import ScrapeScope
+from trex_collector import TrexCollector
+
+
+def expect(actual, expected, what: str) -> None:
+    if actual != expected:
+        raise AssertionError(f'{what}: expected {expected!r}, got {actual!r}')
+
+
+def pci_ids(metrics: List[Metric]) -> Set[str]:
+    return {sample.labels['device_pci_id'] for metric in metrics for sample in metric.samples
+            if 'device_pci_id' in sample.labels}
+
+
+def gpu_families(gpu_count: int, families: int = 1) -> List[Metric]:
+    metrics = []
+    for family in range(families):
+        metric = GaugeMetricFamily(f'mining_gpu_check_{family}', 'check', labels=['miner', 'device_pci_id'])
+        for gpu in range(gpu_count):
+            metric.add_metric(['t-rex', f'{gpu:02d}:00'], gpu)
+        metrics.append(metric)
+    return metrics
+
+
+def counted(miner: str) -> Tuple[Optional[float], ...]:
+    return tuple(REGISTRY.get_sample_value(name, {'host': 'check', 'miner': miner})
+                 for name in ('mining_collector_series', 'mining_collector_series_created_total',
+                              'mining_collector_series_removed_total', 'mining_collector_series_dropped_total'))
+
+
+def check_scoped_budget() -> None:
+    # A scoped scrape sees only part of the series, so on its own it would always fit the budget
+    guard = CardinalityGuard('check', 'scoped-budget', series_budget=2)
+    expect(pci_ids(guard.apply(gpu_families(4))), {'00:00', '01:00'}, 'full scrape within the budget')
+    before = counted('scoped-budget')
+    expect(before, (2.0, 2.0, 0.0, 2.0), 'series counts after the full scrape')
+    for pci_id, admitted in (('03:00', set()), ('01:00', {'01:00'})):
+        metrics = gpu_families(4)
+        for metric in metrics:
+            metric.samples = [sample for sample in metric.samples if sample.labels['device_pci_id'] == pci_id]
+        expect(pci_ids(guard.apply(metrics, ScrapeScope(pci_id=pci_id))), admitted, f'scoped scrape of {pci_id}')
+    expect(pci_ids(guard.apply(gpu_families(4), ScrapeScope(families=['gpu_check_0']))), {'00:00', '01:00'},
+           'family scoped scrape')
+    expect(counted('scoped-budget'), before, 'series counts after scoped scrapes')
+
+    # without a full result yet, a scoped scrape gets the whole budget to itself
+    guard = CardinalityGuard('check', 'scoped-first', series_budget=3)
+    expect(pci_ids(guard.apply(gpu_families(4), ScrapeScope(families=['gpu_check_0']))),
+           {'00:00', '01:00', '02:00'}, 'scoped scrape before a full one')
+
+
+def check_collector(change_detection: bool) -> None:
+    # End to end through a miner collector: scoped scrapes of the GPUs the budget left out get nothing
+    config = {'change_detection': {'enabled': change_detection}}
+    with FixtureServer(scaled('t-rex', 4)) as fixture_server:
+        target = {'miner': 't-rex', 'url': fixture_server.url(FIXTURES['t-rex'][1])}
+        unbounded = TrexCollector(config, target).collect()
+        all_gpus = pci_ids(unbounded)
+        budget = sum(len(metric.samples) for metric in unbounded) // 2
+        collector = TrexCollector({**config, 'cardinality': {'series_budget': budget}}, target)
+        admitted = pci_ids(collector.collect())
+        if not admitted or admitted == all_gpus:
+            raise AssertionError(f'a budget of {budget} should leave out some GPUs, admitted {sorted(admitted)}')
+        for pci_id in sorted(all_gpus):
+            scoped = pci_ids(collector.collect(ScrapeScope(pci_id=pci_id)))
+            expect(scoped, {pci_id} if pci_id in admitted else set(),
+                   f'scoped scrape of {pci_id} (change_detection={change_detection})')
+
+
+def check_cardinality() -> None:
+    check_scoped_budget()
+    # with change detection a scoped scrape of an unchanged response filters the cached full result instead
+    check_collector(change_detection=False)
+    check_collector(change_detection=True)
+
+
+if __name__ == '__main__':
+    check_cardinality()
+    print('cardinality: OK')
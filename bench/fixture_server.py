@@ -0,0 +1,66 @@
+import argparse
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+from fixtures import FIXTURES, scaled
+
+
+class FixtureServer:
+    # Stand-in for a miner API, serving a fixed JSON document on every GET
+    def __init__(self, data: Dict, host: str = '127.0.0.1', port: int = 0):
+        self.set_data(data)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                body = server.body
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # the default listen backlog of 5 drops connections when a farm of targets connects at once
+            request_queue_size = 256
+
+        self._httpd = Server((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fixture-server', daemon=True)
+
+    def set_data(self, data: Dict) -> None:
+        self.body = json.dumps(data).encode()
+
+    def url(self, path: str) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}{path}'
+
+    def __enter__(self) -> 'FixtureServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a (scaled) miner API fixture')
+    parser.add_argument('miner', choices=sorted(FIXTURES))
+    parser.add_argument('--gpus', type=int, default=2)
+    parser.add_argument('--algorithms', type=int, default=1)
+    parser.add_argument('--port', type=int, default=3333)
+    args = parser.parse_args()
+
+    with FixtureServer(scaled(args.miner, args.gpus, args.algorithms), port=args.port) as fixture_server:
+        print(f'Serving {args.miner} with {args.gpus} GPUs at {fixture_server.url(FIXTURES[args.miner][1])}')
+        threading.Event().wait()
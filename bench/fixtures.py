@@ -0,0 +1,68 @@
+import copy
+import json
+import pathlib
+
+from typing import Dict
+
+
+SAMPLE_DIR = pathlib.Path(__file__).parent.parent / 'sample-api-results'
+
+# fixture name -> (sample file, path the miner API is served on)
+FIXTURES = {
+    't-rex': ('t-rex.json', '/summary'),
+    'lolminer': ('lolminer.json', '/'),
+}
+
+
+def load_sample(miner: str) -> Dict:
+    with (SAMPLE_DIR / FIXTURES[miner][0]).open('r') as f:
+        return json.load(f)
+
+
+def scaled_trex(gpu_count: int) -> Dict:
+    data = load_sample('t-rex')
+    template = data['gpus']
+    gpus = []
+    for index in range(gpu_count):
+        gpu = copy.deepcopy(template[index % len(template)])
+        gpu['device_id'] = gpu['gpu_id'] = gpu['gpu_user_id'] = index
+        gpu['pci_bus'] = index + 1
+        gpu['uuid'] = f'{gpu["uuid"][:-4]}{index:04d}'
+        gpus.append(gpu)
+    data['gpus'] = gpus
+    data['gpu_total'] = gpu_count
+    return data
+
+
+def scaled_lolminer(gpu_count: int, algorithm_count: int = 1) -> Dict:
+    data = load_sample('lolminer')
+    template = data['Workers']
+    workers = []
+    for index in range(gpu_count):
+        worker = copy.deepcopy(template[index % len(template)])
+        worker['Index'] = index
+        worker['PCIE_Address'] = f'{index + 1}:0'
+        workers.append(worker)
+    data['Workers'] = workers
+    data['Num_Workers'] = gpu_count
+
+    algorithm_template = data['Algorithms'][0]
+    algorithms = []
+    for algorithm_index in range(algorithm_count):
+        algorithm = copy.deepcopy(algorithm_template)
+        if algorithm_index:
+            algorithm['Algorithm'] = f'{algorithm["Algorithm"]}-{algorithm_index}'
+            algorithm['Pool'] = f'pool-{algorithm_index}.example.com:1177'
+        for key in ('Worker_Performance', 'Worker_Accepted', 'Worker_Rejected', 'Worker_Stales', 'Worker_Errors'):
+            values = algorithm_template[key]
+            algorithm[key] = [values[index % len(values)] for index in range(gpu_count)]
+        algorithms.append(algorithm)
+    data['Algorithms'] = algorithms
+    data['Num_Algorithms'] = algorithm_count
+    return data
+
+
+def scaled(miner: str, gpu_count: int, algorithm_count: int = 1) -> Dict:
+    if miner == 't-rex':
+        return scaled_trex(gpu_count)
+    return scaled_lolminer(gpu_count, algorithm_count)
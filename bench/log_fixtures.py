@@ -0,0 +1,189 @@
+import json
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main  # sets up the lib path
+
+from prometheus_client.core import Metric
+
+from fixtures import load_sample
+from log_tailer import LogOffsets, MinerLogCollector
+from lolminer_collector import LolminerCollector
+from trex_collector import TrexCollector
+
+
+SAMPLE_LOG_DIR = pathlib.Path(__file__).parent.parent / 'sample-logs'
+COLLECTOR_CLASSES = {
+    't-rex': TrexCollector,
+    'lolminer': LolminerCollector,
+}
+# PCI ID of the GPU each GPU number in the logs is, in the matching sample API result
+GPU_PCI_IDS = {0: '07:00', 1: '08:00'}
+
+# What the recorded logs in sample-logs/ hold, per miner: (counter, GPU number or None) -> count, and
+# (histogram, GPU number) -> (cumulative bucket counts up to +Inf, sum)
+EXPECTED = {
+    't-rex': {
+        'counts': {
+            ('mining_log_shares_accepted', 0): 3, ('mining_log_shares_accepted', 1): 3,
+            ('mining_log_shares_rejected', 1): 1,
+            ('mining_log_lhr_unlocks', 0): 1, ('mining_log_lhr_unlocks', 1): 1,
+            ('mining_log_dag_builds', 0): 1, ('mining_log_dag_builds', 1): 2,
+            ('mining_log_gpu_restarts', 1): 1,
+            ('mining_log_pool_reconnects', None): 1,
+        },
+        'histograms': {
+            # 41, 122 and 36 ms; 38, 44 (rejected), 612 and 40 ms
+            ('mining_log_share_latency_sec', 0): ([0, 0, 2, 2, 3, 3, 3, 3, 3], 0.199),
+            ('mining_log_share_latency_sec', 1): ([0, 0, 3, 3, 3, 3, 4, 4, 4], 0.734),
+            # 4107 ms; 4385 and 3962 ms
+            ('mining_log_dag_build_sec', 0): ([0, 0, 1, 1, 1, 1, 1, 1], 4.107),
+            ('mining_log_dag_build_sec', 1): ([0, 0, 2, 2, 2, 2, 2, 2], 8.347),
+        },
+    },
+    'lolminer': {
+        'counts': {
+            ('mining_log_shares_accepted', 0): 2, ('mining_log_shares_accepted', 1): 2,
+            ('mining_log_shares_rejected', 1): 1,
+            ('mining_log_lhr_unlocks', 0): 1, ('mining_log_lhr_unlocks', 1): 1,
+            ('mining_log_dag_builds', 0): 1, ('mining_log_dag_builds', 1): 2,
+            ('mining_log_gpu_restarts', 1): 1,
+            ('mining_log_pool_reconnects', None): 1,
+        },
+        'histograms': {
+            # 48 and 230 ms; 52, 61 (rejected) and 45 ms
+            ('mining_log_share_latency_sec', 0): ([0, 0, 1, 1, 2, 2, 2, 2, 2], 0.278),
+            ('mining_log_share_latency_sec', 1): ([0, 0, 1, 3, 3, 3, 3, 3, 3], 0.158),
+            # 5.3 s; 5.6 and 12.1 s
+            ('mining_log_dag_build_sec', 0): ([0, 0, 0, 1, 1, 1, 1, 1], 5.3),
+            ('mining_log_dag_build_sec', 1): ([0, 0, 0, 1, 2, 2, 2, 2], 17.7),
+        },
+    },
+}
+# the last line of both logs is a share GPU 1 got accepted, which the rotation checks write again
+REPLAYED = ('mining_log_shares_accepted', 1)
+
+
+class FixtureDiscovery:
+    def __init__(self):
+        self.collectors = []
+
+
+def expect(actual, expected, what: str) -> None:
+    if actual != expected:
+        raise AssertionError(f'{what}: expected {expected!r}, got {actual!r}')
+
+
+def api_collector(miner: str):
+    # The miner's own collector, having parsed the sample API result recorded on the same rig as the log
+    data = load_sample(miner)
+    if miner == 't-rex':
+        # T-Rex logs GPUs by their gpu_id rather than their position in the API result, so make the two differ
+        data['gpus'].reverse()
+    collector = COLLECTOR_CLASSES[miner](None)
+    collector.collect_body(time.time(), json.dumps(data).encode())
+    return collector
+
+
+def api_labels(collector) -> Dict[Optional[int], Dict[str, str]]:
+    # GPU number in the log -> labels of that GPU's own series (None -> the miner's)
+    labels = {}
+    for metric in collector.last_metrics:
+        for sample in metric.samples:
+            pci_id = sample.labels.get('device_pci_id')
+            gpu = next((gpu for gpu, gpu_pci_id in GPU_PCI_IDS.items() if gpu_pci_id == pci_id), None)
+            if pci_id is None or gpu is not None:
+                labels.setdefault(gpu, sample.labels)
+    return labels
+
+
+def exported(metrics: List[Metric], labels: Dict[Optional[int], Dict[str, str]]) -> Tuple[Dict, Dict]:
+    # What the log collector exports, in the shape of EXPECTED
+    gpus = {tuple(sorted(gpu_labels.items())): gpu for gpu, gpu_labels in labels.items()}
+    counts, buckets, sums = {}, defaultdict(list), {}
+    for metric in metrics:
+        for sample in metric.samples:
+            sample_labels = {name: value for name, value in sample.labels.items() if name != 'le'}
+            key = tuple(sorted(sample_labels.items()))
+            if key not in gpus:
+                raise AssertionError(f'{sample.name} has labels of no series of the miner: {sample_labels}')
+            gpu = gpus[key]
+            if sample.name.endswith('_total'):
+                counts[(metric.name, gpu)] = int(sample.value)
+            elif sample.name.endswith('_bucket'):
+                buckets[(metric.name, gpu)].append(int(sample.value))
+            elif sample.name.endswith('_sum'):
+                sums[(metric.name, gpu)] = round(sample.value, 6)
+    return counts, {key: (buckets[key], sums[key]) for key in buckets}
+
+
+def check_log_fixture(miner: str) -> None:
+    expected = EXPECTED[miner]
+    lines = (SAMPLE_LOG_DIR / f'{miner}.log').read_bytes().splitlines(keepends=True)
+    collector = api_collector(miner)
+    labels = api_labels(collector)
+    discovery = FixtureDiscovery()
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, f'{miner}.log')
+        state_file = pathlib.Path(directory) / 'offsets.json'
+        open(path, 'wb').close()
+        log_collector = MinerLogCollector(miner, path, COLLECTOR_CLASSES[miner], discovery, LogOffsets(state_file))
+        expect(log_collector.collect(), [], f'{miner} empty log')
+
+        # half the log, ending in half a line; nothing is exported before the miner's API has been read
+        half = len(lines) // 2
+        with open(path, 'ab') as log:
+            log.write(b''.join(lines[:half]) + lines[half][:10])
+        expect(log_collector.collect(), [], f'{miner} before the API was read')
+        discovery.collectors = [collector]
+        with open(path, 'ab') as log:
+            log.write(lines[half][10:] + b''.join(lines[half + 1:]))
+        counts, histograms = exported(log_collector.collect(), labels)
+        expect(counts, expected['counts'], f'{miner} counts')
+        expect(histograms,
+               {key: (buckets, round(total, 6)) for key, (buckets, total) in expected['histograms'].items()},
+               f'{miner} histograms')
+
+        # renamed away, with a line still written to the old file after the new one was created
+        replayed = expected['counts'][REPLAYED]
+        os.rename(path, path + '.1')
+        with open(path, 'wb') as log:
+            log.write(lines[-1] * 2)
+        with open(path + '.1', 'ab') as log:
+            log.write(lines[-1])
+        counts, _ = exported(log_collector.collect(), labels)
+        expect(counts[REPLAYED], replayed + 3, f'{miner} shares after a rename rotation')
+        expect(log_collector.follower.reopens, 1, f'{miner} reopens after a rename rotation')
+
+        # truncated in place and written again (copytruncate)
+        with open(path, 'wb') as log:
+            log.write(lines[-1])
+        counts, _ = exported(log_collector.collect(), labels)
+        expect(counts[REPLAYED], replayed + 4, f'{miner} shares after copytruncate')
+
+        # a restart resumes from the saved offset
+        with open(path, 'ab') as log:
+            log.write(lines[-1])
+        resumed = MinerLogCollector(miner, path, COLLECTOR_CLASSES[miner], discovery, LogOffsets(state_file))
+        expect(exported(resumed.collect(), labels)[0], {REPLAYED: 1}, f'{miner} counts resumed from the state file')
+
+        # without a saved offset, what's already in the log is left alone
+        fresh = MinerLogCollector(miner, path, COLLECTOR_CLASSES[miner], discovery, LogOffsets())
+        expect(exported(fresh.collect(), labels)[0], {}, f'{miner} counts of a log followed for the first time')
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    for miner in EXPECTED:
+        check_log_fixture(miner)
+        print(f'{miner}: OK')
@@ -0,0 +1,71 @@
+import argparse
+import gzip
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+
+class PushReceiver:
+    # Stand-in for a Pushgateway / import endpoint: keeps every pushed (decompressed) body, and can be switched off to
+    # simulate a dropped link
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.bodies: List[bytes] = []
+        self.requests = 0
+        self.up = True
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def _receive(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                receiver.requests += 1
+                if not receiver.up:
+                    self.send_response(503)
+                else:
+                    if self.headers.get('Content-Encoding') == 'gzip':
+                        body = gzip.decompress(body)
+                    receiver.bodies.append(body)
+                    self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            do_POST = do_PUT = _receive
+
+            def log_message(self, *_):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='push-receiver', daemon=True)
+
+    def url(self, path: str = '/api/v1/import/prometheus') -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}{path}'
+
+    def samples(self) -> List[bytes]:
+        return [line for body in self.bodies for line in body.splitlines() if line and not line.startswith(b'#')]
+
+    def __enter__(self) -> 'PushReceiver':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Receive pushes from the collector and print what arrives')
+    parser.add_argument('--port', type=int, default=8428)
+    args = parser.parse_args()
+
+    with PushReceiver(port=args.port) as push_receiver:
+        print(f'Receiving pushes at {push_receiver.url()}')
+        seen = 0
+        while not threading.Event().wait(5):
+            samples = push_receiver.samples()
+            print(f'{push_receiver.requests} requests, {len(samples)} samples (+{len(samples) - seen})')
+            seen = len(samples)
@@ -0,0 +1,104 @@
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main  # sets up the lib path
+
+from prometheus_client.core import Metric
+
+from gpu_telemetry_collector import GpuTelemetryCollector
+
+
+SAMPLE_SYSFS = pathlib.Path(__file__).parent / 'sysfs'
+AMD_DEVICE = 'devices/pci0000:00/0000:00:01.1/0000:07:00.0'
+NVIDIA_DEVICE = 'devices/pci0000:00/0000:00:03.1/0000:08:00.0'
+
+# What the fake sysfs tree in bench/sysfs holds: an amdgpu card with labelled sensors, a nouveau card without labels,
+# a GPU that isn't on PCI (left out, its PCI ID can't be matched to the miner metrics) and a connector (not a card)
+EXPECTED = {
+    '07:00': {
+        'mining_gpu_telemetry_temperature_core': 54.0,
+        'mining_gpu_telemetry_temperature_junction': 61.0,
+        'mining_gpu_telemetry_temperature_memory': 70.0,
+        'mining_gpu_telemetry_power': 112.0,
+        'mining_gpu_telemetry_fan_speed_rpm': 1450.0,
+        'mining_gpu_telemetry_fan_speed': 40.0,
+        'mining_gpu_telemetry_clock_core': 1350000000.0,
+        'mining_gpu_telemetry_clock_memory': 1000000000.0,
+    },
+    '08:00': {
+        'mining_gpu_telemetry_temperature_core': 48.0,
+        'mining_gpu_telemetry_power': 95.5,
+        'mining_gpu_telemetry_fan_speed_rpm': 1200.0,
+    },
+}
+# hwmon attributes each card's reader keeps open
+OPEN_FILES = {'07:00': 9, '08:00': 3}
+
+
+def expect(actual, expected, what: str) -> None:
+    if actual != expected:
+        raise AssertionError(f'{what}: expected {expected!r}, got {actual!r}')
+
+
+def readings(metrics: List[Metric]) -> Dict[str, Dict[str, float]]:
+    # PCI ID -> metric name -> value
+    values = {}
+    for metric in metrics:
+        for sample in metric.samples:
+            values.setdefault(sample.labels['device_pci_id'], {})[sample.name] = round(sample.value, 6)
+    return values
+
+
+def open_files() -> int:
+    return len(os.listdir('/proc/self/fd'))
+
+
+def check_sysfs_fixture() -> None:
+    directory = tempfile.mkdtemp()
+    try:
+        sysfs_root = pathlib.Path(directory) / 'sys'
+        shutil.copytree(SAMPLE_SYSFS, sysfs_root, symlinks=True)
+        baseline = open_files()
+        collector = GpuTelemetryCollector(str(sysfs_root))
+        expect(readings(collector.collect()), EXPECTED, 'readings')
+        expect(open_files() - baseline, sum(OPEN_FILES.values()), 'files kept open')
+
+        # cards are listed again after a failed scrape, only the readers of PCI cards may be left open
+        for _ in range(3):
+            collector.reset()
+            expect(readings(collector.collect()), EXPECTED, 'readings after a reset')
+        expect(open_files() - baseline, sum(OPEN_FILES.values()), 'files kept open after resets')
+
+        # a card whose driver came up later is picked up once the card list is older than ttl_sec
+        shutil.copytree(sysfs_root / NVIDIA_DEVICE, sysfs_root / 'devices/pci0000:00/0000:00:03.1/0000:09:00.0',
+                        symlinks=True)
+        os.symlink('../../devices/pci0000:00/0000:00:03.1/0000:09:00.0/drm/card1', sysfs_root / 'class/drm/card3')
+        expect(sorted(readings(collector.collect())), ['07:00', '08:00'], 'cards within ttl_sec')
+        collector.ttl_sec = 0.0
+        expect(readings(collector.collect()), {**EXPECTED, '09:00': EXPECTED['08:00']}, 'readings of a new card')
+
+        # the reader of a card that's gone is closed, one whose hwmon directory changed (driver reload) is reopened
+        os.remove(sysfs_root / 'class/drm/card1')
+        os.rename(sysfs_root / AMD_DEVICE / 'hwmon/hwmon2', sysfs_root / AMD_DEVICE / 'hwmon/hwmon5')
+        (sysfs_root / AMD_DEVICE / 'hwmon/hwmon5/temp1_input').write_text('57000\n')
+        expect(readings(collector.collect()),
+               {'07:00': {**EXPECTED['07:00'], 'mining_gpu_telemetry_temperature_core': 57.0},
+                '09:00': EXPECTED['08:00']},
+               'readings after a card was removed and a driver reloaded')
+        expect(open_files() - baseline, sum(OPEN_FILES.values()), 'files kept open after cards changed')
+
+        collector.reset()
+        expect(open_files(), baseline, 'files open after the readers were closed')
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    check_sysfs_fixture()
+    print('sysfs: OK')
@@ -1,93 +1,254 @@
 import abc
 import requests
+import socket
+import threading
 import time
 import traceback
+import urllib3
 
-from functools import partial
-from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
-from typing import List, Dict, Callable
+from prometheus_client.core import Metric
+from typing import List, Dict, Optional
+from urllib.parse import urlsplit
 
 import transformers
 
-from metric_wrappers import WrMetric
+from change_detection import LabelCache, ResponseCache
+from cardinality_guard import CardinalityGuard
+from circuit_breaker import CircuitBreaker
+from derived_metrics import DerivedMetrics
+from descriptors import LabelPlan
+from gpu_config import GpuConfig
+from json_decoder import get_decoder
+from scrape_scope import ScrapeScope
+from self_metrics import API_REQUEST_DURATION, API_REQUEST_FAILURES, COLLECT_ERRORS, MINER_UP, SAMPLES_DROPPED, \
+    SAMPLES_EMITTED, phase
+
+
+DEFAULT_CONNECT_TIMEOUT_SEC = 1.0
+DEFAULT_READ_TIMEOUT_SEC = 5.0
+DEFAULT_POOL_MAXSIZE = 2
 
 
 class AbstractMinerCollector(abc.ABC):
     @abc.abstractmethod
-    def collect(self) -> List[WrMetric]:
+    def collect(self, scope: Optional[ScrapeScope] = None) -> List[Metric]:
         return []
 
-    def _create_metrics(self, metric_class, metric_descs, labels) -> List[WrMetric]:
-        return [WrMetric(
-            metric_class=metric_class,
-            name=name,
-            labels=labels,
-            **params,
-        ) for name, params in metric_descs.items()]
-
-    def create_counter_gauge_metrics(self,
-                                     counter_metrics_descs: Dict[str, Dict],
-                                     gauge_metrics_descs: Dict[str, Dict],
-                                     labels: List[str]) -> List[WrMetric]:
-        metrics = self._create_metrics(CounterMetricFamily, counter_metrics_descs, labels)
-        metrics.extend(self._create_metrics(GaugeMetricFamily, gauge_metrics_descs, labels))
-        return metrics
-
 
 class AbstractMinerJsonCollector(AbstractMinerCollector, abc.ABC):
-    def __init__(self, config: Dict):
-        if config:
-            gpus = config['gpus'].get(transformers.hostname(), {})
-            self._pci_to_gpu = {gpu['pci_id']: gpu for gpu in gpus}
-
-            addl_labels = set()
-            for _, gpu in self._pci_to_gpu.items():
-                gpu_addl_labels = gpu.get('addl_labels', {})
-                addl_labels.update(gpu_addl_labels.keys())
-            self._addl_labels = list(addl_labels)
-        else:
-            self._pci_to_gpu = None
-            self._addl_labels = []
-
-    def addl_gpu_labels_from_config(self, pci_id_func: Callable, value_path: str = None) -> Dict:
-        if not self._pci_to_gpu:
-            return {}
-
-        def transform(addl_label: str, gpu_dict: Dict, *_):
-            pci_id = pci_id_func(gpu_dict)
-            return self._pci_to_gpu[pci_id].get('addl_labels', {}).get(addl_label)
-
-        label_descs = {
-            addl_label: {
-                'transform': partial(transform, addl_label),
-            } for addl_label in self._addl_labels
-        }
-        if value_path:
-            for _, desc in label_descs.items():
-                desc['path'] = value_path
-
-        return label_descs
+    miner = 'unknown'
+
+    def __init__(self, config: Dict, target: Optional[Dict] = None, gpu_config: Optional[GpuConfig] = None):
+        # A target is a remote miner API from the `targets` section; without one the miner runs on this machine
+        target = target or {}
+        self._api_url = target.get('url')
+        self.host = target.get('host') or (urlsplit(self._api_url).hostname if self._api_url else
+                                           transformers.hostname())
+        self.target_labels = {'host': self.host} if target else {}
+        if 'platform' in target:
+            self.target_labels['platform'] = target['platform']
+        self.min_interval_sec = float(target.get('min_interval_sec', 0))
+        self._collected_at = None
+        self._extract_failing = False
+        self.last_metrics: List[Metric] = []
+
+        http_config = {**(config or {}).get('http', {}), **target.get('http', {})}
+        self.timeout = (
+            float(http_config.get('connect_timeout_sec', DEFAULT_CONNECT_TIMEOUT_SEC)),
+            float(http_config.get('read_timeout_sec', DEFAULT_READ_TIMEOUT_SEC)),
+        )
+        latency_budget_sec = http_config.get('latency_budget_sec')
+        self.latency_budget_sec = float(latency_budget_sec) if latency_budget_sec else None
+        if self.latency_budget_sec:
+            self.timeout = tuple(min(timeout, self.latency_budget_sec) for timeout in self.timeout)
+        self.session = self._create_session(int(http_config.get('pool_maxsize', DEFAULT_POOL_MAXSIZE)))
+        self.breaker = CircuitBreaker.from_config(self.host, self.miner, config)
+        self.change_detection = bool((config or {}).get('change_detection', {}).get('enabled', True))
+        self.response_cache = ResponseCache(self.miner, self.change_detection)
+        self.decode_json = get_decoder((config or {}).get('json', {}).get('decoder'))
+        self.derived = DerivedMetrics.from_config(config)
+        self.cardinality = CardinalityGuard.from_config(self.host, self.miner, config)
+
+        # without a shared (reloading) GPU config, this collector indexes the `gpus` section of its own config
+        self.gpu_config = gpu_config or GpuConfig.from_config(config)
+        self.gpus = self.gpu_config.index.host(self.host)
+
+    @staticmethod
+    def _create_session(pool_maxsize: int) -> requests.Session:
+        # Only one miner API is polled per collector, so a single kept-alive connection is enough. Retries are left off
+        # so a dead miner fails the scrape right away instead of stacking up connect timeouts.
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def refresh_gpu_config(self) -> None:
+        gpus = self.gpu_config.refresh().host(self.host)
+        if gpus is not self.gpus:
+            self.gpus = gpus
+            # a byte-identical response would otherwise keep the previous additional labels
+            self.response_cache.clear()
+
+    def target_label_plan(self, plan: LabelPlan) -> LabelPlan:
+        return plan.with_values(self.target_labels)
+
+    def label_cache(self, plan: LabelPlan, level: str) -> LabelCache:
+        return LabelCache(plan, self.miner, level, self.change_detection)
+
+    def count_dropped(self, dropped: int) -> None:
+        if dropped:
+            SAMPLES_DROPPED.labels(self.host, self.miner).inc(dropped)
 
     @abc.abstractmethod
-    def json_collect(self, request_time: float, json_data):
+    def json_collect(self, request_time: float, json_data, scope: Optional[ScrapeScope] = None) -> List[Metric]:
         pass
 
     @property
     @abc.abstractmethod
-    def api_url(self):
+    def local_api_url(self) -> str:
         pass
 
-    def collect(self) -> List[WrMetric]:
-        try:
-            request_time = time.time()
-            result = requests.get(self.api_url).json()
-            return self.json_collect(request_time, result)
-        except:
-            # TODO better error handling
-            traceback.print_exc()
-            return []
+    @property
+    def api_url(self) -> str:
+        return self._api_url or self.local_api_url
+
+    def rate_limited(self) -> bool:
+        # A target scraped more often than its min_interval_sec gets its previous result instead of another API call
+        return bool(self.min_interval_sec) and self._collected_at is not None and \
+            time.monotonic() - self._collected_at < self.min_interval_sec
+
+    def _remember(self, metrics: List[Metric], scope: Optional[ScrapeScope]) -> List[Metric]:
+        # Only full results are kept for rate limited scrapes, scoped ones are a subset
+        if scope is None:
+            self.last_metrics = metrics
+            self._collected_at = time.monotonic()
+        return metrics
 
+    def _budget_timeout(self) -> urllib3.Timeout:
+        # `total` makes connecting and waiting for the headers share the budget, instead of each getting all of it
+        return urllib3.Timeout(connect=self.timeout[0], read=self.timeout[1], total=self.latency_budget_sec)
+
+    def _read_within_budget(self, response: requests.Response, deadline: float) -> bytes:
+        # Socket timeouts only bound each read, so a miner trickling out its response would pass every one of them and
+        # hold the scrape well past the budget: the connection is shut down once what's left of the budget is used up
+        connection = response.raw.connection
+        if connection is None or connection.sock is None:
+            return response.content
+        sock = connection.sock
+        expired = threading.Event()
+
+        def cut_off():
+            expired.set()
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+        watchdog = threading.Timer(max(0.0, deadline - time.monotonic()), cut_off)
+        watchdog.start()
+        try:
+            return response.content
+        except requests.RequestException as e:
+            # requests reports a read timing out mid-body as a connection error
+            if expired.is_set() or (e.args and isinstance(e.args[0], urllib3.exceptions.ReadTimeoutError)):
+                raise requests.Timeout(f'Latency budget of {self.latency_budget_sec}s exceeded') from e
+            raise
+        finally:
+            watchdog.cancel()
+            if expired.is_set():
+                response.close()
+
+    def fetch(self) -> bytes:
+        with API_REQUEST_DURATION.labels(self.host, self.miner).time(), phase('fetch', self.miner):
+            try:
+                if self.latency_budget_sec:
+                    deadline = time.monotonic() + self.latency_budget_sec
+                    response = self.session.get(self.api_url, timeout=self._budget_timeout(), stream=True)
+                    response.raise_for_status()
+                    return self._read_within_budget(response, deadline)
+                response = self.session.get(self.api_url, timeout=self.timeout)
+                response.raise_for_status()
+                return response.content
+            except requests.Timeout:
+                API_REQUEST_FAILURES.labels(self.host, self.miner, 'timeout').inc()
+                raise
+            except requests.ConnectionError:
+                API_REQUEST_FAILURES.labels(self.host, self.miner, 'connection').inc()
+                raise
+            except requests.RequestException:
+                API_REQUEST_FAILURES.labels(self.host, self.miner, 'http').inc()
+                raise
+
+    def collect(self, scope: Optional[ScrapeScope] = None) -> List[Metric]:
+        if self.rate_limited():
+            return self.last_metrics if scope is None else scope.filter(self.last_metrics)
+        if not self.breaker.allow():
+            return self.collect_skipped(scope)
+
+        request_time = time.time()
+        try:
+            body = self.fetch()
+        except Exception as e:
+            return self.collect_failed(e, scope)
+        return self.collect_body(request_time, body, scope)
 
-class NoSupportedMinerCollector(AbstractMinerCollector):
-    def collect(self) -> List[WrMetric]:
-        return []
+    def collect_body(self, request_time: float, body: bytes, scope: Optional[ScrapeScope] = None) -> List[Metric]:
+        try:
+            self.refresh_gpu_config()
+            metrics = self.response_cache.get(body, request_time)
+            if metrics is not None and scope is not None:
+                metrics = scope.filter(metrics)
+            elif metrics is None:
+                try:
+                    with phase('decode', self.miner):
+                        result = self.decode_json(body)
+                except Exception as e:
+                    # a body that isn't JSON is the API failing, as much as a bad status is
+                    return self.collect_failed(e, scope)
+                with phase('extract', self.miner):
+                    metrics = self.cardinality.apply(self.json_collect(request_time, result, scope), scope)
+                if scope is None:
+                    self.response_cache.put(body, metrics)
+            if self.derived and scope is None:
+                # derived from full results only, a scoped scrape may not include the families they are computed from
+                with phase('derive', self.miner):
+                    metrics = metrics + self.derived.derive(metrics, request_time)
+        except Exception as e:
+            return self.extract_failed(e, scope)
+
+        self._extract_failing = False
+        SAMPLES_EMITTED.labels(self.host, self.miner).inc(sum(len(metric.samples) for metric in metrics))
+        self.breaker.record_success()
+        MINER_UP.labels(self.host, self.miner).set(1)
+        return self._remember(metrics, scope)
+
+    def collect_skipped(self, scope: Optional[ScrapeScope] = None) -> List[Metric]:
+        MINER_UP.labels(self.host, self.miner).set(0)
+        return self._remember([], scope)
+
+    def collect_failed(self, e: Exception, scope: Optional[ScrapeScope] = None) -> List[Metric]:
+        first_failure = self.breaker.consecutive_failures == 0
+        if isinstance(e, (requests.ConnectionError, requests.Timeout, OSError)):
+            # Expected while the miner is starting or restarting, no need for a full traceback
+            if first_failure:
+                print(f'{self.miner} API unavailable at {self.api_url}: {e.__class__.__name__}')  # TODO logger, stderr
+        else:
+            # TODO better error handling
+            COLLECT_ERRORS.labels(self.host, self.miner, e.__class__.__name__).inc()
+            if first_failure:
+                traceback.print_exception(e)
+        self.breaker.record_failure()
+        MINER_UP.labels(self.host, self.miner).set(0)
+        return self._remember([], scope)
+
+    def extract_failed(self, e: Exception, scope: Optional[ScrapeScope] = None) -> List[Metric]:
+        # The miner API answered, but its result couldn't be turned into metrics (e.g. a field missing after a miner
+        # update). Backing off or reporting the miner down wouldn't be right, the next response won't be any better.
+        COLLECT_ERRORS.labels(self.host, self.miner, e.__class__.__name__).inc()
+        if not self._extract_failing:
+            traceback.print_exception(e)
+        self._extract_failing = True
+        self.breaker.record_success()
+        MINER_UP.labels(self.host, self.miner).set(1)
+        return self._remember([], scope)
@@ -0,0 +1,282 @@
+import asyncio
+import socket
+import ssl
+import time
+import traceback
+
+from prometheus_client import REGISTRY, generate_latest
+from prometheus_client.exposition import CONTENT_TYPE_LATEST
+from prometheus_client.core import Metric
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from abstract_miner_collector import AbstractMinerJsonCollector
+from metric_wrappers import merge_metric_families
+from miner_discovery import MinerTargets
+from scoped_exposition import encode_scoped
+from scrape_scope import GPU_PATH_PREFIX, ScrapeScope
+from self_metrics import API_REQUEST_DURATION, API_REQUEST_FAILURES, phase, profiled_scrape
+from snapshot_poller import DEFAULT_MAX_STALENESS_SEC, Snapshot
+
+
+DEFAULT_INTERVAL_SEC = 10.0
+MAX_HEADER_LINES = 100
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class HttpStatusError(Exception):
+    pass
+
+
+class AsyncHttpClient:
+    # Minimal keep-alive HTTP/1.1 GET client on asyncio streams, enough for the miner APIs
+    def __init__(self, url: str, connect_timeout_sec: float, read_timeout_sec: float):
+        split = urlsplit(url)
+        if split.scheme not in DEFAULT_PORTS:
+            raise ValueError(f'Unsupported scheme in miner API URL {url!r}, expected one of {sorted(DEFAULT_PORTS)}')
+        self.host = split.hostname
+        self.port = split.port or DEFAULT_PORTS[split.scheme]
+        # verified against the system CAs, as requests does for the threaded engine
+        self.ssl = ssl.create_default_context() if split.scheme == 'https' else None
+        self.target = (split.path or '/') + (f'?{split.query}' if split.query else '')
+        self.connect_timeout_sec = connect_timeout_sec
+        self.read_timeout_sec = read_timeout_sec
+        self._request = (f'GET {self.target} HTTP/1.1\r\n'
+                         f'Host: {self.host}:{self.port}\r\n'
+                         'Accept: application/json\r\n'
+                         'Connection: keep-alive\r\n\r\n').encode()
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def get(self) -> bytes:
+        reused = self._writer is not None
+        try:
+            return await self._get()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+        # the miner closed the kept-alive connection since the last request, retry once on a new one
+        return await self._get()
+
+    async def _get(self) -> bytes:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.connect_timeout_sec)
+        self._writer.write(self._request)
+        await self._writer.drain()
+        try:
+            return await asyncio.wait_for(self._read_response(), self.read_timeout_sec)
+        except:
+            self.close()
+            raise
+
+    async def _read_response(self) -> bytes:
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by miner API')
+        status = int(status_line.split(b' ', 2)[1])
+
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self._reader.readline()).split(b';', 1)[0], 16)
+                if size == 0:
+                    await self._reader.readline()
+                    break
+                chunks.append(await self._reader.readexactly(size))
+                await self._reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await self._reader.readexactly(int(headers['content-length']))
+        else:
+            body = await self._reader.read()
+            self.close()
+
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        if status >= 400:
+            raise HttpStatusError(f'Miner API returned HTTP {status}')
+        return body
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+
+class AsyncEngine:
+    # Polls every miner concurrently from a single event loop and serves the latest snapshot from an asyncio HTTP
+    # server, so concurrent scrapers don't each need an OS thread or a miner API call
+    def __init__(self, mining_collector, interval_sec: float, max_staleness_sec: float):
+        self.mining_collector = mining_collector
+        self.interval_sec = interval_sec
+        self.max_staleness_sec = max_staleness_sec
+        self._snapshot: Optional[Snapshot] = None
+        self._clients: Dict[AbstractMinerJsonCollector, AsyncHttpClient] = {}
+        self._rendered: Tuple[Optional[Snapshot], bytes] = (None, b'')
+
+    @staticmethod
+    def from_config(mining_collector, config: Optional[Dict]) -> 'AsyncEngine':
+        polling_config = (config or {}).get('polling', {})
+        interval_sec = float(polling_config.get('interval_sec') or DEFAULT_INTERVAL_SEC)
+        max_staleness_sec = float(polling_config.get('max_staleness_sec', max(DEFAULT_MAX_STALENESS_SEC,
+                                                                              interval_sec * 3)))
+        engine = AsyncEngine(mining_collector, interval_sec, max_staleness_sec)
+        if isinstance(mining_collector.discovery, MinerTargets):
+            # so a target URL the client can't handle fails at startup rather than on every poll
+            for collector in mining_collector.discovery.collectors:
+                engine._client(collector)
+        return engine
+
+    @property
+    def latest(self) -> Optional[Snapshot]:
+        return self._snapshot
+
+    @property
+    def snapshot(self) -> Optional[Snapshot]:
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.age_sec > self.max_staleness_sec:
+            return None
+        return snapshot
+
+    def _client(self, collector: AbstractMinerJsonCollector) -> AsyncHttpClient:
+        client = self._clients.get(collector)
+        if client is None:
+            connect_timeout_sec, read_timeout_sec = collector.timeout
+            client = AsyncHttpClient(collector.api_url, connect_timeout_sec, read_timeout_sec)
+            self._clients[collector] = client
+        return client
+
+    def _close_stale_clients(self, collectors: List) -> None:
+        for collector in [collector for collector in self._clients if collector not in collectors]:
+            self._clients.pop(collector).close()
+
+    async def _fetch(self, collector: AbstractMinerJsonCollector) -> bytes:
+        client = self._client(collector)
+        budget_sec = collector.latency_budget_sec or sum(collector.timeout)
+        with API_REQUEST_DURATION.labels(collector.host, collector.miner).time(), phase('fetch', collector.miner):
+            try:
+                return await asyncio.wait_for(client.get(), budget_sec)
+            except asyncio.TimeoutError:
+                client.close()
+                API_REQUEST_FAILURES.labels(collector.host, collector.miner, 'timeout').inc()
+                raise
+            except OSError:
+                API_REQUEST_FAILURES.labels(collector.host, collector.miner, 'connection').inc()
+                raise
+            except HttpStatusError:
+                API_REQUEST_FAILURES.labels(collector.host, collector.miner, 'http').inc()
+                raise
+
+    async def _collect(self, collector) -> List[Metric]:
+        if not isinstance(collector, AbstractMinerJsonCollector):
+            return await asyncio.get_running_loop().run_in_executor(None, collector.collect)
+        if collector.rate_limited():
+            return collector.last_metrics
+        if not collector.breaker.allow():
+            return collector.collect_skipped()
+
+        request_time = time.time()
+        try:
+            body = await self._fetch(collector)
+        except Exception as e:
+            return collector.collect_failed(e)
+        return collector.collect_body(request_time, body)
+
+    async def poll_once(self) -> None:
+        with profiled_scrape(), phase('collect'):
+            loop = asyncio.get_running_loop()
+            with phase('discovery'):
+                # psutil has no async API; the scan is usually a cache hit anyway
+                collectors = await loop.run_in_executor(None, self.mining_collector.find_collectors)
+            self._close_stale_clients(collectors)
+            metrics = list(self.mining_collector.discovery_metrics())
+            results = await asyncio.gather(*[self._collect(collector) for collector in collectors])
+            metrics.extend(merge_metric_families(metric for result in results for metric in result))
+        self._snapshot = Snapshot(metrics)
+
+    async def poll_forever(self) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                await self.poll_once()
+            except Exception:
+                # keep serving the previous snapshot until it goes stale
+                traceback.print_exc()
+            await asyncio.sleep(max(0.0, self.interval_sec - (time.monotonic() - started)))
+
+    def render(self) -> bytes:
+        # Rendered once per snapshot; the collector's own metrics in the registry lag by at most one poll. Past max
+        # staleness there is no snapshot, so every scrape renders (and serves no miner metrics) until a poll succeeds.
+        snapshot = self.snapshot
+        rendered_for, body = self._rendered
+        if snapshot is None or rendered_for is not snapshot:
+            body = generate_latest(REGISTRY)
+            if snapshot is not None:
+                self._rendered = (snapshot, body)
+        return body
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = request_line.rstrip().endswith(b'HTTP/1.1')
+                accept_encoding = ''
+                for _ in range(MAX_HEADER_LINES):
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    if line.lower().startswith(b'connection:'):
+                        keep_alive = b'close' not in line.lower()
+                    elif line.lower().startswith(b'accept-encoding:'):
+                        accept_encoding = line.decode('latin-1').partition(':')[2].strip()
+
+                parts = request_line.split(b' ')
+                path, _, query = (parts[1] if len(parts) > 1 else b'').decode('latin-1').partition('?')
+                extra_headers = b''
+                if parts[0] != b'GET' or not (path in ('/', '/metrics') or path.startswith(GPU_PATH_PREFIX)):
+                    status, content_type, body = b'404 Not Found', b'text/plain', b'Not Found\n'
+                else:
+                    scope = ScrapeScope.from_request(path, query)
+                    exposition = self.mining_collector.exposition
+                    if scope.unscoped and not exposition:
+                        status, content_type, body = b'200 OK', CONTENT_TYPE_LATEST.encode(), self.render()
+                    else:
+                        if scope.unscoped:
+                            # rendered and gzipped once per snapshot
+                            headers, body = exposition.encode(accept_encoding)
+                        else:
+                            # served from the snapshot, only the filtering happens per request
+                            snapshot = self.snapshot
+                            headers, body = encode_scoped(scope.filter(snapshot.metrics) if snapshot else [],
+                                                          accept_encoding=accept_encoding,
+                                                          renderer=exposition.renderer if exposition else None)
+                        status, content_type = b'200 OK', headers[0][1].encode()
+                        extra_headers = b''.join(b'%s: %s\r\n' % (name.encode(), value.encode())
+                                                 for name, value in headers[1:])
+                writer.write(b'HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n%s%s\r\n' % (
+                    status, content_type, len(body), extra_headers, b'' if keep_alive else b'Connection: close\r\n'))
+                writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, listen_socket: socket.socket) -> None:
+        server = await asyncio.start_server(self._handle, sock=listen_socket)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.poll_forever())
@@ -0,0 +1,204 @@
+import hashlib
+
+from functools import lru_cache
+from prometheus_client import Counter, Gauge
+from prometheus_client.core import Metric
+from prometheus_client.samples import Sample
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from scrape_scope import ScrapeScope
+
+
+PCI_ID_LABEL = 'device_pci_id'
+# Labels that identify a series, and that the info series are joined on; they can't be moved or hashed
+IDENTITY_LABELS = frozenset(['host', 'platform', 'miner', 'algorithm', 'worker', PCI_ID_LABEL])
+HASH_LENGTH = 12
+
+SERIES = Gauge(
+    'mining_collector_series',
+    'number of series in the last result from the miner',
+    ['host', 'miner'],
+)
+SERIES_CREATED = Counter(
+    'mining_collector_series_created',
+    'number of series that were not in the previous result from the miner',
+    ['host', 'miner'],
+)
+SERIES_REMOVED = Counter(
+    'mining_collector_series_removed',
+    'number of series from the previous result that are gone from the miner\'s latest result',
+    ['host', 'miner'],
+)
+SERIES_DROPPED = Counter(
+    'mining_collector_series_dropped',
+    'number of samples not exported because the miner\'s series budget was used up',
+    ['host', 'miner'],
+)
+
+
+@lru_cache(maxsize=1024)
+def hash_label_value(value: str) -> str:
+    return hashlib.blake2b(value.encode(), digest_size=HASH_LENGTH // 2).hexdigest()
+
+
+@lru_cache(maxsize=1024)
+def cap_label_value(value: str, max_length: int) -> str:
+    # Long values keep a readable prefix; the hash keeps distinct values distinct
+    if len(value) <= max_length:
+        return value
+    return f'{value[:max(0, max_length - HASH_LENGTH - 1)]}~{hash_label_value(value)}'
+
+
+class CardinalityGuard:
+    # Runs on a collector's extracted families. Volatile labels move to one `mining_miner_info`/`mining_gpu_info`
+    # series per miner/GPU, long values are capped or hashed, and label sets beyond the series budget are dropped
+    # (the ones seen before are kept first). Series counts and churn are tracked per miner.
+    def __init__(self,
+                 host: str,
+                 miner: str,
+                 info_labels: Sequence[str] = (),
+                 hashed_labels: Sequence[str] = (),
+                 max_label_length: Optional[int] = None,
+                 series_budget: Optional[int] = None
+                 ):
+        reserved = IDENTITY_LABELS & (set(info_labels) | set(hashed_labels))
+        if reserved:
+            raise ValueError(f'Identity labels can\'t be moved to info series or hashed: {sorted(reserved)}')
+        self.info_labels = frozenset(info_labels)
+        self.hashed_labels = frozenset(hashed_labels)
+        self.max_label_length = max_label_length
+        self.series_budget = series_budget
+        self.relabels = bool(self.info_labels or self.hashed_labels or max_label_length)
+        self._series: Dict[Tuple[str, ...], int] = {}
+
+        self._series_gauge = SERIES.labels(host, miner)
+        self._created = SERIES_CREATED.labels(host, miner)
+        self._removed = SERIES_REMOVED.labels(host, miner)
+        self._dropped = SERIES_DROPPED.labels(host, miner)
+
+    @staticmethod
+    def from_config(host: str, miner: str, config: Optional[Dict]) -> 'CardinalityGuard':
+        cardinality_config = (config or {}).get('cardinality', {})
+        max_label_length = cardinality_config.get('max_label_length')
+        series_budget = cardinality_config.get('series_budget')
+        return CardinalityGuard(host, miner,
+                                info_labels=cardinality_config.get('info_labels') or (),
+                                hashed_labels=cardinality_config.get('hashed_labels') or (),
+                                max_label_length=int(max_label_length) if max_label_length else None,
+                                series_budget=int(series_budget) if series_budget else None)
+
+    def _value(self, name: str, value: str) -> str:
+        if name in self.hashed_labels:
+            return hash_label_value(value)
+        if self.max_label_length:
+            return cap_label_value(value, self.max_label_length)
+        return value
+
+    def _relabel(self, labels: Dict[str, str]) -> Tuple[Dict[str, str], Dict[str, str]]:
+        kept, info = {}, {}
+        for name, value in labels.items():
+            (info if name in self.info_labels else kept)[name] = self._value(name, value)
+        return kept, info
+
+    def apply(self, metrics: List[Metric], scope: Optional[ScrapeScope] = None) -> List[Metric]:
+        # Samples of a label set share one labels dict, so the work here is per label set rather than per sample.
+        # Scoped scrapes only see part of the series: they aren't counted, and are held to the last full result.
+        label_sets: Dict[int, Tuple[Dict[str, str], Dict[str, str]]] = {}
+        counts: Dict[int, int] = {}
+        for family in metrics:
+            for sample in family.samples:
+                labels_id = id(sample.labels)
+                if labels_id in counts:
+                    counts[labels_id] += 1
+                else:
+                    counts[labels_id] = 1
+                    label_sets[labels_id] = self._relabel(sample.labels) if self.relabels else (sample.labels, {})
+
+        admitted = self._admit(label_sets, counts) if scope is None else self._admit_scoped(label_sets, counts)
+        if not self.relabels and admitted is None:
+            return metrics
+
+        guarded = []
+        for family in metrics:
+            copied = Metric(family.name, family.documentation, family.type, family.unit)
+            copied.samples = [Sample(sample.name, label_sets[id(sample.labels)][0], sample.value, sample.timestamp,
+                                     sample.exemplar)
+                              for sample in family.samples if admitted is None or id(sample.labels) in admitted]
+            guarded.append(copied)
+        if self.info_labels:
+            info_families = self._info_families(metrics, label_sets, admitted)
+            guarded.extend(info_families if scope is None else scope.filter(info_families))
+        return guarded
+
+    def _admit(self, label_sets: Dict, counts: Dict[int, int]) -> Optional[set]:
+        series, ids_by_key = {}, {}
+        for labels_id, (kept, _) in label_sets.items():
+            key = tuple(kept.items())
+            series[key] = series.get(key, 0) + counts[labels_id]
+            ids_by_key.setdefault(key, []).append(labels_id)
+
+        admitted_keys = series
+        if self.series_budget and sum(series.values()) > self.series_budget:
+            # label sets that were exported before keep their place, new ones get what's left of the budget
+            admitted_keys, total = {}, 0
+            for key in sorted(series, key=lambda key: key not in self._series):
+                if total + series[key] <= self.series_budget:
+                    admitted_keys[key] = series[key]
+                    total += series[key]
+                else:
+                    self._dropped.inc(series[key])
+
+        previous = self._series
+        self._created.inc(sum(count for key, count in admitted_keys.items() if key not in previous))
+        self._removed.inc(sum(count for key, count in previous.items() if key not in admitted_keys))
+        self._series = admitted_keys
+        self._series_gauge.set(sum(admitted_keys.values()))
+
+        if admitted_keys is series:
+            return None
+        return {labels_id for key in admitted_keys for labels_id in ids_by_key[key]}
+
+    def _admit_scoped(self, label_sets: Dict, counts: Dict[int, int]) -> Optional[set]:
+        # The series the last full result admitted, and new ones as far as what it left of the budget goes (as the next
+        # full result would), so a scoped scrape can't get around the budget
+        if not self.series_budget:
+            return None
+        room = self.series_budget - sum(self._series.values())
+        admitted, new_series, new_ids = set(), {}, {}
+        for labels_id, (kept, _) in label_sets.items():
+            key = tuple(kept.items())
+            if key in self._series:
+                admitted.add(labels_id)
+            else:
+                new_series[key] = new_series.get(key, 0) + counts[labels_id]
+                new_ids.setdefault(key, []).append(labels_id)
+        for key, count in new_series.items():
+            if count <= room:
+                admitted.update(new_ids[key])
+                room -= count
+        return admitted
+
+    def _info_families(self, metrics: List[Metric], label_sets: Dict, admitted: Optional[set]) -> List[Metric]:
+        miner_info = Metric('mining_miner_info', 'miner labels that change too often to be on every series', 'gauge')
+        gpu_info = Metric('mining_gpu_info', 'GPU labels that change too often to be on every series', 'gauge')
+        timestamp = next((family.samples[0].timestamp for family in metrics if family.samples), None)
+
+        miner_label_names = set()
+        for kept, info in label_sets.values():
+            if PCI_ID_LABEL not in kept:
+                miner_label_names.update(kept, info)
+        seen = set()
+        for labels_id, (kept, info) in label_sets.items():
+            if (admitted is not None and labels_id not in admitted) or not info:
+                continue
+            family = gpu_info if PCI_ID_LABEL in kept else miner_info
+            if family is gpu_info:
+                # the miner-wide ones are already on the miner's info series
+                info = {name: value for name, value in info.items() if name not in miner_label_names}
+                if not info:
+                    continue
+            key = (family.name, tuple(kept.items()), tuple(info.items()))
+            if key not in seen:
+                seen.add(key)
+                family.samples.append(Sample(family.name, {**kept, **info}, 1.0, timestamp))
+        return [family for family in (miner_info, gpu_info) if family.samples]
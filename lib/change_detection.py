@@ -0,0 +1,87 @@
+import copy
+
+from prometheus_client import Counter
+from prometheus_client.core import Metric
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from descriptors import LabelPlan, label_as_str
+
+
+CHANGE_CACHE_HITS = Counter(
+    'mining_collector_change_cache_hits',
+    'number of times unchanged miner data let previously computed labels/samples be reused',
+    ['miner', 'level'],
+)
+CHANGE_CACHE_MISSES = Counter(
+    'mining_collector_change_cache_misses',
+    'number of times changed miner data had to be parsed again',
+    ['miner', 'level'],
+)
+
+
+class LabelCache:
+    # Remembers, per position (e.g. GPU index), the raw label inputs from the last scrape and the label values they
+    # produced. Labels that can only be computed from their whole base document are recomputed every time.
+    def __init__(self, plan: LabelPlan, miner: str, level: str, enabled: bool = True):
+        self.plan = plan
+        self.enabled = enabled
+        self._keyed = [index for index, label_input in enumerate(plan.inputs) if label_input is not None]
+        self._unkeyed = [index for index, label_input in enumerate(plan.inputs) if label_input is None]
+        self._entries: Dict[Hashable, Tuple[Tuple, Tuple[str, ...]]] = {}
+        self._hits = CHANGE_CACHE_HITS.labels(miner, level)
+        self._misses = CHANGE_CACHE_MISSES.labels(miner, level)
+
+    def values(self, base, i: int = None, key: Hashable = None) -> Tuple[str, ...]:
+        if not self.enabled or not self._keyed:
+            return self.plan.values(base, i)
+
+        lookups = self.plan.lookups
+        inputs = tuple([self.plan.inputs[index](base, i) for index in self._keyed])
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == inputs:
+            self._hits.inc()
+            keyed_values = entry[1]
+        else:
+            self._misses.inc()
+            keyed_values = tuple([label_as_str(lookups[index](base, i)) for index in self._keyed])
+            self._entries[key] = (inputs, keyed_values)
+
+        if not self._unkeyed:
+            return keyed_values
+        values = [None] * len(lookups)
+        for index, value in zip(self._keyed, keyed_values):
+            values[index] = value
+        for index in self._unkeyed:
+            values[index] = label_as_str(lookups[index](base, i))
+        return tuple(values)
+
+
+class ResponseCache:
+    # A byte-identical miner response produces the same samples, only the timestamps need updating
+    def __init__(self, miner: str, enabled: bool = True):
+        self.enabled = enabled
+        self._last: Optional[Tuple[bytes, List[Metric]]] = None
+        self._hits = CHANGE_CACHE_HITS.labels(miner, 'response')
+        self._misses = CHANGE_CACHE_MISSES.labels(miner, 'response')
+
+    def get(self, body: bytes, request_time: float) -> Optional[List[Metric]]:
+        last = self._last
+        if not self.enabled or last is None or last[0] != body:
+            if self.enabled:
+                self._misses.inc()
+            return None
+        self._hits.inc()
+
+        metrics = []
+        for family in last[1]:
+            restamped = copy.copy(family)
+            restamped.samples = [sample._replace(timestamp=request_time) for sample in family.samples]
+            metrics.append(restamped)
+        return metrics
+
+    def put(self, body: bytes, metrics: List[Metric]) -> None:
+        if self.enabled:
+            self._last = (body, metrics)
+
+    def clear(self) -> None:
+        self._last = None
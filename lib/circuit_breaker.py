@@ -0,0 +1,99 @@
+import threading
+import time
+
+from prometheus_client import Counter, Gauge
+from typing import Dict, Optional
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+STATE_VALUES = {
+    CLOSED: 0,
+    OPEN: 1,
+    HALF_OPEN: 2,
+}
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_BACKOFF_SEC = 5.0
+DEFAULT_MAX_BACKOFF_SEC = 300.0
+
+BREAKER_STATE = Gauge(
+    'mining_collector_breaker_state',
+    'miner API circuit breaker state (0 = closed, 1 = open, 2 = half open)',
+    ['host', 'miner'],
+)
+BREAKER_TRANSITIONS = Counter(
+    'mining_collector_breaker_transitions',
+    'number of miner API circuit breaker state changes',
+    ['host', 'miner', 'state'],
+)
+
+
+class CircuitBreaker:
+    # After `failure_threshold` consecutive failures the miner API is left alone for a back-off window that doubles
+    # (up to `max_backoff_sec`) each time a trial request after the window fails
+    def __init__(self,
+                 host: str,
+                 miner: str,
+                 failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 backoff_sec: float = DEFAULT_BACKOFF_SEC,
+                 max_backoff_sec: float = DEFAULT_MAX_BACKOFF_SEC
+                 ):
+        self.host = host
+        self.miner = miner
+        self.failure_threshold = failure_threshold
+        self.backoff_sec = backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._current_backoff_sec = backoff_sec
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+        BREAKER_STATE.labels(host, miner).set(STATE_VALUES[CLOSED])
+
+    @staticmethod
+    def from_config(host: str, miner: str, config: Optional[Dict]) -> 'CircuitBreaker':
+        breaker_config = (config or {}).get('breaker', {})
+        return CircuitBreaker(
+            host,
+            miner,
+            failure_threshold=int(breaker_config.get('failure_threshold', DEFAULT_FAILURE_THRESHOLD)),
+            backoff_sec=float(breaker_config.get('backoff_sec', DEFAULT_BACKOFF_SEC)),
+            max_backoff_sec=float(breaker_config.get('max_backoff_sec', DEFAULT_MAX_BACKOFF_SEC)),
+        )
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        self.state = state
+        BREAKER_STATE.labels(self.host, self.miner).set(STATE_VALUES[state])
+        BREAKER_TRANSITIONS.labels(self.host, self.miner, state).inc()
+        print(f'{self.miner} API on {self.host} circuit breaker {state}')  # TODO logger, stderr
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self._open_until:
+                # let a single trial request through
+                self._transition(HALF_OPEN)
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self._current_backoff_sec = self.backoff_sec
+            self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN:
+                self._current_backoff_sec = min(self._current_backoff_sec * 2, self.max_backoff_sec)
+            elif self.consecutive_failures < self.failure_threshold:
+                return
+            self._open_until = time.monotonic() + self._current_backoff_sec
+            self._transition(OPEN)
@@ -0,0 +1,263 @@
+import math
+import threading
+
+from array import array
+from collections import OrderedDict
+from prometheus_client.core import Metric
+from prometheus_client.samples import Sample
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+DEFAULT_WINDOW_SEC = 300.0
+DEFAULT_WINDOW_SIZE = 32
+
+# `ratio`: numerator / denominator family, from the latest scrape or (`windowed`) summed over the window
+# `rate`: increase of a counter family per minute over the window
+# `share_of`: increase of the first counter family over the increase of all of them, over the window
+DERIVED_GAUGE_METRICS = OrderedDict(
+    hashrate_per_watt = {
+        'desc': 'hashrate per watt of GPU power, from the miner hashrate and the summed GPU power',
+        'ratio': ('hashrate', 'gpu_power_sum'),
+    },
+    shares_accepted_per_min = {
+        'desc': 'accepted shares per minute over the rolling window',
+        'rate': 'shares_accepted',
+    },
+    shares_rejected_per_min = {
+        'desc': 'rejected shares per minute over the rolling window',
+        'rate': 'shares_rejected',
+    },
+    shares_rejected_ratio = {
+        'desc': 'fraction of the shares submitted over the rolling window that were rejected',
+        'share_of': ('shares_rejected', 'shares_accepted'),
+    },
+    gpu_hashrate_per_watt = {
+        'desc': 'GPU hashrate per watt of GPU power',
+        'ratio': ('gpu_hashrate', 'gpu_power'),
+    },
+    gpu_hashrate_per_watt_avg = {
+        'desc': 'GPU hashrate per watt of GPU power over the rolling window',
+        'ratio': ('gpu_hashrate', 'gpu_power'),
+        'windowed': True,
+    },
+    gpu_shares_accepted_per_min = {
+        'desc': 'GPU accepted shares per minute over the rolling window',
+        'rate': 'gpu_shares_accepted',
+    },
+    gpu_shares_rejected_per_min = {
+        'desc': 'GPU rejected shares per minute over the rolling window',
+        'rate': 'gpu_shares_rejected',
+    },
+    gpu_shares_rejected_ratio = {
+        'desc': 'fraction of the GPU\'s shares submitted over the rolling window that were rejected',
+        'share_of': ('gpu_shares_rejected', 'gpu_shares_accepted'),
+    },
+)
+DERIVED_DESC_KEYS = frozenset(['desc', 'ratio', 'rate', 'share_of', 'windowed'])
+
+# Families summed over all of a miner's samples, e.g. to relate the miner hashrate to the power of all of its GPUs
+SUMMED_SOURCES = {
+    'gpu_power_sum': 'gpu_power',
+}
+COUNTER_KINDS = frozenset(['rate', 'share_of'])
+
+
+class RollingWindow:
+    # Ring of the last `capacity` scrapes of one label set: a timestamp plus one column per source family, in flat
+    # arrays so the memory per label set is fixed. Missing values are NaN.
+    def __init__(self, capacity: int, columns: int):
+        self.capacity = capacity
+        self.columns = columns
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.values = array('d', [math.nan]) * (capacity * columns)
+        self.start = 0
+        self.count = 0
+
+    def clear(self) -> None:
+        self.start = 0
+        self.count = 0
+
+    def push(self, timestamp: float, row: Sequence[float]) -> None:
+        if self.count == self.capacity:
+            position = self.start
+            self.start = (self.start + 1) % self.capacity
+        else:
+            position = (self.start + self.count) % self.capacity
+            self.count += 1
+        self.timestamps[position] = timestamp
+        self.values[position * self.columns:(position + 1) * self.columns] = array('d', row)
+
+    def trim(self, oldest: float) -> None:
+        # The latest row is always kept
+        while self.count > 1 and self.timestamps[self.start] < oldest:
+            self.start = (self.start + 1) % self.capacity
+            self.count -= 1
+
+    def positions(self) -> range:
+        return range(self.start, self.start + self.count)
+
+    def at(self, position: int, column: int) -> float:
+        return self.values[(position % self.capacity) * self.columns + column]
+
+    def timestamp_at(self, position: int) -> float:
+        return self.timestamps[position % self.capacity]
+
+    def latest(self, column: int) -> float:
+        return self.at(self.start + self.count - 1, column)
+
+    def increase(self, column: int) -> Optional[Tuple[float, float]]:
+        # (increase, elapsed seconds) from the oldest row with a value in the column to the latest one
+        latest = self.start + self.count - 1
+        if math.isnan(self.at(latest, column)):
+            return None
+        for position in self.positions():
+            value = self.at(position, column)
+            if not math.isnan(value):
+                if position == latest:
+                    return None
+                return self.at(latest, column) - value, self.timestamp_at(latest) - self.timestamp_at(position)
+        return None
+
+    def sums(self, numerator: int, denominator: int) -> Tuple[float, float]:
+        numerator_sum = denominator_sum = 0.0
+        for position in self.positions():
+            numerator_value, denominator_value = self.at(position, numerator), self.at(position, denominator)
+            if not math.isnan(numerator_value) and not math.isnan(denominator_value):
+                numerator_sum += numerator_value
+                denominator_sum += denominator_value
+        return numerator_sum, denominator_sum
+
+
+class DerivedPlan:
+    def __init__(self, name: str, desc: str, kind: str, sources: Tuple[str, ...], windowed: bool = False):
+        self.name = name
+        self.full_name = f'mining_{name}'
+        self.desc = desc
+        self.kind = kind
+        self.sources = sources
+        self.windowed = windowed
+
+    def new_family(self) -> Metric:
+        return Metric(self.full_name, self.desc, 'gauge')
+
+
+def compile_derived_metrics(derived_descs: OrderedDict[str, Dict]) -> List[DerivedPlan]:
+    plans = []
+    for name, params in derived_descs.items():
+        unknown = params.keys() - DERIVED_DESC_KEYS
+        if unknown:
+            raise ValueError(f'Unknown descriptor keys for derived metric {name}: {sorted(unknown)}')
+        kinds = [kind for kind in ('ratio', 'rate', 'share_of') if kind in params]
+        if len(kinds) != 1:
+            raise ValueError(f'Derived metric {name} needs exactly one of ratio, rate or share_of')
+        sources = params[kinds[0]]
+        plans.append(DerivedPlan(name, params['desc'], kinds[0], (sources,) if isinstance(sources, str) else
+                                 tuple(sources), bool(params.get('windowed'))))
+    return plans
+
+
+DERIVED_PLANS = compile_derived_metrics(DERIVED_GAUGE_METRICS)
+
+
+class DerivedMetrics:
+    # Optional stage after extraction: keeps a rolling window per label set (the miner, each GPU) of the families the
+    # derived gauges are computed from, so efficiency and share rates don't have to be computed in PromQL
+    def __init__(self,
+                 plans: Sequence[DerivedPlan] = DERIVED_PLANS,
+                 window_sec: float = DEFAULT_WINDOW_SEC,
+                 window_size: int = DEFAULT_WINDOW_SIZE
+                 ):
+        self.plans = list(plans)
+        self.window_sec = window_sec
+        self.window_size = window_size
+        self.columns: Dict[str, int] = OrderedDict()
+        for plan in self.plans:
+            for source in plan.sources:
+                self.columns.setdefault(source, len(self.columns))
+        self.counter_columns = frozenset(self.columns[source] for plan in self.plans if plan.kind in COUNTER_KINDS
+                                         for source in plan.sources)
+        self.family_columns = {SUMMED_SOURCES.get(source, source): column for source, column in self.columns.items()
+                               if source not in SUMMED_SOURCES}
+        self.summed_columns = {SUMMED_SOURCES[source]: column for source, column in self.columns.items()
+                               if source in SUMMED_SOURCES}
+        self._windows: Dict[Tuple[str, ...], Tuple[Dict[str, str], RollingWindow]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_config(config: Optional[Dict]) -> Optional['DerivedMetrics']:
+        derived_config = (config or {}).get('derived_metrics', {})
+        if not derived_config.get('enabled'):
+            return None
+        return DerivedMetrics(window_sec=float(derived_config.get('window_sec', DEFAULT_WINDOW_SEC)),
+                              window_size=int(derived_config.get('window_size', DEFAULT_WINDOW_SIZE)))
+
+    def _rows(self, metrics: Sequence[Metric]) -> Dict[Tuple[str, ...], Tuple[Dict[str, str], List[float]]]:
+        rows = {}
+        sums = {column: 0.0 for column in self.summed_columns.values()}
+        for family in metrics:
+            name = family.name[len('mining_'):]
+            column = self.family_columns.get(name)
+            summed_column = self.summed_columns.get(name)
+            if column is None and summed_column is None:
+                continue
+            for sample in family.samples:
+                if column is not None:
+                    key = tuple(sample.labels.values())
+                    row = rows.get(key)
+                    if row is None:
+                        row = rows[key] = (sample.labels, [math.nan] * len(self.columns))
+                    row[1][column] = sample.value
+                if summed_column is not None:
+                    sums[summed_column] += sample.value
+        # Summed sources belong to every label set, they are only used where the rest of a ratio is present
+        for _, values in rows.values():
+            for column, total in sums.items():
+                values[column] = total
+        return rows
+
+    def _value(self, plan: DerivedPlan, window: RollingWindow) -> Optional[float]:
+        columns = [self.columns[source] for source in plan.sources]
+        if plan.kind == 'ratio':
+            if plan.windowed:
+                numerator, denominator = window.sums(*columns)
+            else:
+                numerator, denominator = window.latest(columns[0]), window.latest(columns[1])
+            if math.isnan(numerator) or math.isnan(denominator) or denominator <= 0:
+                return None
+            return numerator / denominator
+        increases = [window.increase(column) for column in columns]
+        if None in increases:
+            return None
+        if plan.kind == 'rate':
+            increase, elapsed = increases[0]
+            return increase * 60.0 / elapsed if elapsed > 0 else None
+        total = sum(increase for increase, _ in increases)
+        return increases[0][0] / total if total > 0 else 0.0
+
+    def derive(self, metrics: Sequence[Metric], timestamp: float) -> List[Metric]:
+        families = [plan.new_family() for plan in self.plans]
+        with self._lock:
+            rows = self._rows(metrics)
+            for key, (labels, values) in rows.items():
+                entry = self._windows.get(key)
+                if entry is None:
+                    entry = self._windows[key] = (labels, RollingWindow(self.window_size, len(self.columns)))
+                window = entry[1]
+                if window.count and any(values[column] < window.latest(column) for column in self.counter_columns):
+                    # a counter went backwards: the miner restarted
+                    window.clear()
+                window.push(timestamp, values)
+                window.trim(timestamp - self.window_sec)
+
+                for plan, family in zip(self.plans, families):
+                    value = self._value(plan, window)
+                    if value is not None:
+                        family.samples.append(Sample(plan.full_name, labels, value, timestamp))
+
+            if len(self._windows) > len(rows):
+                # label sets that disappeared (GPU removed, algorithm switched) are dropped once they age out
+                for key in [key for key, (_, window) in self._windows.items()
+                            if key not in rows and window.timestamp_at(window.start + window.count - 1) <
+                            timestamp - self.window_sec]:
+                    del self._windows[key]
+        return families
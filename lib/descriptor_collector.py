@@ -0,0 +1,223 @@
+from abstract_miner_collector import AbstractMinerJsonCollector
+from change_detection import LabelCache
+from descriptors import LabelPlan, MetricPlan, compile_counter_gauge_metrics, compile_labels, compile_path
+from gpu_config import HostGpus
+from metric_wrappers import MetricSchema
+from scrape_scope import ScrapeScope
+
+import re
+
+from collections import OrderedDict
+from functools import cached_property
+from prometheus_client.core import Metric
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+PCI_ID_LABEL = 'device_pci_id'
+UUID_LABEL = 'device_uuid'
+_CLASS_NAME_PART = re.compile(r'[^0-9a-zA-Z]+')
+
+
+class MinerDescriptor:
+    # A miner API as data: the process to look for, where its API is served, and the descriptor tables (in the
+    # MINER_LABELS/GPU_*_METRICS format) its documents are read with. Compiled once, then run by
+    # DescriptorMinerCollector like every other miner.
+    #
+    # GPUs are either a list of per-GPU documents (`gpus_path`, e.g. T-Rex's `gpus`), or addressed with `[i]` paths
+    # into the whole document, `gpu_count_path` being a list with one entry per GPU (e.g. lolMiner's `Workers`). With
+    # `algorithms_path`, every entry of that top-level list is read as if it were the first one, for dual mining.
+    def __init__(self,
+                 miner: str,
+                 process_name: str,
+                 api_url: Optional[str] = None,
+                 miner_labels: Optional[OrderedDict[str, Dict]] = None,
+                 miner_counter_metrics: Optional[OrderedDict[str, Dict]] = None,
+                 miner_gauge_metrics: Optional[OrderedDict[str, Dict]] = None,
+                 gpu_labels: Optional[OrderedDict[str, Dict]] = None,
+                 gpu_counter_metrics: Optional[OrderedDict[str, Dict]] = None,
+                 gpu_gauge_metrics: Optional[OrderedDict[str, Dict]] = None,
+                 gpus_path: Optional[str] = None,
+                 gpu_count_path: Optional[str] = None,
+                 algorithms_path: Optional[str] = None
+                 ):
+        if gpus_path and gpu_count_path:
+            raise ValueError(f'Miner {miner} can have either gpus_path or gpu_count_path, not both')
+        if algorithms_path and not re.fullmatch(r'[^.\[\]]+', algorithms_path):
+            raise ValueError(f'Miner {miner} algorithms_path must be a top-level key: {algorithms_path!r}')
+        self.miner = miner
+        self.process_name = process_name.lower()
+        self.api_url = api_url
+        self.miner_label_plan = compile_labels(miner_labels or OrderedDict())
+        self.miner_metric_plans = compile_counter_gauge_metrics(miner_counter_metrics or OrderedDict(),
+                                                                miner_gauge_metrics or OrderedDict())
+        self.gpu_label_plan = compile_labels(gpu_labels or OrderedDict())
+        # additional labels from the `gpus` config are matched on the PCI ID (and UUID) the GPUs are labelled with
+        self.pci_id_index = self._label_index(PCI_ID_LABEL)
+        self.uuid_index = self._label_index(UUID_LABEL)
+        self.gpu_metric_plans = compile_counter_gauge_metrics(gpu_counter_metrics or OrderedDict(),
+                                                              gpu_gauge_metrics or OrderedDict())
+
+        self.gpus_at = compile_path(gpus_path) if gpus_path else None
+        self.gpu_count_at = compile_path(gpu_count_path) if gpu_count_path else None
+        self.algorithms_path = algorithms_path
+        self.miner_algorithm_indexes = self._algorithm_indexes(self.miner_metric_plans)
+        self.gpu_algorithm_indexes = self._algorithm_indexes(self.gpu_metric_plans)
+
+    def _label_index(self, name: str) -> Optional[int]:
+        return self.gpu_label_plan.names.index(name) if name in self.gpu_label_plan.names else None
+
+    def _algorithm_indexes(self, plans: List[MetricPlan]) -> Optional[List[int]]:
+        if not self.algorithms_path:
+            return None
+        prefix = f'{self.algorithms_path}['
+        return [index for index, plan in enumerate(plans) if plan.value_path.startswith(prefix)]
+
+    def algorithm_views(self, json_data) -> Iterator[Tuple[int, Any]]:
+        # The descriptor tables address the algorithm as `<algorithms_path>[0]`; a shallow copy with that entry swapped
+        # out lets the same compiled tables read any of the dual-mining algorithms
+        yield 0, json_data
+        if not self.algorithms_path:
+            return
+        algorithms = json_data.get(self.algorithms_path) or []
+        for algorithm_index in range(1, len(algorithms)):
+            view = dict(json_data)
+            view[self.algorithms_path] = [algorithms[algorithm_index]]
+            yield algorithm_index, view
+
+    def gpu_bases(self, data) -> Iterator[Tuple[Any, Optional[int]]]:
+        # (base document, GPU index for `[i]` paths) per GPU
+        if self.gpus_at:
+            for gpu in self.gpus_at(data):
+                yield gpu, None
+        elif self.gpu_count_at:
+            for i in range(len(self.gpu_count_at(data))):
+                yield data, i
+
+    @property
+    def class_name(self) -> str:
+        return ''.join(part.capitalize() for part in _CLASS_NAME_PART.split(self.miner)) + 'Collector'
+
+
+class LastLabels:
+    # The label values of the last parsed response (first algorithm), for sources that label their samples like this
+    # miner's own, e.g. the log tailer
+    __slots__ = ('miner_names', 'miner_values', 'gpu_names', 'gpu_values')
+
+    def __init__(self, miner_names: Tuple[str, ...], miner_values: Tuple[str, ...], gpu_names: Tuple[str, ...],
+                 gpu_values: List[Tuple[str, ...]]):
+        self.miner_names = miner_names
+        self.miner_values = miner_values
+        self.gpu_names = gpu_names
+        self.gpu_values = gpu_values
+
+
+class DescriptorMinerCollector(AbstractMinerJsonCollector):
+    # The one extraction engine: runs any MinerDescriptor, built in (trex_collector, lolminer_collector) or loaded
+    # from a data file by the miner registry
+    descriptor: MinerDescriptor = None
+    _gpu_layout: Optional[Tuple[HostGpus, MetricSchema]] = None
+    # Log lines the log tailer looks for, by event (see log_tailer.LOG_EVENTS), and the GPU label the GPU numbers in
+    # the log refer to (the GPU's position in the API response when unset)
+    log_patterns: Optional[Dict[str, str]] = None
+    log_gpu_label: Optional[str] = None
+    last_labels: Optional[LastLabels] = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.descriptor is not None:
+            cls.miner = cls.descriptor.miner
+
+    @staticmethod
+    def for_descriptor(descriptor: MinerDescriptor, **attributes) -> type['DescriptorMinerCollector']:
+        return type(descriptor.class_name, (DescriptorMinerCollector,), {'descriptor': descriptor, **attributes})
+
+    @property
+    def local_api_url(self) -> str:
+        if not self.descriptor.api_url:
+            raise ValueError(f'{self.miner} has no local API URL, it can only be polled as a target')
+        return self.descriptor.api_url
+
+    @cached_property
+    def miner_label_plan(self) -> LabelPlan:
+        return self.target_label_plan(self.descriptor.miner_label_plan)
+
+    @property
+    def gpu_label_plan(self) -> LabelPlan:
+        return self.descriptor.gpu_label_plan
+
+    @cached_property
+    def miner_schema(self) -> MetricSchema:
+        return MetricSchema(self.descriptor.miner_metric_plans, self.descriptor.miner_label_plan.names)
+
+    def gpu_layout(self) -> Tuple[HostGpus, MetricSchema]:
+        # The GPU schema ends with the host's additional labels from the GPU config; they're read together so a
+        # reload during a scrape can't mix the two up
+        gpus, layout = self.gpus, self._gpu_layout
+        if layout is None or layout[0] is not gpus:
+            if layout is not None and layout[0].label_names == gpus.label_names:
+                schema = layout[1]
+            else:
+                schema = MetricSchema(self.descriptor.gpu_metric_plans, self.descriptor.miner_label_plan.names +
+                                      self.gpu_label_plan.names + gpus.label_names)
+            layout = self._gpu_layout = (gpus, schema)
+        return layout
+
+    @property
+    def gpu_schema(self) -> MetricSchema:
+        return self.gpu_layout()[1]
+
+    @cached_property
+    def miner_label_cache(self) -> LabelCache:
+        return self.label_cache(self.miner_label_plan, 'miner_labels')
+
+    @cached_property
+    def gpu_label_cache(self) -> LabelCache:
+        return self.label_cache(self.gpu_label_plan, 'gpu_labels')
+
+    def json_collect(self, request_time: float, json_data, scope: Optional[ScrapeScope] = None) -> List[Metric]:
+        descriptor = self.descriptor
+        gpus, gpu_schema = self.gpu_layout()
+        metrics = self.miner_schema.new_families()
+        gpu_metrics = gpu_schema.new_families()
+        dropped = 0
+        first_label_values, first_gpu_label_values = (), []
+
+        for algorithm_index, algorithm_data in descriptor.algorithm_views(json_data):
+            # Device-level metrics (clocks, temps, uptime, ...) are the same for every algorithm when dual mining, so
+            # they are only reported alongside the first algorithm
+            miner_indexes = None if algorithm_index == 0 else descriptor.miner_algorithm_indexes
+            gpu_indexes = None if algorithm_index == 0 else descriptor.gpu_algorithm_indexes
+            if scope:
+                # Out of scope families and GPUs are skipped before any value is read
+                miner_indexes = scope.miner_metric_indexes(self.miner_schema, miner_indexes)
+                gpu_indexes = scope.metric_indexes(gpu_schema, gpu_indexes)
+
+            label_values = self.miner_label_cache.values(algorithm_data, key=algorithm_index)
+            if algorithm_index == 0:
+                first_label_values = label_values
+            labels = self.miner_schema.labels_for(label_values)
+            dropped += self.miner_schema.add_values(metrics, algorithm_data, labels, request_time,
+                                                    indexes=miner_indexes)
+
+            for index, (base, i) in enumerate(descriptor.gpu_bases(algorithm_data)):
+                gpu_values = self.gpu_label_cache.values(base, i, key=(algorithm_index, index))
+                if gpus.label_names:
+                    gpu_values += gpus.addl_values(
+                        gpu_values[descriptor.pci_id_index] if descriptor.pci_id_index is not None else None,
+                        gpu_values[descriptor.uuid_index] if descriptor.uuid_index is not None else None)
+                gpu_label_values = label_values + gpu_values
+                if algorithm_index == 0:
+                    first_gpu_label_values.append(gpu_label_values)
+                if scope and not scope.wants_gpu(gpu_schema, gpu_label_values):
+                    continue
+                dropped += gpu_schema.add_values(gpu_metrics, base, gpu_schema.labels_for(gpu_label_values),
+                                                 request_time, i=i, indexes=gpu_indexes)
+        self.count_dropped(dropped)
+        self.last_labels = LastLabels(self.miner_schema.label_names, first_label_values, gpu_schema.label_names,
+                                      first_gpu_label_values)
+
+        if scope:
+            return ScrapeScope.select(metrics, scope.miner_metric_indexes(self.miner_schema)) + \
+                ScrapeScope.select(gpu_metrics, scope.metric_indexes(gpu_schema))
+        metrics.extend(gpu_metrics)
+        return metrics
@@ -0,0 +1,198 @@
+import re
+
+from collections import OrderedDict
+from collections.abc import Callable
+from functools import cache
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+# Accessors take the base document and the current GPU index (or None outside of GPU descriptors)
+Accessor = Callable[[Any, Optional[int]], Any]
+
+_PATH_SEGMENT = re.compile(r'^([^\[\]]+)((?:\[(?:\d+|i)\])*)$')
+_PATH_INDEX = re.compile(r'\[(\d+|i)\]')
+
+# Marks a `[i]` segment that is filled in with the GPU index at lookup time
+GPU_INDEX = object()
+
+LABEL_DESC_KEYS = frozenset(['value', 'path', 'join', 'transform', 'coalesce'])
+METRIC_DESC_KEYS = frozenset(['desc', 'value_path', 'transform'])
+
+
+def parse_path(path: str) -> Tuple:
+    if path == '.':
+        return ()
+    keys = []
+    for segment in path.split('.'):
+        match = _PATH_SEGMENT.match(segment)
+        if not match:
+            raise ValueError(f'Invalid descriptor path: {path!r}')
+        keys.append(match[1])
+        for index in _PATH_INDEX.findall(match[2]):
+            keys.append(GPU_INDEX if index == 'i' else int(index))
+    return tuple(keys)
+
+
+@cache
+def compile_path(path: str) -> Accessor:
+    keys = parse_path(path)
+    if not keys:
+        return lambda base, i=None: base
+    if GPU_INDEX not in keys:
+        def access(base, i=None):
+            for key in keys:
+                base = base[key]
+            return base
+    else:
+        def access(base, i=None):
+            for key in keys:
+                base = base[i if key is GPU_INDEX else key]
+            return base
+    return access
+
+
+def compile_label(desc: Dict) -> Accessor:
+    unknown = desc.keys() - LABEL_DESC_KEYS
+    if unknown:
+        raise ValueError(f'Unknown label descriptor keys: {sorted(unknown)}')
+
+    if 'value' in desc:
+        value = desc['value']
+        lookup = lambda base, i=None: value
+    elif 'path' in desc:
+        lookup = compile_path(desc['path'])
+    else:
+        lookup = lambda base, i=None: base
+
+    if 'join' in desc:
+        join_paths = [compile_path(path) for path in desc['join']]
+        base_lookup = lookup
+
+        def lookup(base, i=None):
+            joined = base_lookup(base, i)
+            return ' '.join([path(joined, i) for path in join_paths])
+
+    if 'transform' in desc:
+        transform = desc['transform']
+        pre_transform = lookup
+
+        def lookup(base, i=None):
+            return transform(pre_transform(base, i))
+
+    if 'coalesce' in desc:
+        coalesced = [compile_label(desc_coalesced) for desc_coalesced in desc['coalesce']]
+        pre_coalesce = lookup
+
+        def lookup(base, i=None):
+            int_result = pre_coalesce(base, i)
+            for c_lookup in coalesced:
+                c_result = c_lookup(int_result, i)
+                if c_result is not None and (not isinstance(c_result, str) or len(c_result) > 0):
+                    return c_result
+            return None
+
+    return lookup
+
+
+def _constant_input(base, i=None):
+    return None
+
+
+def compile_label_input(desc: Dict) -> Optional[Accessor]:
+    # An accessor for the raw values a label is derived from (before join/transform/coalesce), assuming transforms are
+    # pure. Labels computed from their whole base document can't be keyed this cheaply and get None.
+    if 'value' in desc:
+        base_input = _constant_input
+    elif 'path' in desc:
+        base_input = compile_path(desc['path'])
+    else:
+        base_input = None
+
+    if 'join' in desc:
+        join_paths = [compile_path(path) for path in desc['join']]
+        base_lookup = base_input or compile_path('.')
+        return lambda base, i=None: tuple([path(base_lookup(base, i), i) for path in join_paths])
+
+    if 'coalesce' in desc:
+        coalesced = [compile_label_input(desc_coalesced) for desc_coalesced in desc['coalesce']]
+        if None in coalesced:
+            return None
+        base_lookup = base_input or compile_path('.')
+        return lambda base, i=None: tuple([c_input(base_lookup(base, i), i) for c_input in coalesced])
+
+    return base_input
+
+
+def label_as_str(value) -> str:
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+class LabelPlan:
+    def __init__(self, names: Sequence[str], lookups: Sequence[Accessor], inputs: Sequence[Optional[Accessor]]):
+        self.names = tuple(names)
+        self.lookups = tuple(lookups)
+        self.inputs = tuple(inputs)
+
+    def values(self, base, i: int = None) -> Tuple[str, ...]:
+        return tuple([label_as_str(lookup(base, i)) for lookup in self.lookups])
+
+    def extend(self, other: 'LabelPlan') -> 'LabelPlan':
+        return LabelPlan(self.names + other.names, self.lookups + other.lookups, self.inputs + other.inputs)
+
+    def with_values(self, values: Dict[str, Any]) -> 'LabelPlan':
+        # Pins labels to fixed values, e.g. the host label of a remote miner target
+        if not values:
+            return self
+        lookups = [compile_label({'value': values[name]}) if name in values else lookup
+                   for name, lookup in zip(self.names, self.lookups)]
+        inputs = [_constant_input if name in values else label_input
+                  for name, label_input in zip(self.names, self.inputs)]
+        return LabelPlan(self.names, lookups, inputs)
+
+    def __len__(self):
+        return len(self.names)
+
+
+def compile_labels(label_descs: OrderedDict[str, Dict]) -> LabelPlan:
+    return LabelPlan(label_descs.keys(),
+                     [compile_label(desc) for desc in label_descs.values()],
+                     [compile_label_input(desc) for desc in label_descs.values()])
+
+
+class MetricPlan:
+    def __init__(self,
+                 metric_class: type[GaugeMetricFamily] | type[CounterMetricFamily],
+                 name: str,
+                 desc: str,
+                 value_path: str,
+                 transform: Callable[[Any, ...], float | Optional[float]] = None
+                 ):
+        self.metric_class = metric_class
+        self.name = name
+        self.full_name = f'mining_{name}'
+        self.desc = desc
+        self.value_path = value_path
+        self.value_at = compile_path(value_path)
+        self.transform = transform
+
+
+def compile_metrics(metric_class, metric_descs: OrderedDict[str, Dict]) -> List[MetricPlan]:
+    plans = []
+    for name, params in metric_descs.items():
+        unknown = params.keys() - METRIC_DESC_KEYS
+        if unknown:
+            raise ValueError(f'Unknown descriptor keys for metric {name}: {sorted(unknown)}')
+        plans.append(MetricPlan(metric_class=metric_class, name=name, **params))
+    return plans
+
+
+def compile_counter_gauge_metrics(counter_metrics_descs: OrderedDict[str, Dict],
+                                  gauge_metrics_descs: OrderedDict[str, Dict]) -> List[MetricPlan]:
+    plans = compile_metrics(CounterMetricFamily, counter_metrics_descs)
+    plans.extend(compile_metrics(GaugeMetricFamily, gauge_metrics_descs))
+    return plans
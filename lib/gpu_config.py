@@ -0,0 +1,131 @@
+import os
+import pathlib
+import threading
+import time
+import traceback
+import yaml
+
+from prometheus_client import Counter
+from typing import Dict, List, Optional, Tuple
+
+from descriptors import label_as_str
+
+
+DEFAULT_CHECK_INTERVAL_SEC = 5.0
+
+GPU_CONFIG_RELOADS = Counter(
+    'mining_collector_gpu_config_reloads',
+    'number of times the gpus section was reloaded after config.yaml changed, by result (ok, failed)',
+    ['result'],
+)
+
+
+def normalize_pci_id(pci_id) -> str:
+    # An unquoted PCI ID like 10:00 is a base 60 integer to YAML (600); slots are below 60 so it can be turned back
+    if isinstance(pci_id, int):
+        return f'{pci_id // 60:02d}:{pci_id % 60:02d}'
+    return str(pci_id).lower()
+
+
+def normalize_uuid(uuid: str) -> str:
+    # nvidia-smi prefixes UUIDs with `GPU-`, miners mostly don't
+    uuid = str(uuid).lower()
+    return uuid[len('gpu-'):] if uuid.startswith('gpu-') else uuid
+
+
+class HostGpus:
+    # One host's `gpus` entries, each resolved to its additional label values (in `label_names` order) up front
+    def __init__(self, gpus: List[Dict]):
+        label_names = {}
+        for gpu in gpus:
+            label_names.update(dict.fromkeys(gpu.get('addl_labels') or {}))
+        self.label_names: Tuple[str, ...] = tuple(label_names)
+        self.missing = tuple([label_as_str(None)] * len(self.label_names))
+
+        self.by_pci_id: Dict[str, Tuple[str, ...]] = {}
+        self.by_uuid: Dict[str, Tuple[str, ...]] = {}
+        for gpu in gpus:
+            addl_labels = gpu.get('addl_labels') or {}
+            values = tuple([label_as_str(addl_labels.get(name)) for name in self.label_names])
+            if gpu.get('pci_id') is not None:
+                self.by_pci_id[normalize_pci_id(gpu['pci_id'])] = values
+            if gpu.get('uuid'):
+                self.by_uuid[normalize_uuid(gpu['uuid'])] = values
+
+    def addl_values(self, pci_id: Optional[str], uuid: Optional[str] = None) -> Tuple[str, ...]:
+        # The UUID follows a card moved to another slot; GPUs that aren't configured get `null`s rather than failing
+        if uuid and self.by_uuid:
+            values = self.by_uuid.get(normalize_uuid(uuid))
+            if values is not None:
+                return values
+        return self.by_pci_id.get(pci_id, self.missing) if pci_id else self.missing
+
+
+NO_GPUS = HostGpus([])
+
+
+class GpuIndex:
+    def __init__(self, gpus_config: Optional[Dict]):
+        self.hosts = {str(host): HostGpus(gpus or []) for host, gpus in (gpus_config or {}).items()}
+
+    def host(self, host: str) -> HostGpus:
+        return self.hosts.get(host, NO_GPUS)
+
+
+class GpuConfig:
+    # The current GpuIndex. With a config file, the file's mtime is checked at most every `check_interval_sec` and a
+    # changed `gpus` section is indexed in full before it replaces the current index, so readers see either the old or
+    # the new one. A file that fails to load keeps the previous index. Other sections still need a restart.
+    def __init__(self,
+                 index: GpuIndex,
+                 path: Optional[pathlib.Path] = None,
+                 check_interval_sec: float = DEFAULT_CHECK_INTERVAL_SEC
+                 ):
+        self.index = index
+        self.path = path
+        self.check_interval_sec = check_interval_sec
+        self._mtime = self._stat_mtime()
+        self._checked_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_config(config: Optional[Dict], path: Optional[pathlib.Path] = None) -> 'GpuConfig':
+        reload_config = (config or {}).get('gpu_config', {})
+        if not reload_config.get('reload', True):
+            path = None
+        return GpuConfig(GpuIndex((config or {}).get('gpus')), path,
+                         float(reload_config.get('check_interval_sec', DEFAULT_CHECK_INTERVAL_SEC)))
+
+    def _stat_mtime(self) -> Optional[int]:
+        if not self.path:
+            return None
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def refresh(self) -> GpuIndex:
+        if self.path and time.monotonic() - self._checked_at >= self.check_interval_sec and \
+                self._lock.acquire(blocking=False):
+            try:
+                self._checked_at = time.monotonic()
+                mtime = self._stat_mtime()
+                if mtime is not None and mtime != self._mtime:
+                    self._mtime = mtime
+                    self._reload()
+            finally:
+                self._lock.release()
+        return self.index
+
+    def _reload(self) -> None:
+        try:
+            with self.path.open('r') as f:
+                config = yaml.full_load(f)
+            index = GpuIndex((config or {}).get('gpus'))
+        except Exception:
+            GPU_CONFIG_RELOADS.labels('failed').inc()
+            traceback.print_exc()
+            return
+        self.index = index
+        GPU_CONFIG_RELOADS.labels('ok').inc()
+        print(f'Reloaded the gpus section of {self.path}')  # TODO logger, stderr
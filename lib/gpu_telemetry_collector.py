@@ -0,0 +1,248 @@
+import os
+import pathlib
+import re
+import time
+import traceback
+
+from collections import OrderedDict
+from prometheus_client.core import Metric
+from typing import Dict, List, Optional
+
+import transformers
+
+from abstract_miner_collector import AbstractMinerCollector
+from descriptors import compile_counter_gauge_metrics, compile_labels
+from metric_wrappers import MetricSchema, WrMetric
+from scrape_scope import ScrapeScope
+
+
+DEFAULT_SYSFS_ROOT = '/sys'
+DEFAULT_TTL_SEC = 300.0
+
+_CARD_NAME = re.compile(r'^card\d+$')
+_PCI_ADDRESS = re.compile(r'^[0-9a-fA-F]{4}:([0-9a-fA-F]{2}):([0-9a-fA-F]{2})\.[0-7]$')
+
+VENDORS = {
+    '0x10de': 'NVIDIA',
+    '0x1002': 'AMD',
+    '0x8086': 'Intel',
+}
+
+# reading key -> (hwmon attribute prefix, preferred `*_label` values, fallback attribute)
+LABELLED_ATTRIBUTES = OrderedDict(
+    temperature_core=('temp', ('edge', 'gpu'), 'temp1_input'),
+    temperature_junction=('temp', ('junction', 'hotspot'), None),
+    temperature_memory=('temp', ('mem', 'memory'), None),
+    clock_core=('freq', ('sclk',), 'freq1_input'),
+    clock_memory=('freq', ('mclk',), None),
+)
+PLAIN_ATTRIBUTES = OrderedDict(
+    power=('power1_average', 'power1_input'),
+    fan_rpm=('fan1_input',),
+    fan_pwm=('pwm1',),
+    fan_pwm_max=('pwm1_max',),
+)
+
+
+GPU_LABELS = OrderedDict(
+    host = {
+        'transform': transformers.hostname,
+    },
+    platform = {
+        'transform': transformers.mining_platform,
+    },
+    device_vendor = {
+        'path': 'vendor',
+    },
+    device_pci_id = {
+        'path': 'pci_id',
+    },
+    hwmon = {
+        'path': 'hwmon',
+    },
+)
+GPU_COUNTER_METRICS = OrderedDict()
+GPU_GAUGE_METRICS = OrderedDict(
+    gpu_telemetry_temperature_core = {
+        'desc': 'GPU core (edge) temperature read from hwmon',
+        'value_path': 'temperature_core',
+        'transform': transformers.mul(0.001),
+    },
+    gpu_telemetry_temperature_junction = {
+        'desc': 'GPU junction (hotspot) temperature read from hwmon',
+        'value_path': 'temperature_junction',
+        'transform': transformers.mul(0.001),
+    },
+    gpu_telemetry_temperature_memory = {
+        'desc': 'GPU memory temperature read from hwmon',
+        'value_path': 'temperature_memory',
+        'transform': transformers.mul(0.001),
+    },
+    gpu_telemetry_power = {
+        'desc': 'GPU power in watts read from hwmon',
+        'value_path': 'power',
+        'transform': transformers.mul(0.000001),
+    },
+    gpu_telemetry_fan_speed_rpm = {
+        'desc': 'GPU fan speed in RPM read from hwmon',
+        'value_path': 'fan_rpm',
+    },
+    gpu_telemetry_fan_speed = {
+        'desc': 'GPU fan speed in percent read from hwmon',
+        'value_path': '.',
+        'transform': lambda reading, *_: transformers.pwm_percent(reading['fan_pwm'], reading['fan_pwm_max']),
+    },
+    gpu_telemetry_clock_core = {
+        'desc': 'GPU core clock speed read from hwmon',
+        'value_path': 'clock_core',
+    },
+    gpu_telemetry_clock_memory = {
+        'desc': 'GPU memory clock speed read from hwmon',
+        'value_path': 'clock_memory',
+    },
+)
+
+GPU_LABEL_PLAN = compile_labels(GPU_LABELS)
+GPU_METRIC_PLANS = compile_counter_gauge_metrics(GPU_COUNTER_METRICS, GPU_GAUGE_METRICS)
+GPU_SCHEMA = MetricSchema(GPU_METRIC_PLANS, GPU_LABEL_PLAN.names)
+
+
+def _read_str(path: pathlib.Path) -> Optional[str]:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+
+def _device_pci_id(device_path: pathlib.Path) -> Optional[str]:
+    # only PCI devices have a bus:slot the miner metrics can be matched on
+    match = _PCI_ADDRESS.match(os.path.basename(os.path.realpath(device_path)))
+    return transformers.pcie_bus_slot_str_to_id(f'{match[1]}:{match[2]}').lower() if match else None
+
+
+def _hwmon_path(device_path: pathlib.Path) -> Optional[pathlib.Path]:
+    hwmon_dirs = sorted((device_path / 'hwmon').glob('hwmon*'))
+    return hwmon_dirs[0] if hwmon_dirs else None
+
+
+class HwmonReader:
+    # Keeps one raw file descriptor per hwmon attribute open and re-reads it in place with pread, so a scrape is a
+    # single syscall per value instead of open/read/close
+    def __init__(self, device_path: pathlib.Path, pci_id: str):
+        self.pci_id = pci_id
+        vendor = _read_str(device_path / 'vendor')
+        self.vendor = VENDORS.get(vendor, vendor)
+
+        self.hwmon_path = _hwmon_path(device_path)
+        self.hwmon = _read_str(self.hwmon_path / 'name') if self.hwmon_path else None
+        self._fds: Dict[str, int] = OrderedDict()
+        if self.hwmon_path:
+            self._open_attributes()
+
+    def _open(self, key: str, attribute: str) -> bool:
+        try:
+            self._fds[key] = os.open(self.hwmon_path / attribute, os.O_RDONLY)
+            return True
+        except OSError:
+            return False
+
+    def _open_attributes(self) -> None:
+        labels = {}
+        for label_path in self.hwmon_path.glob('*_label'):
+            labels[_read_str(label_path)] = label_path.name[:-len('_label')] + '_input'
+
+        for key, (prefix, label_values, fallback) in LABELLED_ATTRIBUTES.items():
+            attribute = next((labels[value] for value in label_values
+                              if value in labels and labels[value].startswith(prefix)), fallback)
+            if attribute:
+                self._open(key, attribute)
+        for key, attributes in PLAIN_ATTRIBUTES.items():
+            for attribute in attributes:
+                if self._open(key, attribute):
+                    break
+
+    def read(self) -> Dict:
+        reading = {
+            'vendor': self.vendor,
+            'pci_id': self.pci_id,
+            'hwmon': self.hwmon,
+        }
+        for key in LABELLED_ATTRIBUTES.keys() | PLAIN_ATTRIBUTES.keys():
+            reading[key] = None
+        for key, fd in self._fds.items():
+            try:
+                reading[key] = int(os.pread(fd, 32, 0))
+            except (OSError, ValueError):
+                # some attributes (e.g. power while the GPU is idle on older drivers) can't always be read
+                pass
+        return reading
+
+    def close(self) -> None:
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+
+
+class GpuTelemetryCollector(AbstractMinerCollector):
+    def __init__(self, sysfs_root: str = DEFAULT_SYSFS_ROOT, ttl_sec: float = DEFAULT_TTL_SEC):
+        self.sysfs_root = pathlib.Path(sysfs_root)
+        self.ttl_sec = ttl_sec
+        self.host = transformers.hostname()
+        # by resolved device path
+        self._readers: Dict[str, HwmonReader] = OrderedDict()
+        self._listed_at: Optional[float] = None
+
+    @staticmethod
+    def from_config(config: Optional[Dict]) -> Optional['GpuTelemetryCollector']:
+        telemetry_config = (config or {}).get('gpu_telemetry', {})
+        if not telemetry_config.get('enabled'):
+            return None
+        return GpuTelemetryCollector(telemetry_config.get('sysfs_root', DEFAULT_SYSFS_ROOT),
+                                     float(telemetry_config.get('ttl_sec', DEFAULT_TTL_SEC)))
+
+    @property
+    def readers(self) -> List[HwmonReader]:
+        if self._listed_at is None or time.monotonic() - self._listed_at > self.ttl_sec:
+            self._list_cards()
+        return list(self._readers.values())
+
+    def _list_cards(self) -> None:
+        # Cards are listed again every ttl_sec, so a GPU whose driver came up after the collector is picked up. The
+        # readers of cards that are still there (with the same hwmon directory) keep their open files.
+        drm_path = self.sysfs_root / 'class' / 'drm'
+        readers = OrderedDict()
+        for card in sorted(path for path in drm_path.glob('card*') if _CARD_NAME.match(path.name)):
+            device_path = pathlib.Path(os.path.realpath(card / 'device'))
+            pci_id = _device_pci_id(device_path)
+            if not pci_id:
+                continue
+            reader = self._readers.pop(str(device_path), None)
+            if reader and reader.hwmon_path != _hwmon_path(device_path):
+                reader.close()
+                reader = None
+            readers[str(device_path)] = reader or HwmonReader(device_path, pci_id)
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = readers
+        self._listed_at = time.monotonic()
+
+    def reset(self) -> None:
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = OrderedDict()
+        self._listed_at = None
+
+    def collect(self, scope: Optional[ScrapeScope] = None) -> List[Metric]:
+        try:
+            request_time = time.time()
+            metrics = GPU_SCHEMA.new_families()
+            for reading in [reader.read() for reader in self.readers]:
+                labels = GPU_SCHEMA.labels_for(WrMetric.parse_label_values(reading, GPU_LABEL_PLAN))
+                GPU_SCHEMA.add_values(metrics, reading, labels, request_time)
+            return metrics if scope is None else scope.filter(metrics)
+        except:
+            # TODO better error handling
+            traceback.print_exc()
+            # the card set may have changed (driver reload), find them again on the next scrape
+            self.reset()
+            return []
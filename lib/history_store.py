@@ -0,0 +1,325 @@
+import json
+import re
+import threading
+import time
+import traceback
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from prometheus_client import Counter, Gauge
+from prometheus_client.core import Metric
+from prometheus_client.utils import floatToGoString
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+
+DEFAULT_RETENTION_HOURS = 6.0
+DEFAULT_RESOLUTION_SEC = 30.0
+DEFAULT_MAX_MEMORY_MB = 16
+DEFAULT_LISTEN_ADDR = '127.0.0.1'
+DEFAULT_PORT = 32728
+
+# a float64 timestamp and a float64 value
+POINT_BYTES = 16
+RECORDED_TYPES = frozenset(['gauge', 'counter'])
+QUERY_PARAMS = frozenset(['name', 'start', 'end', 'step', 'agg'])
+AGGREGATIONS: Dict[str, Callable[[List[float]], float]] = {
+    'avg': lambda values: sum(values) / len(values),
+    'min': min,
+    'max': max,
+    'last': lambda values: values[-1],
+}
+_DURATION = re.compile(r'^(\d+(?:\.\d+)?)([smhd]?)$')
+_DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+HISTORY_SERIES = Gauge(
+    'mining_collector_history_series',
+    'number of series kept in the recent-history store',
+)
+HISTORY_BYTES = Gauge(
+    'mining_collector_history_bytes',
+    'bytes preallocated for the points of the series in the recent-history store',
+)
+HISTORY_SERIES_DROPPED = Counter(
+    'mining_collector_history_series_dropped',
+    'number of samples not recorded because the recent-history store was at its series limit',
+)
+
+
+def parse_duration(value: str) -> float:
+    # `90`, `90s`, `15m`, `6h`, `1d`
+    match = _DURATION.match(value.strip())
+    if not match:
+        raise ValueError(f'Invalid duration {value!r}')
+    return float(match[1]) * _DURATION_UNITS[match[2]]
+
+
+def parse_time(value: Optional[str], now: float, default: float) -> float:
+    # Unix seconds, `now`, or relative to now: `-1h`
+    if not value:
+        return default
+    if value == 'now':
+        return now
+    if value.startswith('-'):
+        return now - parse_duration(value[1:])
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f'Invalid time {value!r}') from None
+
+
+def downsample(timestamps: List[float], values: List[float], start: float, step: float,
+               agg: Callable[[List[float]], float]) -> List[Tuple[float, float]]:
+    # One point per `step` wide bucket from `start`, stamped with the bucket's start
+    buckets: Dict[int, List[float]] = {}
+    for timestamp, value in zip(timestamps, values):
+        buckets.setdefault(int((timestamp - start) // step), []).append(value)
+    return [(start + index * step, agg(bucket)) for index, bucket in buckets.items()]
+
+
+class SeriesRing:
+    # The last `capacity` points of one series, oldest overwritten first, in two float64 arrays allocated up front
+    __slots__ = ('labels', 'kind', 'timestamps', 'values', 'position', 'count')
+
+    def __init__(self, labels: Dict[str, str], kind: str, capacity: int):
+        self.labels = dict(labels)
+        self.kind = kind
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.position = 0
+        self.count = 0
+
+    @property
+    def last_timestamp(self) -> float:
+        return self.timestamps[self.position - 1] if self.count else float('-inf')
+
+    def append(self, timestamp: float, value: float) -> None:
+        self.timestamps[self.position] = timestamp
+        self.values[self.position] = value
+        self.position = (self.position + 1) % len(self.timestamps)
+        if self.count < len(self.timestamps):
+            self.count += 1
+
+    def points(self, start: float, end: float) -> Tuple[List[float], List[float]]:
+        capacity = len(self.timestamps)
+        first = (self.position - self.count) % capacity
+        if first + self.count <= capacity:
+            timestamps = self.timestamps[first:first + self.count]
+            values = self.values[first:first + self.count]
+        else:
+            timestamps = self.timestamps[first:] + self.timestamps[:self.position]
+            values = self.values[first:] + self.values[:self.position]
+        low, high = bisect_left(timestamps, start), bisect_right(timestamps, end)
+        return timestamps[low:high].tolist(), values[low:high].tolist()
+
+
+class HistoryStore:
+    # The last `retention_sec` of every gauge and counter sample, one SeriesRing per series with a point every
+    # `resolution_sec`. Every ring is allocated in full, so memory use is the number of series times a fixed size and
+    # series beyond `max_bytes` are not recorded. Series that stop reporting are dropped once past the retention.
+    def __init__(self, retention_sec: float, resolution_sec: float, max_bytes: int):
+        self.retention_sec = retention_sec
+        self.resolution_sec = resolution_sec
+        self.capacity = max(1, int(retention_sec // resolution_sec))
+        self.series_bytes = self.capacity * POINT_BYTES
+        self.max_series = max(1, max_bytes // self.series_bytes)
+        # sample name -> label items -> ring
+        self._series: Dict[str, Dict[Tuple[Tuple[str, str], ...], SeriesRing]] = {}
+        self._series_count = 0
+        self._full_reported = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._series_count
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._series_count * self.series_bytes
+
+    def append(self, metrics: Iterable[Metric], timestamp: float) -> None:
+        dropped = 0
+        with self._lock:
+            for metric in metrics:
+                if metric.type not in RECORDED_TYPES:
+                    continue
+                counter = metric.type == 'counter'
+                for sample in metric.samples:
+                    if counter and not sample.name.endswith('_total'):
+                        # `_created`
+                        continue
+                    named = self._series.get(sample.name)
+                    if named is None:
+                        named = self._series[sample.name] = {}
+                    key = tuple(sample.labels.items())
+                    ring = named.get(key)
+                    if ring is None:
+                        if self._series_count >= self.max_series:
+                            dropped += 1
+                            continue
+                        ring = named[key] = SeriesRing(sample.labels, metric.type, self.capacity)
+                        self._series_count += 1
+                    sample_timestamp = float(sample.timestamp) if sample.timestamp is not None else timestamp
+                    # the same snapshot recorded twice
+                    if sample_timestamp > ring.last_timestamp:
+                        ring.append(sample_timestamp, float(sample.value))
+            self._expire(timestamp - self.retention_sec)
+        if dropped:
+            if not self._full_reported:
+                self._full_reported = True
+                print(f'History store is full at {self.max_series} series, raise history.max_memory_mb or lower '
+                      f'history.retention_hours to keep the rest')  # TODO logger, stderr
+            HISTORY_SERIES_DROPPED.inc(dropped)
+        HISTORY_SERIES.set(self._series_count)
+        HISTORY_BYTES.set(self.memory_bytes)
+
+    def _expire(self, before: float) -> None:
+        for name, named in list(self._series.items()):
+            for key in [key for key, ring in named.items() if ring.last_timestamp < before]:
+                del named[key]
+                self._series_count -= 1
+            if not named:
+                del self._series[name]
+
+    def series(self, name: Optional[str] = None) -> List[Dict[str, str]]:
+        with self._lock:
+            return [{'__name__': sample_name, **ring.labels}
+                    for sample_name, named in self._series.items() if name in (None, sample_name)
+                    for ring in named.values()]
+
+    def query(self,
+              name: str,
+              matchers: Optional[Dict[str, str]] = None,
+              start: float = float('-inf'),
+              end: float = float('inf'),
+              step: Optional[float] = None,
+              agg: Optional[str] = None
+              ) -> Tuple[str, List[Tuple[Dict[str, str], List[Tuple[float, float]]]]]:
+        # The sample name and the points of every series of it (the family name works for counters too) whose labels
+        # match, between start and end; with `step`, downsampled by `agg` (by default `avg` for gauges, `last` for
+        # counters)
+        if agg is not None and agg not in AGGREGATIONS:
+            raise ValueError(f'Unknown aggregation {agg!r}, expected one of {sorted(AGGREGATIONS)}')
+        if step is not None and step <= 0:
+            raise ValueError('step must be positive')
+        matchers = matchers or {}
+        with self._lock:
+            if name not in self._series and f'{name}_total' in self._series:
+                name = f'{name}_total'
+            named = self._series.get(name) or {}
+            selected = [(ring.kind, ring.labels, ring.points(start, end)) for ring in named.values()
+                        if all(ring.labels.get(label) == value for label, value in matchers.items())]
+
+        results = []
+        for kind, labels, (timestamps, values) in selected:
+            if step is None:
+                points = list(zip(timestamps, values))
+            else:
+                first = start if start != float('-inf') else (timestamps[0] if timestamps else 0.0)
+                points = downsample(timestamps, values, first, step,
+                                    AGGREGATIONS[agg or ('last' if kind == 'counter' else 'avg')])
+            results.append((labels, points))
+        return name, results
+
+
+def _make_handler(store: HistoryStore) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, data: Dict) -> None:
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            split = urlsplit(self.path)
+            params = {name: values[-1] for name, values in parse_qs(split.query).items()}
+            try:
+                if split.path == '/history/series':
+                    self._reply(200, {'status': 'success', 'data': store.series(params.get('name'))})
+                elif split.path == '/history/query':
+                    self._reply(200, {'status': 'success', 'data': self._query(params)})
+                else:
+                    self._reply(404, {'status': 'error', 'error': 'not found'})
+            except ValueError as e:
+                self._reply(400, {'status': 'error', 'error': str(e)})
+
+        @staticmethod
+        def _query(params: Dict[str, str]) -> List[Dict]:
+            if not params.get('name'):
+                raise ValueError('name is required')
+            now = time.time()
+            name, results = store.query(
+                params['name'],
+                {label: value for label, value in params.items() if label not in QUERY_PARAMS},
+                parse_time(params.get('start'), now, now - store.retention_sec),
+                parse_time(params.get('end'), now, now),
+                parse_duration(params['step']) if params.get('step') else None,
+                params.get('agg'))
+            # the same shape as a Prometheus range query
+            return [{'metric': {'__name__': name, **labels},
+                     'values': [[timestamp, floatToGoString(value)] for timestamp, value in points]}
+                    for labels, points in results]
+
+        def log_message(self, *_):
+            pass
+
+    return Handler
+
+
+class HistoryRecorder:
+    # Records `collect` (the registry) into a HistoryStore every `resolution_sec` and serves it on a local port:
+    #   /history/series[?name=]
+    #   /history/query?name=mining_gpu_hashrate[&device_pci_id=01:00][&start=-1h][&end=now][&step=5m][&agg=max]
+    def __init__(self,
+                 collect: Callable[[], Iterable[Metric]],
+                 store: HistoryStore,
+                 listen_addr: str = DEFAULT_LISTEN_ADDR,
+                 port: int = DEFAULT_PORT
+                 ):
+        self.collect = collect
+        self.store = store
+        self.listen_addr = listen_addr
+        self.port = port
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='history-recorder', daemon=True)
+        self._httpd: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def interval_sec(self) -> float:
+        return self.store.resolution_sec
+
+    @staticmethod
+    def from_config(collect: Callable[[], Iterable[Metric]], config: Optional[Dict]) -> Optional['HistoryRecorder']:
+        history_config = (config or {}).get('history', {})
+        if not history_config.get('enabled'):
+            return None
+        store = HistoryStore(float(history_config.get('retention_hours', DEFAULT_RETENTION_HOURS)) * 3600,
+                             float(history_config.get('resolution_sec', DEFAULT_RESOLUTION_SEC)),
+                             int(float(history_config.get('max_memory_mb', DEFAULT_MAX_MEMORY_MB)) * 1024 * 1024))
+        return HistoryRecorder(collect, store, history_config.get('listen_addr', DEFAULT_LISTEN_ADDR),
+                               int(history_config.get('port', DEFAULT_PORT)))
+
+    def start(self) -> None:
+        self._httpd = ThreadingHTTPServer((self.listen_addr, self.port), _make_handler(self.store))
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, name='history-http', daemon=True).start()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.store.append(self.collect(), time.time())
+            except Exception:
+                traceback.print_exc()
+            self._stop.wait(max(0.0, self.interval_sec - (time.monotonic() - started)))
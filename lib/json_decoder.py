@@ -0,0 +1,37 @@
+import json
+
+from collections.abc import Callable
+from typing import Any, Dict, Optional
+
+
+def _stdlib_loads(body: bytes) -> Any:
+    return json.loads(body)
+
+
+def _load_decoders() -> Dict[str, Callable[[bytes], Any]]:
+    # Fastest first; both are optional, stdlib json is always available
+    decoders = {}
+    try:
+        import orjson
+        decoders['orjson'] = orjson.loads
+    except ImportError:
+        pass
+    try:
+        import ujson
+        decoders['ujson'] = ujson.loads
+    except ImportError:
+        pass
+    decoders['json'] = _stdlib_loads
+    return decoders
+
+
+DECODERS = _load_decoders()
+
+
+def get_decoder(name: Optional[str] = None) -> Callable[[bytes], Any]:
+    if not name or name == 'auto':
+        return next(iter(DECODERS.values()))
+    if name not in DECODERS:
+        print(f'JSON decoder {name} is not installed, falling back to {next(iter(DECODERS))}')  # TODO logger, stderr
+        return next(iter(DECODERS.values()))
+    return DECODERS[name]
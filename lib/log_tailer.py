@@ -0,0 +1,315 @@
+import json
+import os
+import pathlib
+import re
+import threading
+import traceback
+
+from collections import OrderedDict
+from prometheus_client import Counter
+from prometheus_client.core import Metric
+from prometheus_client.samples import Sample
+from prometheus_client.utils import floatToGoString
+from typing import TYPE_CHECKING, Dict, List, Optional, Pattern, Tuple
+
+import transformers
+
+from abstract_miner_collector import AbstractMinerCollector
+from scrape_scope import ScrapeScope
+
+if TYPE_CHECKING:
+    from descriptor_collector import DescriptorMinerCollector, LastLabels
+    from miner_discovery import MinerDiscovery, MinerTargets
+
+
+# event -> (counter, its description, histogram of the event's duration)
+LOG_EVENTS = OrderedDict(
+    share_accepted=('log_shares_accepted', 'shares the miner logged as accepted', 'log_share_latency_sec'),
+    share_rejected=('log_shares_rejected', 'shares the miner logged as rejected', 'log_share_latency_sec'),
+    lhr_unlock=('log_lhr_unlocks', 'LHR unlocks the miner logged', None),
+    dag_build=('log_dag_builds', 'DAG builds the miner logged', 'log_dag_build_sec'),
+    gpu_restart=('log_gpu_restarts', 'GPU restarts the miner logged', None),
+    pool_reconnect=('log_pool_reconnects', 'pool connections the miner logged as lost', None),
+)
+# histogram -> (description, bucket upper bounds)
+LOG_HISTOGRAMS = OrderedDict(
+    log_share_latency_sec=('share submit to accept/reject latency the miner logged, in seconds',
+                           (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)),
+    log_dag_build_sec=('DAG build time the miner logged, in seconds', (1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)),
+)
+
+LOG_LINES = Counter(
+    'mining_collector_log_lines',
+    'number of miner log lines read, by whether they matched an event',
+    ['miner', 'matched'],
+)
+LOG_REOPENS = Counter(
+    'mining_collector_log_reopens',
+    'number of times a miner log was read again from its start after being rotated or truncated',
+    ['miner'],
+)
+
+
+def compile_log_patterns(patterns: Dict[str, str]) -> List[Tuple[str, Pattern[bytes]]]:
+    # Lines are matched as bytes, so nothing is decoded for lines no pattern matches
+    unknown = patterns.keys() - LOG_EVENTS.keys()
+    if unknown:
+        raise ValueError(f'Unknown log events: {sorted(unknown)}, expected some of {list(LOG_EVENTS)}')
+    return [(event, re.compile(pattern.encode())) for event, pattern in patterns.items()]
+
+
+class LogOffsets:
+    # Where each followed log was read up to (inode, offset), kept in `state_file` across restarts
+    def __init__(self, path: Optional[pathlib.Path] = None):
+        self.path = path
+        self.offsets: Dict[str, Tuple[int, int]] = {}
+        if path and path.exists():
+            try:
+                self.offsets = {log: (int(inode), int(offset)) for log, (inode, offset) in
+                                json.loads(path.read_text()).items()}
+            except (OSError, ValueError, TypeError):
+                traceback.print_exc()
+        self._lock = threading.Lock()
+
+    def get(self, log: str) -> Optional[Tuple[int, int]]:
+        return self.offsets.get(log)
+
+    def put(self, log: str, inode: int, offset: int) -> None:
+        with self._lock:
+            if self.offsets.get(log) == (inode, offset):
+                return
+            self.offsets[log] = (inode, offset)
+            if self.path:
+                # written aside and renamed, so a crash leaves either the old or the new offsets
+                temp_path = self.path.with_name(self.path.name + '.tmp')
+                temp_path.write_text(json.dumps(self.offsets))
+                os.replace(temp_path, self.path)
+
+
+class LogFollower:
+    # Reads what was appended to a log since the last call. The file stays open, so after a rotation (renamed, new file
+    # at the path) the rest of the old file is read before the new one is picked up from its start; a file that got
+    # shorter was truncated in place (copytruncate) and is read again from its start. The first time, reading resumes
+    # from the saved offset if it's the same file, or only picks up new lines otherwise.
+    def __init__(self, path: str, saved: Optional[Tuple[int, int]] = None):
+        self.path = path
+        self.inode: Optional[int] = saved[0] if saved else None
+        self.offset: int = saved[1] if saved else 0
+        self.reopens = 0
+        self._saved = saved
+        self._file = None
+        self._partial = b''
+        self._from_start = False
+
+    @property
+    def line_offset(self) -> int:
+        # the end of the last whole line read
+        return self.offset - len(self._partial)
+
+    def _open(self) -> bool:
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            # not written yet; when it shows up, all of it is new
+            self._from_start = True
+            return False
+        stat = os.fstat(f.fileno())
+        if self._from_start:
+            offset = 0
+        elif self._saved and self._saved[0] == stat.st_ino and self._saved[1] <= stat.st_size:
+            offset = self._saved[1]
+        else:
+            offset = stat.st_size
+        f.seek(offset)
+        self._file, self.inode, self.offset, self._partial = f, stat.st_ino, offset, b''
+        self._saved, self._from_start = None, True
+        return True
+
+    def _read(self) -> List[bytes]:
+        data = self._file.read()
+        if not data:
+            return []
+        self.offset += len(data)
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        return lines
+
+    def read_lines(self) -> List[bytes]:
+        if self._file is None and not self._open():
+            return []
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            # rotated away and not recreated yet, the old file may still be written to
+            return self._read()
+
+        if stat.st_ino != self.inode:
+            lines = self._read()
+            if self._partial:
+                lines.append(self._partial)
+            self.close()
+            self.reopens += 1
+            return lines + (self._read() if self._open() else [])
+        if stat.st_size < self.offset:
+            self._file.seek(0)
+            self.offset, self._partial = 0, b''
+            self.reopens += 1
+        return self._read()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class LogEventCounts:
+    # Event counts and duration histograms per GPU number in the log (None for miner-level events)
+    def __init__(self):
+        self.counts: Dict[Tuple[str, Optional[int]], int] = {}
+        # (histogram, GPU number) -> (bucket counts, sum)
+        self.histograms: Dict[Tuple[str, Optional[int]], Tuple[List[int], float]] = {}
+
+    def add(self, event: str, gpu: Optional[int], duration_sec: Optional[float]) -> None:
+        self.counts[(event, gpu)] = self.counts.get((event, gpu), 0) + 1
+        histogram = LOG_EVENTS[event][2]
+        if histogram is None or duration_sec is None:
+            return
+        bounds = LOG_HISTOGRAMS[histogram][1]
+        buckets, total = self.histograms.get((histogram, gpu)) or ([0] * (len(bounds) + 1), 0.0)
+        index = next((index for index, bound in enumerate(bounds) if duration_sec <= bound), len(bounds))
+        buckets[index] += 1
+        self.histograms[(histogram, gpu)] = (buckets, total + duration_sec)
+
+
+class MinerLogCollector(AbstractMinerCollector):
+    # Follows one miner's log for events its API doesn't report, matching every new line against the miner collector's
+    # precompiled `log_patterns`. There is no thread: the log is read on each collect, so an idle log costs a stat per
+    # scrape. Samples carry the labels of the miner's own metrics (GPU events those of the GPU the log names), taken
+    # from the last response its collector parsed, so nothing is exported until the miner's API has been read once.
+    def __init__(self,
+                 miner: str,
+                 path: str,
+                 collector_class: type['DescriptorMinerCollector'],
+                 discovery,
+                 offsets: LogOffsets,
+                 host: Optional[str] = None
+                 ):
+        if not collector_class.log_patterns:
+            raise ValueError(f'{miner} has no log patterns to follow {path} with')
+        self.miner = collector_class.miner
+        self.host = host or transformers.hostname()
+        self.patterns = compile_log_patterns(collector_class.log_patterns)
+        self.log_gpu_label = collector_class.log_gpu_label
+        self.discovery = discovery
+        self.offsets = offsets
+        self.follower = LogFollower(path, offsets.get(path))
+        self.events = LogEventCounts()
+        self._matched = LOG_LINES.labels(self.miner, 'true')
+        self._unmatched = LOG_LINES.labels(self.miner, 'false')
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_config(config: Optional[Dict],
+                    discovery: 'MinerDiscovery | MinerTargets') -> List['MinerLogCollector']:
+        logs_config = (config or {}).get('miner_logs', {})
+        state_file = logs_config.get('state_file')
+        offsets = LogOffsets(pathlib.Path(state_file) if state_file else None)
+        collectors = []
+        for log in logs_config.get('files') or []:
+            collector_class = discovery.registry.collector_class(str(log.get('miner', '')))
+            if collector_class is None:
+                raise ValueError(f'Unknown miner {log.get("miner")!r} for log {log.get("path")!r}, '
+                                 f'expected one of {sorted(discovery.registry.miners)}')
+            collectors.append(MinerLogCollector(str(log['miner']), str(log['path']), collector_class, discovery,
+                                                offsets, log.get('host')))
+        return collectors
+
+    def read(self) -> None:
+        reopens = self.follower.reopens
+        lines = self.follower.read_lines()
+        if self.follower.reopens != reopens:
+            LOG_REOPENS.labels(self.miner).inc(self.follower.reopens - reopens)
+        matched = 0
+        for line in lines:
+            for event, pattern in self.patterns:
+                match = pattern.search(line)
+                if match:
+                    groups = match.groupdict()
+                    gpu = int(groups['gpu']) if groups.get('gpu') is not None else None
+                    if groups.get('ms') is not None:
+                        duration_sec = float(groups['ms']) / 1000
+                    elif groups.get('sec') is not None:
+                        duration_sec = float(groups['sec'])
+                    else:
+                        duration_sec = None
+                    self.events.add(event, gpu, duration_sec)
+                    matched += 1
+                    break
+        if lines:
+            self._matched.inc(matched)
+            self._unmatched.inc(len(lines) - matched)
+        if self.follower.inode is not None:
+            self.offsets.put(self.follower.path, self.follower.inode, self.follower.line_offset)
+
+    def last_labels(self) -> Optional['LastLabels']:
+        for collector in self.discovery.collectors:
+            if getattr(collector, 'miner', None) == self.miner and collector.host == self.host and \
+                    getattr(collector, 'last_labels', None) is not None:
+                return collector.last_labels
+        return None
+
+    def _labels(self, last: 'LastLabels', gpu: Optional[int]) -> Optional[Dict[str, str]]:
+        if gpu is None:
+            return dict(zip(last.miner_names, last.miner_values))
+        if self.log_gpu_label is None:
+            values = last.gpu_values[gpu] if gpu < len(last.gpu_values) else None
+        else:
+            index = last.gpu_names.index(self.log_gpu_label)
+            values = next((values for values in last.gpu_values if values[index] == str(gpu)), None)
+        return dict(zip(last.gpu_names, values)) if values is not None else None
+
+    def render(self, last: 'LastLabels') -> List[Metric]:
+        # GPUs the API doesn't report (yet) are left out until it does; their counts are kept
+        labels_by_gpu: Dict[Optional[int], Optional[Dict[str, str]]] = {}
+
+        def labels_for(gpu: Optional[int]) -> Optional[Dict[str, str]]:
+            if gpu not in labels_by_gpu:
+                labels_by_gpu[gpu] = self._labels(last, gpu)
+            return labels_by_gpu[gpu]
+
+        families: Dict[str, Metric] = OrderedDict()
+        for event, (name, desc, _) in LOG_EVENTS.items():
+            families[name] = Metric(f'mining_{name}', desc, 'counter')
+        for name, (desc, _) in LOG_HISTOGRAMS.items():
+            families[name] = Metric(f'mining_{name}', desc, 'histogram')
+
+        for (event, gpu), count in self.events.counts.items():
+            labels = labels_for(gpu)
+            if labels is not None:
+                family = families[LOG_EVENTS[event][0]]
+                family.samples.append(Sample(f'{family.name}_total', labels, float(count), None))
+        for (histogram, gpu), (buckets, total) in self.events.histograms.items():
+            labels = labels_for(gpu)
+            if labels is None:
+                continue
+            family = families[histogram]
+            cumulative = 0
+            for bound, count in zip(LOG_HISTOGRAMS[histogram][1] + (float('inf'),), buckets):
+                cumulative += count
+                family.samples.append(Sample(f'{family.name}_bucket', {**labels, 'le': floatToGoString(bound)},
+                                             float(cumulative), None))
+            family.samples.append(Sample(f'{family.name}_count', labels, float(cumulative), None))
+            family.samples.append(Sample(f'{family.name}_sum', labels, total, None))
+        return [family for family in families.values() if family.samples]
+
+    def collect(self, scope: Optional[ScrapeScope] = None) -> List[Metric]:
+        try:
+            with self._lock:
+                self.read()
+                last = self.last_labels()
+                metrics = self.render(last) if last is not None else []
+            return metrics if scope is None else scope.filter(metrics)
+        except:
+            # TODO better error handling
+            traceback.print_exc()
+            return []
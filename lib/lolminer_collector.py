@@ -1,11 +1,9 @@
 import transformers
 
-from abstract_miner_collector import AbstractMinerJsonCollector
-from metric_wrappers import WrMetric
+from descriptor_collector import DescriptorMinerCollector, MinerDescriptor
 
 from collections import OrderedDict
 from functools import partial
-from typing import List
 
 
 MINER_LABELS = OrderedDict(
@@ -156,31 +154,33 @@ GPU_GAUGE_METRICS = OrderedDict(
     },
 )
 
+# Events only the log reports (see log_tailer.LOG_EVENTS), written against lolMiner 1.8x logs. `gpu` is the GPU's
+# position in `Workers`, `ms`/`sec` the event's duration.
+LOG_PATTERNS = OrderedDict(
+    share_accepted = r'GPU (?P<gpu>\d+): Share accepted \((?P<ms>\d+) ms\)',
+    share_rejected = r'GPU (?P<gpu>\d+): Share rejected .*\((?P<ms>\d+) ms\)',
+    lhr_unlock = r'GPU (?P<gpu>\d+): LHR unlock mode enabled',
+    dag_build = r'GPU (?P<gpu>\d+): DAG generated in (?P<sec>[\d.]+) s',
+    gpu_restart = r'GPU (?P<gpu>\d+): Restarting',
+    pool_reconnect = r'Connection to pool lost',
+)
 
-class LolminerCollector(AbstractMinerJsonCollector):
-    @property
-    def api_url(self):
-        return 'http://127.0.0.1:3333/'
-
-    def json_collect(self, request_time: float, json_data) -> List[WrMetric]:
-        label_keys = list(MINER_LABELS.keys())
-        metrics = self.create_counter_gauge_metrics(MINER_COUNTER_METRICS, MINER_GAUGE_METRICS, label_keys)
-        labels = WrMetric.parse_label_values(json_data, MINER_LABELS)
-        for metric in metrics:
-            metric.add_value(base=json_data, labels=labels, timestamp=request_time)
 
-        gpu_general_label_keys = list(label_keys)
-        all_gpu_labels = OrderedDict(GPU_LABELS)
-        all_gpu_labels.update(self.addl_gpu_labels_from_config(transformers.pcie_bus_slot_str_to_id,
-                                                               'Workers[i].PCIE_Address'))
-        gpu_general_label_keys.extend(list(all_gpu_labels.keys()))
+LOLMINER = MinerDescriptor(
+    miner='lolMiner',
+    process_name='lolminer',
+    api_url='http://127.0.0.1:3333/',
+    miner_labels=MINER_LABELS,
+    miner_counter_metrics=MINER_COUNTER_METRICS,
+    miner_gauge_metrics=MINER_GAUGE_METRICS,
+    gpu_labels=GPU_LABELS,
+    gpu_counter_metrics=GPU_COUNTER_METRICS,
+    gpu_gauge_metrics=GPU_GAUGE_METRICS,
+    gpu_count_path='Workers',
+    algorithms_path='Algorithms',
+)
 
-        gpu_metrics = self.create_counter_gauge_metrics(GPU_COUNTER_METRICS, GPU_GAUGE_METRICS, gpu_general_label_keys)
-        for i in range(len(json_data['Workers'])):
-            gpu_labels = OrderedDict(labels)
-            gpu_labels.update(WrMetric.parse_label_values(json_data, all_gpu_labels, i))
-            for metric in gpu_metrics:
-                metric.add_value(base=json_data, labels=gpu_labels, timestamp=request_time, i=i)
-        metrics.extend(gpu_metrics)
 
-        return metrics
+class LolminerCollector(DescriptorMinerCollector):
+    descriptor = LOLMINER
+    log_patterns = LOG_PATTERNS
@@ -1,93 +1,92 @@
-import dictlib
-
 from collections import OrderedDict
-from collections.abc import Callable
-from prometheus_client.core import Metric, GaugeMetricFamily, CounterMetricFamily
-from typing import Dict, Sequence, Any, Optional
+from prometheus_client.core import Metric
+from prometheus_client.samples import Sample
+from typing import Dict, Iterable, List, Sequence, Optional, Tuple
 
+from descriptors import LabelPlan, MetricPlan, label_as_str
 
-class WrMetric:
-    def __init__(self,
-                 metric_class: type[GaugeMetricFamily] | type[CounterMetricFamily],
-                 name: str,
-                 labels: Sequence[str],
-                 desc: str,
-                 value_path: str,
-                 transform: Callable[[Any, ...], float | Optional[float]] = None
-                 ):
-        full_name = f'mining_{name}'
-        self.value_path = value_path
-        self.transform = transform
-        self._labels = list(labels)
-        self._metric = metric_class(name=full_name, documentation=desc, labels=self._labels)
 
-    @staticmethod
-    def value_at_path(base: Dict, path: str, i: int) -> Optional[Any]:
-        if path == '.':
-            return base
-        if i is not None:
-            path = path.replace('[i]', f'[{i}]')
-        return dictlib.dig(base, path)
+class WrMetric:
+    # Built once per collector for a fixed label layout; each scrape only allocates a fresh family and its samples
+    def __init__(self, plan: MetricPlan, labels: Sequence[str]):
+        self.plan = plan
+        self.labels = tuple(labels)
+        prototype = self.new_family()
+        self.sample_name = f'{prototype.name}_total' if prototype.type == 'counter' else prototype.name
 
     @staticmethod
     def label_as_str(value) -> str:
-        if value is None:
-            return 'null'
-        if isinstance(value, bool):
-            return 'true' if value else 'false'
-        return str(value)
+        return label_as_str(value)
 
     @staticmethod
-    def lookup_str_value(base: Dict, desc: Dict, i: int) -> Optional[str]:
-        if 'value' in desc.keys():
-            int_result = desc['value']
-        elif 'path' in desc.keys():
-            int_result = WrMetric.value_at_path(base, desc['path'], i)
-        else:
-            int_result = base
+    def parse_label_values(base: Dict, label_plan: LabelPlan, i: int = None) -> Tuple[str, ...]:
+        return label_plan.values(base, i)
 
-        if 'join' in desc.keys():
-            int_result = ' '.join([WrMetric.value_at_path(int_result, path, i) for path in desc['join']])
+    def new_family(self) -> Metric:
+        return self.plan.metric_class(name=self.plan.full_name, documentation=self.plan.desc, labels=self.labels)
 
-        if 'transform' in desc.keys():
-            int_result = desc['transform'](int_result)
+    def add_value(self,
+                  family: Metric,
+                  base: Dict,
+                  labels: Dict[str, str],
+                  timestamp: Optional[float] = None,
+                  i: int = None
+                  ) -> bool:
+        # Returns whether the sample was dropped by its transform
+        value = self.plan.value_at(base, i)
+        if value is None:
+            return False
+        if self.plan.transform:
+            value = self.plan.transform(value, i)
+            if value is None:
+                return True
+        # `labels` is built by the owning MetricSchema in this metric's label order, and is shared between all the
+        # samples of a label set
+        family.samples.append(Sample(self.sample_name, labels, float(value), timestamp))
+        return False
 
-        if 'coalesce' in desc.keys():
-            for desc_coalesced in desc['coalesce']:
-                c_result = WrMetric.lookup_str_value(int_result, desc_coalesced, i)
-                if c_result is not None and (not isinstance(c_result, str) or len(c_result) > 0):
-                    return c_result
-            return None
 
-        return int_result
+class MetricSchema:
+    def __init__(self, metric_plans: Sequence[MetricPlan], label_names: Sequence[str]):
+        self.label_names = tuple(label_names)
+        if len(set(self.label_names)) != len(self.label_names):
+            duplicates = sorted({name for name in self.label_names if self.label_names.count(name) > 1})
+            raise ValueError(f'Duplicate label names: {duplicates}')
+        self.label_indexes = {name: index for index, name in enumerate(self.label_names)}
+        self.metrics = [WrMetric(plan, self.label_names) for plan in metric_plans]
 
-    @staticmethod
-    def parse_label_values(base: Dict, label_descs: OrderedDict[str, Dict], i: int = None) -> OrderedDict[str, str]:
-        result = OrderedDict()
-        for name, desc in label_descs.items():
-            result[name] = WrMetric.label_as_str(WrMetric.lookup_str_value(base, desc, i))
-        return result
+    def new_families(self) -> List[Metric]:
+        return [metric.new_family() for metric in self.metrics]
 
-    def add_value(self, base: Dict, labels: Dict[str, str], timestamp: Optional[float] = None, i: int = None) -> None:
-        value = self.value_at_path(base, self.value_path, i)
-        if value is None:
-            return
-        if self.transform:
-            value = self.transform(value, i)
-        if value is None:
-            return
-        # TODO make the raise optional at runtime, but this is likely a programming error, not something unexpected from
-        # the api
-        if list(labels.keys()) != self._labels:
-            print(self._labels)
-            print(list(labels.keys()))
-            raise 'Labels do not match'
+    def labels_for(self, label_values: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.label_names, label_values))
 
-        # Make sure they're in order... yes paranoid but no unit tests yet
-        label_values = [labels[label] for label in self._labels]
+    def add_values(self,
+                   families: List[Metric],
+                   base: Dict,
+                   labels: Dict[str, str],
+                   timestamp: Optional[float] = None,
+                   i: int = None,
+                   indexes: Optional[Sequence[int]] = None
+                   ) -> int:
+        # Returns the number of samples dropped by their transforms
+        dropped = 0
+        for index in range(len(self.metrics)) if indexes is None else indexes:
+            dropped += self.metrics[index].add_value(families[index], base, labels, timestamp, i)
+        return dropped
 
-        self._metric.add_metric(value=float(value), labels=label_values, timestamp=timestamp)
 
-    @property
-    def metric(self) -> Metric:
-        return self._metric
+def merge_metric_families(metrics: Iterable[Metric]) -> List[Metric]:
+    # Several miners (or algorithms) report the same families; exposition needs each family name exactly once
+    merged: OrderedDict[str, Metric] = OrderedDict()
+    for metric in metrics:
+        existing = merged.get(metric.name)
+        if existing is None:
+            merged[metric.name] = metric
+        elif existing.type != metric.type:
+            print(f'Dropping {metric.name}: reported as both {existing.type} and {metric.type}')  # TODO logger, stderr
+        else:
+            combined = Metric(existing.name, existing.documentation, existing.type, existing.unit)
+            combined.samples = existing.samples + metric.samples
+            merged[metric.name] = combined
+    return list(merged.values())
@@ -0,0 +1,138 @@
+import os
+import psutil
+import time
+import traceback
+
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from gpu_config import GpuConfig
+from miner_registry import MinerRegistry
+
+if TYPE_CHECKING:
+    from abstract_miner_collector import AbstractMinerCollector
+
+
+DEFAULT_TTL_SEC = 300.0
+MOCKED_MINERS = (('DEBUG_MOCK_TREX', 't-rex'), ('DEBUG_MOCK_LOLMINER', 'lolminer'))
+
+
+class DiscoveredMiner:
+    def __init__(self, collector: 'AbstractMinerCollector', pid: Optional[int], create_time: Optional[float]):
+        self.collector = collector
+        self.pid = pid
+        self.create_time = create_time
+
+    def still_running(self) -> bool:
+        if self.pid is None:
+            # mocked miners have no process to watch
+            return True
+        try:
+            return psutil.Process(self.pid).create_time() == self.create_time
+        except (psutil.AccessDenied, psutil.NoSuchProcess, psutil.ZombieProcess):
+            return False
+
+
+class MinerDiscovery:
+    def __init__(self, config: Optional[Dict], registry: Optional[MinerRegistry] = None,
+                 gpu_config: Optional[GpuConfig] = None):
+        discovery_config = (config or {}).get('discovery', {})
+        self.config = config
+        self.gpu_config = gpu_config or GpuConfig.from_config(config)
+        self.registry = registry or MinerRegistry.from_config(config)
+        self._process_entries = self.registry.process_entries()
+        self.ttl_sec = float(discovery_config.get('ttl_sec', DEFAULT_TTL_SEC))
+        self._cached: List[DiscoveredMiner] = []
+        self._cached_at = 0.0
+
+        self.last_duration_sec = 0.0
+        self.last_cache_hit = False
+
+    def _cache_valid(self) -> bool:
+        if not self._cached:
+            return False
+        mocked = all(miner.pid is None for miner in self._cached)
+        if not mocked and time.monotonic() - self._cached_at > self.ttl_sec:
+            return False
+        return all(miner.still_running() for miner in self._cached)
+
+    def _scan(self) -> List[DiscoveredMiner]:
+        mocked = []
+        for env_var, miner in MOCKED_MINERS:
+            if env_var in os.environ:
+                collector_class = self.registry.collector_class(miner)
+                mocked.append(DiscoveredMiner(collector_class(self.config, gpu_config=self.gpu_config), None, None))
+        if mocked:
+            return mocked
+
+        # One collector per miner type: miners often run helper/watchdog processes under the same name, and each
+        # type is reached through a single API endpoint anyway
+        found = {}
+        for proc in psutil.process_iter(['name', 'create_time']):
+            try:
+                name = (proc.info['name'] or '').lower()
+                for entry in self._process_entries:
+                    if entry.matches(name):
+                        if entry.miner not in found:
+                            # the miner's collector module is only imported once the miner turns up
+                            found[entry.miner] = DiscoveredMiner(
+                                entry.collector_class(self.config, gpu_config=self.gpu_config), proc.pid,
+                                proc.info['create_time'])
+                        break
+            except (psutil.AccessDenied, psutil.NoSuchProcess, psutil.ZombieProcess):
+                traceback.print_exc()
+
+        return [found[entry.miner] for entry in self.registry.entries.values() if entry.miner in found]
+
+    def find_collectors(self) -> List['AbstractMinerCollector']:
+        start = time.perf_counter()
+        self.last_cache_hit = self._cache_valid()
+        if not self.last_cache_hit:
+            self._cached = self._scan()
+            self._cached_at = time.monotonic()
+        self.last_duration_sec = time.perf_counter() - start
+
+        if not self._cached:
+            print('No miner found')  # TODO logger, stderr
+            return []
+        return [miner.collector for miner in self._cached]
+
+    @property
+    def collectors(self) -> List['AbstractMinerCollector']:
+        # as of the last find_collectors, without looking again
+        return [miner.collector for miner in self._cached]
+
+
+class MinerTargets:
+    # Miner APIs listed under `targets` in the config (e.g. every rig of a farm, polled from one central collector),
+    # used in place of looking for miner processes on this machine
+    def __init__(self, config: Dict, registry: Optional[MinerRegistry] = None,
+                 gpu_config: Optional[GpuConfig] = None):
+        self.registry = registry or MinerRegistry.from_config(config)
+        gpu_config = gpu_config or GpuConfig.from_config(config)
+        self.collectors: List['AbstractMinerCollector'] = []
+        seen = set()
+        for target in config['targets']:
+            miner = str(target.get('miner', '')).lower()
+            collector_class = self.registry.collector_class(miner)
+            if collector_class is None:
+                raise ValueError(f'Unknown miner {target.get("miner")!r} for target {target.get("url")!r}, '
+                                 f'expected one of {sorted(self.registry.miners)}')
+            if not target.get('url'):
+                raise ValueError(f'Missing url for {miner} target {target.get("host")!r}')
+            collector = collector_class(config, target, gpu_config)
+            if (collector.host, miner) in seen:
+                raise ValueError(f'Duplicate {miner} target for host {collector.host!r}')
+            seen.add((collector.host, miner))
+            self.collectors.append(collector)
+
+        self.last_duration_sec = 0.0
+        self.last_cache_hit = True
+
+    @staticmethod
+    def from_config(config: Optional[Dict], gpu_config: Optional[GpuConfig] = None) -> Optional['MinerTargets']:
+        if not (config or {}).get('targets'):
+            return None
+        return MinerTargets(config, gpu_config=gpu_config)
+
+    def find_collectors(self) -> List['AbstractMinerCollector']:
+        return list(self.collectors)
@@ -0,0 +1,166 @@
+import importlib
+import pathlib
+import yaml
+
+from collections import OrderedDict
+from collections.abc import Callable
+from functools import partial
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import transformers
+
+if TYPE_CHECKING:
+    from descriptor_collector import DescriptorMinerCollector, MinerDescriptor
+
+
+# miner, process name, module and class of the built-in collectors
+BUILTIN_COLLECTORS = (
+    ('t-rex', 't-rex', 'trex_collector', 'TrexCollector'),
+    ('lolMiner', 'lolminer', 'lolminer_collector', 'LolminerCollector'),
+)
+BUILTIN_DESCRIPTOR_DIR = pathlib.Path(__file__).parent.parent / 'miners'
+
+DESCRIPTOR_FILE_KEYS = frozenset([
+    'miner', 'process_name', 'process_match', 'api_url', 'gpus_path', 'gpu_count_path', 'algorithms_path',
+    'miner_labels', 'miner_counter_metrics', 'miner_gauge_metrics',
+    'gpu_labels', 'gpu_counter_metrics', 'gpu_gauge_metrics', 'log_patterns', 'log_gpu_label',
+])
+# how a process name is matched: contained in the process's name, or the whole name (without a Windows `.exe`)
+PROCESS_MATCHES = ('substring', 'exact')
+TABLE_KEYS = ('miner_labels', 'miner_counter_metrics', 'miner_gauge_metrics',
+              'gpu_labels', 'gpu_counter_metrics', 'gpu_gauge_metrics')
+
+
+def resolve_transform(spec) -> Callable:
+    # Data files name transforms from the `transformers` module: `si_suffixed`, or `{scale: 1000000}` /
+    # `{pow10: [Total_Performance, Performance_Factor]}` for the leading arguments of one
+    if isinstance(spec, dict):
+        if len(spec) != 1:
+            raise ValueError(f'A transform takes one name and its arguments, got {spec!r}')
+        name, args = next(iter(spec.items()))
+        args = args if isinstance(args, list) else [args]
+    else:
+        name, args = spec, []
+    transform = getattr(transformers, str(name), None) if not str(name).startswith('_') else None
+    if not callable(transform) or isinstance(transform, type):
+        raise ValueError(f'Unknown transform {name!r}')
+    return partial(transform, *args) if args else transform
+
+
+def _resolve_desc(desc: Dict) -> Dict:
+    resolved = dict(desc)
+    if 'transform' in resolved:
+        resolved['transform'] = resolve_transform(resolved['transform'])
+    if 'coalesce' in resolved:
+        resolved['coalesce'] = [_resolve_desc(coalesced) for coalesced in resolved['coalesce']]
+    return resolved
+
+
+def _resolve_table(table: Optional[Dict]) -> OrderedDict[str, Dict]:
+    return OrderedDict((name, _resolve_desc(desc or {})) for name, desc in (table or {}).items())
+
+
+def read_descriptor_file(path: pathlib.Path) -> Dict:
+    with path.open('r') as f:
+        data = yaml.safe_load(f) or {}
+    unknown = data.keys() - DESCRIPTOR_FILE_KEYS
+    if unknown:
+        raise ValueError(f'Unknown keys in miner descriptor {path}: {sorted(unknown)}')
+    for key in ('miner', 'process_name'):
+        if not data.get(key):
+            raise ValueError(f'Missing {key} in miner descriptor {path}')
+    if data.get('process_match', PROCESS_MATCHES[0]) not in PROCESS_MATCHES:
+        raise ValueError(f'Unknown process_match {data["process_match"]!r} in miner descriptor {path}, '
+                         f'expected one of {list(PROCESS_MATCHES)}')
+    # transforms are resolved here, so a bad name shows up at startup rather than when the miner is detected
+    data.update({key: _resolve_table(data.get(key)) for key in TABLE_KEYS})
+    return data
+
+
+def compile_descriptor(data: Dict) -> 'MinerDescriptor':
+    from descriptor_collector import MinerDescriptor
+    return MinerDescriptor(str(data['miner']), str(data['process_name']), data.get('api_url'),
+                           gpus_path=data.get('gpus_path'), gpu_count_path=data.get('gpu_count_path'),
+                           algorithms_path=data.get('algorithms_path'), **{key: data[key] for key in TABLE_KEYS})
+
+
+def load_descriptor(path: pathlib.Path) -> 'MinerDescriptor':
+    return compile_descriptor(read_descriptor_file(path))
+
+
+def _builtin_collector(module: str, name: str) -> type['DescriptorMinerCollector']:
+    return getattr(importlib.import_module(module), name)
+
+
+def _descriptor_collector(data: Dict) -> type['DescriptorMinerCollector']:
+    from descriptor_collector import DescriptorMinerCollector
+    return DescriptorMinerCollector.for_descriptor(compile_descriptor(data), log_patterns=data.get('log_patterns'),
+                                                   log_gpu_label=data.get('log_gpu_label'))
+
+
+class MinerEntry:
+    # A supported miner; its collector class (module import, descriptor compilation) is only loaded on first use
+    def __init__(self, miner: str, process_name: str, load: Callable[[], type['DescriptorMinerCollector']],
+                 process_match: str = 'substring'):
+        self.miner = miner
+        self.process_name = process_name.lower()
+        self.exact = process_match == 'exact'
+        self._load = load
+        self._collector_class = None
+
+    def matches(self, name: str) -> bool:
+        # against a lowercase process name
+        if self.exact:
+            return name == self.process_name or name == self.process_name + '.exe'
+        return self.process_name in name
+
+    @property
+    def collector_class(self) -> type['DescriptorMinerCollector']:
+        if self._collector_class is None:
+            self._collector_class = self._load()
+        return self._collector_class
+
+
+class MinerRegistry:
+    # The supported miners, keyed by lowercase miner name: the built-in ones, then the `*.yaml` descriptors in
+    # `miners/` and in any `miners.descriptor_dirs` from the config. A data file for an already registered miner
+    # replaces it. Data files are read and checked up front; collectors are imported and descriptors compiled (once)
+    # when their miner is first detected or targeted.
+    def __init__(self):
+        self.entries: OrderedDict[str, MinerEntry] = OrderedDict()
+        for miner, process_name, module, name in BUILTIN_COLLECTORS:
+            self.register(MinerEntry(miner, process_name, partial(_builtin_collector, module, name)))
+
+    @staticmethod
+    def from_config(config: Optional[Dict]) -> 'MinerRegistry':
+        miners_config = (config or {}).get('miners', {})
+        registry = MinerRegistry()
+        registry.load_dir(BUILTIN_DESCRIPTOR_DIR)
+        for directory in miners_config.get('descriptor_dirs') or []:
+            registry.load_dir(pathlib.Path(directory))
+        return registry
+
+    def register(self, entry: MinerEntry) -> None:
+        self.entries[entry.miner.lower()] = entry
+
+    def load_dir(self, directory: pathlib.Path) -> None:
+        if not directory.is_dir():
+            print(f'Miner descriptor directory {directory} not found')  # TODO logger, stderr
+            return
+        for path in sorted(directory.glob('*.yaml')):
+            data = read_descriptor_file(path)
+            self.register(MinerEntry(str(data['miner']), str(data['process_name']),
+                                     partial(_descriptor_collector, data),
+                                     str(data.get('process_match', PROCESS_MATCHES[0]))))
+
+    def collector_class(self, miner: str) -> Optional[type['DescriptorMinerCollector']]:
+        entry = self.entries.get(miner.lower())
+        return entry.collector_class if entry else None
+
+    @property
+    def miners(self) -> List[str]:
+        return list(self.entries)
+
+    def process_entries(self) -> List[MinerEntry]:
+        # Longest first, so a process is claimed by the most specific match (`lolminer` before a bare `miner`)
+        return sorted(self.entries.values(), key=lambda entry: -len(entry.process_name))
@@ -0,0 +1,202 @@
+import os
+import pathlib
+import signal
+import sys
+import threading
+import time
+import yaml
+
+from concurrent.futures import ThreadPoolExecutor
+from prometheus_client.core import REGISTRY, GaugeMetricFamily
+from socket import socket
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import transformers
+from gpu_config import GpuConfig
+from metric_wrappers import merge_metric_families
+from miner_discovery import MinerDiscovery, MinerTargets
+from scrape_scope import ScrapeScope
+from self_metrics import phase, profiled_scrape, profiling, request_profile
+from snapshot_poller import SnapshotPoller
+
+if TYPE_CHECKING:
+    from abstract_miner_collector import AbstractMinerCollector
+
+
+CONFIG_FILE = pathlib.Path(os.environ.get('MINING_COLLECTOR_CONFIG') or
+                           pathlib.Path(__file__).parent.parent / 'config.yaml')
+DEFAULT_MAX_WORKERS = 4
+MAX_WORKERS_LIMIT = 64
+
+
+class MiningCollector:
+    def __init__(self, config: Optional[Dict] = None):
+        if config is not None:
+            self.config = config
+        elif CONFIG_FILE.exists():
+            with CONFIG_FILE.open('r') as f:
+                self.config = yaml.full_load(f)
+        else:
+            self.config = None
+
+        # from pprint import pprint
+        # pprint(self.config)
+
+        transformers.configure_caches(
+            int((self.config or {}).get('transform_cache', {}).get('maxsize', transformers.DEFAULT_CACHE_SIZE)))
+        # the `gpus` section is reloaded when config.yaml changes, the rest of it needs a restart
+        self.gpu_config = GpuConfig.from_config(self.config, CONFIG_FILE if config is None and self.config else None)
+        self.discovery = MinerTargets.from_config(self.config, self.gpu_config) or \
+            MinerDiscovery(self.config, gpu_config=self.gpu_config)
+        # collected alongside the miners on every scrape
+        self.sources: List['AbstractMinerCollector'] = []
+        if (self.config or {}).get('gpu_telemetry', {}).get('enabled'):
+            from gpu_telemetry_collector import GpuTelemetryCollector
+            self.sources.append(GpuTelemetryCollector.from_config(self.config))
+        if (self.config or {}).get('miner_logs', {}).get('files'):
+            from log_tailer import MinerLogCollector
+            self.sources.extend(MinerLogCollector.from_config(self.config, self.discovery))
+        # one thread per target when polling a farm, so a scrape still takes about as long as the slowest miner
+        target_count = len((self.config or {}).get('targets') or [])
+        max_workers = (self.config or {}).get('http', {}).get('max_concurrent_requests',
+                                                              min(max(DEFAULT_MAX_WORKERS, target_count),
+                                                                  MAX_WORKERS_LIMIT))
+        self.async_engine = (self.config or {}).get('engine') == 'async'
+        self._executor = ThreadPoolExecutor(max_workers=int(max_workers), thread_name_prefix='miner-collect')
+        if self.async_engine:
+            from async_engine import AsyncEngine
+            self.poller = AsyncEngine.from_config(self, self.config)
+        else:
+            self.poller = SnapshotPoller.from_config(self.live_collect, self.config)
+        # Without a poller, push and history ticks reuse the last full result while it's at most this old (see run())
+        self.background_max_age_sec = 0.0
+        self._last_result: Optional[Tuple[float, List]] = None
+        self._background = threading.local()
+        self._background_lock = threading.Lock()
+        self.exposition = None
+        if (self.config or {}).get('exposition', {}).get('renderer') == 'direct':
+            from text_exposition import DirectExposition
+            self.exposition = DirectExposition(snapshot=lambda: self.poller.snapshot if self.poller else None)
+
+    def find_collectors(self) -> List['AbstractMinerCollector']:
+        return self.discovery.find_collectors() + self.sources
+
+    def discovery_metrics(self):
+        duration = GaugeMetricFamily('mining_collector_discovery_duration_sec',
+                                     'time spent finding the running miner on the last scrape')
+        duration.add_metric([], self.discovery.last_duration_sec)
+        yield duration
+
+        cache_hit = GaugeMetricFamily('mining_collector_discovery_cache_hit',
+                                      'whether the last scrape reused the previously discovered miner')
+        cache_hit.add_metric([], 1 if self.discovery.last_cache_hit else 0)
+        yield cache_hit
+
+    def live_collect(self, scope: Optional[ScrapeScope] = None):
+        with profiled_scrape(), phase('collect'):
+            metrics = self._collect(scope)
+        if scope is None:
+            self._last_result = (time.monotonic(), metrics)
+        return metrics
+
+    def _collect(self, scope: Optional[ScrapeScope] = None):
+        with phase('discovery'):
+            collectors = self.find_collectors()
+        if scope is None:
+            metrics = list(self.discovery_metrics())
+        else:
+            collectors = [collector for collector in collectors if scope.wants_collector(collector)]
+            metrics = []
+
+        # Miners are queried concurrently so a scrape takes as long as the slowest miner, not the sum of all of
+        # them. A profiled scrape stays on this thread so the profiler sees everything.
+        if len(collectors) == 1 or profiling():
+            results = [collector.collect(scope) for collector in collectors]
+        else:
+            results = self._executor.map(lambda collector: collector.collect(scope), collectors)
+        metrics.extend(merge_metric_families(metric for result in results for metric in result))
+        return metrics
+
+    def recent_result(self):
+        # For push and history ticks: a recent enough full result, or a new one that isn't counted as a scrape
+        with self._background_lock:
+            last = self._last_result
+            if last is None or time.monotonic() - last[0] > self.background_max_age_sec:
+                last = self._last_result = (time.monotonic(), self._collect())
+            return last[1]
+
+    def background_collect(self):
+        # The registry as push and history record it: from the poller's snapshot if there is one (as for scrapes),
+        # otherwise from `recent_result`
+        self._background.active = True
+        try:
+            return list(REGISTRY.collect())
+        finally:
+            self._background.active = False
+
+    def scoped_collect(self, scope: ScrapeScope):
+        if not self.poller:
+            return self.live_collect(scope)
+        snapshot = self.poller.snapshot
+        return scope.filter(snapshot.metrics) if snapshot else []
+
+    def describe(self):
+        # Without this, registering runs a full collect under the registry lock, which deadlocks as soon as that
+        # collect lazily imports a module defining its own metrics (and delays binding the exposition server)
+        return []
+
+    def collect(self):
+        if not self.poller:
+            yield from self.recent_result() if getattr(self._background, 'active', False) else self.live_collect()
+            return
+
+        # Past max staleness nothing is served, rather than serving old data
+        snapshot = self.poller.snapshot
+        if snapshot:
+            yield from snapshot.metrics
+
+        latest = self.poller.latest
+        if latest:
+            age = GaugeMetricFamily('mining_collector_snapshot_age_sec',
+                                    'age of the most recent background poll of the miner')
+            age.add_metric([], latest.age_sec)
+            yield age
+
+
+def run(listen_socket: socket) -> None:
+    # Modules only some setups need (the async engine, push mode, history, GPU telemetry, each miner's collector) are
+    # imported once they turn out to be needed
+    signal.signal(signal.SIGUSR1, request_profile)
+    mining_collector = MiningCollector()
+    REGISTRY.register(mining_collector)
+    background = []
+    if (mining_collector.config or {}).get('push', {}).get('url'):
+        # for rigs Prometheus can't reach; scrapes keep working alongside
+        from push_exporter import PushExporter
+        background.append(PushExporter.from_config(mining_collector.background_collect, mining_collector.config))
+    if (mining_collector.config or {}).get('history', {}).get('enabled'):
+        # recent history kept on the rig, for when Prometheus or the link is down
+        from history_store import HistoryRecorder
+        background.append(HistoryRecorder.from_config(mining_collector.background_collect, mining_collector.config))
+    # so their ticks share one result (and a scrape's), rather than each querying every miner again
+    mining_collector.background_max_age_sec = min((task.interval_sec for task in background), default=0.0)
+    for task in background:
+        task.start()
+    # systemd stops the service with SIGTERM; exiting through SystemExit lets the background tasks stop cleanly
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        if mining_collector.async_engine:
+            import asyncio
+            asyncio.run(mining_collector.poller.serve(listen_socket))
+        else:
+            from scoped_exposition import start_http_server
+            if mining_collector.poller:
+                mining_collector.poller.start()
+            start_http_server(mining_collector.scoped_collect, listen_socket=listen_socket,
+                              exposition=mining_collector.exposition)
+            while True:
+                time.sleep(1)
+    finally:
+        # the push exporter buffers the snapshots of its unfinished batch
+        for task in background:
+            task.stop()
@@ -0,0 +1,311 @@
+import gzip
+import os
+import pathlib
+import struct
+import threading
+import time
+import traceback
+
+import requests
+
+from collections import deque
+from collections.abc import Callable
+from prometheus_client import Counter, Gauge, generate_latest
+from prometheus_client.core import Metric
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from scoped_exposition import MetricsView
+
+
+IMPORT = 'import'
+PUSHGATEWAY = 'pushgateway'
+
+DEFAULT_INTERVAL_SEC = 15.0
+DEFAULT_BATCH_SIZE = 4
+DEFAULT_TIMEOUT_SEC = 10.0
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF_SEC = 1.0
+DEFAULT_BUFFER_MAX_MB = 64
+DEFAULT_DRAIN_MAX_MB = 4
+SEGMENTS_PER_BUFFER = 8
+
+RECORD_HEADER = struct.Struct('>I')
+
+PUSHES = Counter(
+    'mining_collector_push_requests',
+    'number of push requests, by result (ok, retry, failed, rejected)',
+    ['result'],
+)
+PUSHED_BYTES = Counter(
+    'mining_collector_push_bytes',
+    'compressed bytes pushed',
+)
+PUSH_BACKLOG_BYTES = Gauge(
+    'mining_collector_push_backlog_bytes',
+    'bytes of batches buffered while the push endpoint is unreachable',
+)
+PUSH_BACKLOG_DROPPED = Counter(
+    'mining_collector_push_backlog_dropped_bytes',
+    'bytes of buffered batches dropped to stay within the buffer size',
+)
+
+
+class DiskBuffer:
+    # Bounded append-only buffer of compressed batches: length-prefixed records in numbered segment files. Full
+    # segments are drained (or dropped when over the size limit) oldest first, and a segment is only deleted once all
+    # of it was pushed, so a crash while draining at worst pushes some batches twice.
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.segment_bytes = max(1, max_bytes // SEGMENTS_PER_BUFFER)
+        self._active: Optional[pathlib.Path] = None
+        self._update_gauge()
+
+    def _segments(self) -> List[pathlib.Path]:
+        return sorted(self.directory.glob('*.seg'))
+
+    def size(self) -> int:
+        return sum(segment.stat().st_size for segment in self._segments())
+
+    def _update_gauge(self) -> None:
+        PUSH_BACKLOG_BYTES.set(self.size())
+
+    def __len__(self) -> int:
+        return len(self._segments())
+
+    def append(self, payload: bytes) -> None:
+        if self._active is None or not self._active.exists() or self._active.stat().st_size >= self.segment_bytes:
+            segments = self._segments()
+            number = int(segments[-1].stem) + 1 if segments else 0
+            self._active = self.directory / f'{number:012d}.seg'
+        with self._active.open('ab') as f:
+            f.write(RECORD_HEADER.pack(len(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+        segments = self._segments()
+        size = sum(segment.stat().st_size for segment in segments)
+        while size > self.max_bytes and len(segments) > 1:
+            oldest = segments.pop(0)
+            dropped = oldest.stat().st_size
+            oldest.unlink()
+            size -= dropped
+            PUSH_BACKLOG_DROPPED.inc(dropped)
+        PUSH_BACKLOG_BYTES.set(size)
+
+    def oldest(self, max_bytes: int) -> Tuple[List[pathlib.Path], List[bytes]]:
+        # Whole segments from the oldest, up to about max_bytes of records
+        paths, records, size = [], [], 0
+        for segment in self._segments():
+            if paths and size + segment.stat().st_size > max_bytes:
+                break
+            if segment == self._active:
+                # nothing is appended while draining; start a new segment after this one
+                self._active = None
+            data = segment.read_bytes()
+            position = 0
+            while position + RECORD_HEADER.size <= len(data):
+                (length,) = RECORD_HEADER.unpack_from(data, position)
+                position += RECORD_HEADER.size
+                if position + length > len(data):
+                    # torn write from a crash, the rest of the segment is unusable
+                    break
+                records.append(data[position:position + length])
+                position += length
+            paths.append(segment)
+            size += len(data)
+        return paths, records
+
+    def remove(self, paths: Iterable[pathlib.Path]) -> None:
+        for path in paths:
+            path.unlink(missing_ok=True)
+        self._update_gauge()
+
+
+class MemoryBuffer:
+    # Same interface as DiskBuffer when no buffer_dir is configured; the backlog is lost on restart
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._batches: Deque[bytes] = deque()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._batches)
+
+    def append(self, payload: bytes) -> None:
+        self._batches.append(payload)
+        self._size += len(payload)
+        while self._size > self.max_bytes and len(self._batches) > 1:
+            dropped = len(self._batches.popleft())
+            self._size -= dropped
+            PUSH_BACKLOG_DROPPED.inc(dropped)
+        PUSH_BACKLOG_BYTES.set(self._size)
+
+    def oldest(self, max_bytes: int) -> Tuple[List[int], List[bytes]]:
+        records, size = [], 0
+        for payload in self._batches:
+            if records and size + len(payload) > max_bytes:
+                break
+            records.append(payload)
+            size += len(payload)
+        return [len(records)], records
+
+    def remove(self, counts: Iterable[int]) -> None:
+        for _ in range(sum(counts)):
+            self._size -= len(self._batches.popleft())
+        PUSH_BACKLOG_BYTES.set(self._size)
+
+
+def _stamped(metrics: Iterable[Metric], timestamp: float) -> List[Metric]:
+    # Backlogged batches arrive late, so every sample needs its own timestamp
+    stamped = []
+    for metric in metrics:
+        if all(sample.timestamp is not None for sample in metric.samples):
+            stamped.append(metric)
+            continue
+        copied = Metric(metric.name, metric.documentation, metric.type, metric.unit)
+        copied.samples = [sample if sample.timestamp is not None else sample._replace(timestamp=timestamp)
+                          for sample in metric.samples]
+        stamped.append(copied)
+    return stamped
+
+
+def _unstamped(metrics: Iterable[Metric]) -> List[Metric]:
+    # The Pushgateway rejects samples with timestamps
+    unstamped = []
+    for metric in metrics:
+        copied = Metric(metric.name, metric.documentation, metric.type, metric.unit)
+        copied.samples = [sample._replace(timestamp=None) for sample in metric.samples]
+        unstamped.append(copied)
+    return unstamped
+
+
+class PushExporter:
+    # Pushes for rigs Prometheus can't scrape. `import` mode sends timestamped text exposition (e.g. VictoriaMetrics'
+    # /api/v1/import/prometheus) in gzipped batches, buffering batches that can't be delivered and draining them in
+    # bulk once the endpoint is back. `pushgateway` mode PUTs each snapshot without timestamps; the Pushgateway only
+    # keeps the latest push, so nothing is buffered.
+    def __init__(self,
+                 collect: Callable[[], Iterable[Metric]],
+                 url: str,
+                 mode: str = IMPORT,
+                 interval_sec: float = DEFAULT_INTERVAL_SEC,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 timeout_sec: float = DEFAULT_TIMEOUT_SEC,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 retry_backoff_sec: float = DEFAULT_RETRY_BACKOFF_SEC,
+                 buffer_dir: Optional[str] = None,
+                 buffer_max_bytes: int = DEFAULT_BUFFER_MAX_MB * 1024 * 1024,
+                 drain_max_bytes: int = DEFAULT_DRAIN_MAX_MB * 1024 * 1024
+                 ):
+        if mode not in (IMPORT, PUSHGATEWAY):
+            raise ValueError(f'Unknown push mode {mode!r}, expected {IMPORT} or {PUSHGATEWAY}')
+        self.collect = collect
+        self.url = url
+        self.mode = mode
+        self.interval_sec = interval_sec
+        self.batch_size = 1 if mode == PUSHGATEWAY else max(1, batch_size)
+        self.timeout_sec = timeout_sec
+        self.max_retries = max_retries
+        self.retry_backoff_sec = retry_backoff_sec
+        self.drain_max_bytes = drain_max_bytes
+        self.buffer = DiskBuffer(buffer_dir, buffer_max_bytes) if buffer_dir else MemoryBuffer(buffer_max_bytes)
+        self.session = requests.Session()
+        self._batch: List[bytes] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='push-exporter', daemon=True)
+
+    @staticmethod
+    def from_config(collect: Callable[[], Iterable[Metric]], config: Optional[Dict]) -> Optional['PushExporter']:
+        push_config = (config or {}).get('push', {})
+        if not push_config.get('url'):
+            return None
+        return PushExporter(
+            collect,
+            push_config['url'],
+            mode=push_config.get('mode', IMPORT),
+            interval_sec=float(push_config.get('interval_sec', DEFAULT_INTERVAL_SEC)),
+            batch_size=int(push_config.get('batch_size', DEFAULT_BATCH_SIZE)),
+            timeout_sec=float(push_config.get('timeout_sec', DEFAULT_TIMEOUT_SEC)),
+            max_retries=int(push_config.get('max_retries', DEFAULT_MAX_RETRIES)),
+            retry_backoff_sec=float(push_config.get('retry_backoff_sec', DEFAULT_RETRY_BACKOFF_SEC)),
+            buffer_dir=push_config.get('buffer_dir'),
+            buffer_max_bytes=int(float(push_config.get('buffer_max_mb', DEFAULT_BUFFER_MAX_MB)) * 1024 * 1024),
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        # snapshots of a batch that isn't full yet are buffered rather than lost (and sent after a restart when the
+        # buffer is on disk)
+        if self._batch:
+            self.buffer.append(gzip.compress(b''.join(self._batch)))
+            self._batch = []
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.push_once()
+            except Exception:
+                traceback.print_exc()
+            self._stop.wait(max(0.0, self.interval_sec - (time.monotonic() - started)))
+
+    def encode(self, metrics: Iterable[Metric], timestamp: float) -> bytes:
+        metrics = _unstamped(metrics) if self.mode == PUSHGATEWAY else _stamped(metrics, timestamp)
+        return generate_latest(MetricsView(metrics))
+
+    def push_once(self) -> None:
+        self._batch.append(self.encode(self.collect(), time.time()))
+        if len(self._batch) < self.batch_size:
+            return
+        # gzip members can be concatenated, so batches from the buffer can later be sent together as they are
+        payload = gzip.compress(b''.join(self._batch))
+        self._batch = []
+
+        if self.mode == PUSHGATEWAY:
+            # a Pushgateway only keeps the latest push anyway, there's nothing to catch up on
+            self._send(payload)
+            return
+        # the backlog goes first so the endpoint receives batches in order
+        if (len(self.buffer) and not self.drain()) or not self._send(payload):
+            self.buffer.append(payload)
+
+    def drain(self) -> bool:
+        # Sends the backlog oldest first, in bulk, until it's empty or the endpoint fails again
+        while len(self.buffer):
+            handles, records = self.buffer.oldest(self.drain_max_bytes)
+            if records and not self._send(b''.join(records)):
+                return False
+            self.buffer.remove(handles)
+        return True
+
+    def _send(self, payload: bytes) -> bool:
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                if self._stop.wait(self.retry_backoff_sec * 2 ** (attempt - 1)):
+                    break
+            try:
+                response = self.session.request('PUT' if self.mode == PUSHGATEWAY else 'POST', self.url,
+                                                data=payload, timeout=self.timeout_sec,
+                                                headers={'Content-Encoding': 'gzip',
+                                                         'Content-Type': 'text/plain; version=0.0.4'})
+                if response.status_code < 500:
+                    response.raise_for_status()
+                    PUSHES.labels('ok').inc()
+                    PUSHED_BYTES.inc(len(payload))
+                    return True
+                PUSHES.labels('retry').inc()
+            except requests.HTTPError as e:
+                # a 4xx won't get better by retrying or buffering, and would block the backlog behind it
+                PUSHES.labels('rejected').inc()
+                print(f'Push to {self.url} rejected, dropping the batch: {e}')  # TODO logger, stderr
+                return True
+            except requests.RequestException:
+                PUSHES.labels('retry').inc()
+        PUSHES.labels('failed').inc()
+        return False
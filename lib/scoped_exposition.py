@@ -0,0 +1,90 @@
+import gzip
+import socket
+import threading
+
+from prometheus_client import REGISTRY, make_wsgi_app
+from prometheus_client.core import Metric
+from prometheus_client.exposition import CONTENT_TYPE_LATEST, ThreadingWSGIServer, choose_encoder, gzip_accepted
+from typing import TYPE_CHECKING, Callable, Iterable, List, Optional
+from urllib.parse import parse_qs
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+from scrape_scope import ScrapeScope
+
+if TYPE_CHECKING:
+    from text_exposition import DirectExposition, TextRenderer
+
+
+class MetricsView:
+    # Just enough of a registry for the exposition encoders
+    def __init__(self, metrics: Iterable[Metric]):
+        self.metrics = metrics
+
+    def collect(self) -> Iterable[Metric]:
+        return self.metrics
+
+
+def encode_scoped(metrics: List[Metric], accept: str = None, accept_encoding: str = None,
+                  renderer: Optional['TextRenderer'] = None):
+    encoder, content_type = choose_encoder(accept)
+    if renderer and content_type == CONTENT_TYPE_LATEST:
+        output = renderer.render(metrics)
+    else:
+        output = encoder(MetricsView(metrics))
+    headers = [('Content-Type', content_type)]
+    if gzip_accepted(accept_encoding or ''):
+        output = gzip.compress(output)
+        headers.append(('Content-Encoding', 'gzip'))
+    return headers, output
+
+
+def direct_exposition_applies(environ) -> bool:
+    # The direct renderer only writes the text format; OpenMetrics and `name[]` requests go through prometheus_client
+    return choose_encoder(environ.get('HTTP_ACCEPT'))[1] == CONTENT_TYPE_LATEST and \
+        'name[]' not in parse_qs(environ.get('QUERY_STRING', '')) and environ.get('PATH_INFO') != '/favicon.ico'
+
+
+def make_scoped_wsgi_app(scoped_collect: Callable[[ScrapeScope], List[Metric]], registry=REGISTRY,
+                         exposition: Optional['DirectExposition'] = None):
+    # Plain scrapes are served from the registry as before (or from `exposition`, the direct renderer); `?miner=`,
+    # `?host=`, `?family=` and `/metrics/gpu/<pci_id>` only collect what they ask for
+    registry_app = make_wsgi_app(registry)
+    renderer = exposition.renderer if exposition else None
+
+    def app(environ, start_response):
+        scope = ScrapeScope.from_request(environ.get('PATH_INFO', '/'), environ.get('QUERY_STRING', ''))
+        if scope.unscoped:
+            if not exposition or not direct_exposition_applies(environ):
+                return registry_app(environ, start_response)
+            headers, output = exposition.encode(environ.get('HTTP_ACCEPT_ENCODING'))
+            start_response('200 OK', headers)
+            return [output]
+        headers, output = encode_scoped(scoped_collect(scope), environ.get('HTTP_ACCEPT'),
+                                        environ.get('HTTP_ACCEPT_ENCODING'), renderer)
+        start_response('200 OK', headers)
+        return [output]
+
+    return app
+
+
+class _SilentHandler(WSGIRequestHandler):
+    def log_message(self, *_):
+        pass
+
+
+def start_http_server(scoped_collect: Callable[[ScrapeScope], List[Metric]], port: int = 0, addr: str = '0.0.0.0',
+                      registry=REGISTRY, listen_socket: Optional[socket.socket] = None,
+                      exposition: Optional['DirectExposition'] = None) -> None:
+    app = make_scoped_wsgi_app(scoped_collect, registry, exposition)
+    if listen_socket is None:
+        httpd = make_server(addr, port, app, ThreadingWSGIServer, handler_class=_SilentHandler)
+    else:
+        # already bound and listening (see main.py); connections that queued up meanwhile are served now
+        httpd = ThreadingWSGIServer(listen_socket.getsockname()[:2], _SilentHandler, bind_and_activate=False)
+        httpd.socket.close()
+        httpd.socket = listen_socket
+        httpd.server_address = listen_socket.getsockname()
+        httpd.server_name, httpd.server_port = httpd.server_address[:2]
+        httpd.setup_environ()
+        httpd.set_app(app)
+    threading.Thread(target=httpd.serve_forever, name='metrics-http', daemon=True).start()
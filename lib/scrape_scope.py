@@ -0,0 +1,103 @@
+from prometheus_client.core import Metric
+from typing import Dict, Iterable, List, Optional, Sequence
+from urllib.parse import parse_qs
+
+from metric_wrappers import MetricSchema
+
+
+GPU_PATH_PREFIX = '/metrics/gpu/'
+PCI_ID_LABEL = 'device_pci_id'
+
+
+def _split_values(values: Sequence[str]) -> List[str]:
+    return [value for joined in values for value in joined.split(',') if value]
+
+
+class ScrapeScope:
+    # What a scoped scrape asks for: some miners (by miner type or host), some metric families and/or a single GPU.
+    # Collectors only extract what is in scope; results that were already extracted are narrowed down with `filter`.
+    def __init__(self,
+                 miners: Iterable[str] = (),
+                 hosts: Iterable[str] = (),
+                 families: Iterable[str] = (),
+                 pci_id: Optional[str] = None
+                 ):
+        self.miners = frozenset(miner.lower() for miner in miners)
+        self.hosts = frozenset(hosts)
+        self.families = frozenset(family if family.startswith('mining_') else f'mining_{family}'
+                                  for family in families)
+        self.pci_id = pci_id.lower() if pci_id else None
+        self._indexes: Dict[int, List[int]] = {}
+
+    @staticmethod
+    def from_request(path: str, query: str) -> 'ScrapeScope':
+        # `?miner=t-rex&family=gpu_hashrate` (repeated or comma separated) and/or `/metrics/gpu/<pci_id>`
+        params = parse_qs(query)
+        pci_id = path[len(GPU_PATH_PREFIX):].strip('/') if path.startswith(GPU_PATH_PREFIX) else None
+        return ScrapeScope(_split_values(params.get('miner', [])),
+                           _split_values(params.get('host', [])),
+                           _split_values(params.get('family', [])),
+                           pci_id)
+
+    @property
+    def unscoped(self) -> bool:
+        return not (self.miners or self.hosts or self.families or self.pci_id)
+
+    def wants_collector(self, collector) -> bool:
+        miner = getattr(collector, 'miner', None)
+        if self.miners and (miner is None or miner.lower() not in self.miners):
+            return False
+        return not self.hosts or getattr(collector, 'host', None) in self.hosts
+
+    def wants_family(self, name: str) -> bool:
+        return not self.families or name in self.families
+
+    def metric_indexes(self, schema: MetricSchema, indexes: Optional[Sequence[int]] = None) -> Optional[List[int]]:
+        # The schema's metrics to extract, narrowed down from `indexes` (None meaning all of them)
+        if not self.families and indexes is None:
+            return None
+        wanted = self._indexes.get(id(schema))
+        if wanted is None:
+            wanted = [index for index, metric in enumerate(schema.metrics) if self.wants_family(metric.plan.full_name)]
+            self._indexes[id(schema)] = wanted
+        return wanted if indexes is None else [index for index in indexes if index in wanted]
+
+    def miner_metric_indexes(self, schema: MetricSchema,
+                             indexes: Optional[Sequence[int]] = None) -> Optional[List[int]]:
+        # A single GPU's scrape has no miner-level families
+        if self.pci_id:
+            return []
+        return self.metric_indexes(schema, indexes)
+
+    def wants_gpu(self, schema: MetricSchema, label_values: Sequence[str]) -> bool:
+        if not self.pci_id:
+            return True
+        # a GPU whose schema has no PCI ID (a descriptor file may define one) can't be the one asked for
+        index = schema.label_indexes.get(PCI_ID_LABEL)
+        return index is not None and label_values[index].lower() == self.pci_id
+
+    @staticmethod
+    def select(families: List[Metric], indexes: Optional[Sequence[int]]) -> List[Metric]:
+        return families if indexes is None else [families[index] for index in indexes]
+
+    def wants_sample_labels(self, labels: Dict[str, str]) -> bool:
+        if self.miners and labels.get('miner', '').lower() not in self.miners:
+            return False
+        if self.hosts and labels.get('host') not in self.hosts:
+            return False
+        return not self.pci_id or labels.get(PCI_ID_LABEL, '').lower() == self.pci_id
+
+    def filter(self, metrics: Iterable[Metric]) -> List[Metric]:
+        # For results that were extracted in full (snapshots, cached responses); the families are copied, not changed
+        filtered = []
+        for metric in metrics:
+            if not self.wants_family(metric.name) or metric.name.startswith('mining_collector_'):
+                continue
+            if self.miners or self.hosts or self.pci_id:
+                scoped = Metric(metric.name, metric.documentation, metric.type, metric.unit)
+                scoped.samples = [sample for sample in metric.samples if self.wants_sample_labels(sample.labels)]
+                if not scoped.samples:
+                    continue
+                metric = scoped
+            filtered.append(metric)
+        return filtered
@@ -0,0 +1,113 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
+from typing import List, Optional, Tuple
+
+
+PHASE_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+API_REQUEST_DURATION = Histogram(
+    'mining_collector_api_request_duration_sec',
+    'time spent requesting data from the miner API',
+    ['host', 'miner'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0),
+)
+API_REQUEST_FAILURES = Counter(
+    'mining_collector_api_request_failures',
+    'number of failed miner API requests',
+    ['host', 'miner', 'reason'],
+)
+MINER_UP = Gauge(
+    'mining_collector_miner_up',
+    'whether the last attempt to collect from the miner API got a valid response',
+    ['host', 'miner'],
+)
+PHASE_DURATION = Histogram(
+    'mining_collector_phase_duration_sec',
+    'time spent in each phase of a scrape (discovery, fetch, decode, extract, derive, collect)',
+    ['miner', 'phase'],
+    buckets=PHASE_BUCKETS,
+)
+SAMPLES_EMITTED = Counter(
+    'mining_collector_samples_emitted',
+    'number of samples produced from miner API responses',
+    ['host', 'miner'],
+)
+SAMPLES_DROPPED = Counter(
+    'mining_collector_samples_dropped',
+    'number of samples dropped by their transform (e.g. only_above_0)',
+    ['host', 'miner'],
+)
+COLLECT_ERRORS = Counter(
+    'mining_collector_collect_errors',
+    'number of unexpected errors while collecting from a miner',
+    ['host', 'miner', 'error'],
+)
+
+
+class ScrapeProfile:
+    def __init__(self):
+        self.phases: List[Tuple[str, str, float]] = []
+        self._lock = threading.Lock()
+
+    def record(self, miner: str, phase_name: str, elapsed: float) -> None:
+        with self._lock:
+            self.phases.append((miner, phase_name, elapsed))
+
+    def report(self, profiler: cProfile.Profile) -> str:
+        out = io.StringIO()
+        out.write('Scrape profile, per phase:\n')
+        for miner, phase_name, elapsed in self.phases:
+            out.write(f'  {miner or "-":<12} {phase_name:<10} {elapsed * 1000:>10.3f} ms\n')
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+        return out.getvalue()
+
+
+_profile_requested = threading.Event()
+_active_profile: Optional[ScrapeProfile] = None
+
+
+def request_profile(*_) -> None:
+    # Usable directly as a signal handler: `kill -USR1 <pid>` profiles the next scrape
+    _profile_requested.set()
+
+
+def profiling() -> bool:
+    return _active_profile is not None
+
+
+@contextmanager
+def phase(phase_name: str, miner: str = ''):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        PHASE_DURATION.labels(miner, phase_name).observe(elapsed)
+        profile = _active_profile
+        if profile:
+            profile.record(miner, phase_name, elapsed)
+
+
+@contextmanager
+def profiled_scrape():
+    global _active_profile
+    if not _profile_requested.is_set() or _active_profile is not None:
+        yield
+        return
+
+    _profile_requested.clear()
+    _active_profile = ScrapeProfile()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        print(_active_profile.report(profiler))  # TODO logger, stderr
+        _active_profile = None
@@ -0,0 +1,71 @@
+import threading
+import time
+import traceback
+
+from collections.abc import Callable
+from prometheus_client.core import Metric
+from typing import Dict, Iterable, Optional, Tuple
+
+
+DEFAULT_MAX_STALENESS_SEC = 30.0
+
+
+class Snapshot:
+    def __init__(self, metrics: Iterable[Metric]):
+        self.metrics: Tuple[Metric, ...] = tuple(metrics)
+        self.taken_at = time.monotonic()
+
+    @property
+    def age_sec(self) -> float:
+        return time.monotonic() - self.taken_at
+
+
+class SnapshotPoller:
+    def __init__(self, build: Callable[[], Iterable[Metric]], interval_sec: float, max_staleness_sec: float):
+        self.build = build
+        self.interval_sec = interval_sec
+        self.max_staleness_sec = max_staleness_sec
+        self._snapshot: Optional[Snapshot] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='snapshot-poller', daemon=True)
+
+    @staticmethod
+    def from_config(build: Callable[[], Iterable[Metric]], config: Optional[Dict]) -> Optional['SnapshotPoller']:
+        polling_config = (config or {}).get('polling', {})
+        if not polling_config.get('interval_sec'):
+            return None
+        interval_sec = float(polling_config['interval_sec'])
+        max_staleness_sec = float(polling_config.get('max_staleness_sec', max(DEFAULT_MAX_STALENESS_SEC,
+                                                                              interval_sec * 3)))
+        return SnapshotPoller(build, interval_sec, max_staleness_sec)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def poll_once(self) -> None:
+        try:
+            self._snapshot = Snapshot(self.build())
+        except:
+            # keep serving the previous snapshot until it goes stale
+            traceback.print_exc()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.poll_once()
+            self._stop.wait(max(0.0, self.interval_sec - (time.monotonic() - started)))
+
+    @property
+    def latest(self) -> Optional[Snapshot]:
+        return self._snapshot
+
+    @property
+    def snapshot(self) -> Optional[Snapshot]:
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.age_sec > self.max_staleness_sec:
+            return None
+        return snapshot
@@ -0,0 +1,142 @@
+import gzip
+import io
+import threading
+
+from collections.abc import Callable
+from prometheus_client import REGISTRY, Counter
+from prometheus_client.exposition import CONTENT_TYPE_LATEST, gzip_accepted
+from prometheus_client.core import Metric
+from prometheus_client.utils import floatToGoString
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+DIRECT = 'direct'
+
+# OpenMetrics-only samples, which the text format moves to gauges of their own after the family
+_OM_SUFFIXES = ('_created', '_gsum', '_gcount')
+_TYPE_NAMES = {'info': 'gauge', 'stateset': 'gauge', 'gaugehistogram': 'histogram', 'unknown': 'untyped'}
+
+EXPOSITION_BODIES = Counter(
+    'mining_collector_exposition_bodies',
+    'number of /metrics bodies served by the direct renderer, by whether they were rendered or cached (rendered, '
+    'cached, gzip_cached)',
+    ['result'],
+)
+
+
+def _escape_help(documentation: str) -> str:
+    return documentation.replace('\\', r'\\').replace('\n', r'\n')
+
+
+def render_label_block(labels: Dict[str, str]) -> str:
+    return '{' + ','.join(['{}="{}"'.format(name, value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"'))
+                           for name, value in sorted(labels.items())]) + '}'
+
+
+class TextRenderer:
+    # Writes the text format (0.0.4) byte for byte as prometheus_client's generate_latest does, without sorting and
+    # escaping every sample's labels again: a label set's `{...}` block is rendered once and reused for as long as the
+    # series shows up in consecutive renders. Samples of one label set share their labels dict (see MetricSchema), so
+    # most samples only cost a dict lookup by id.
+    def __init__(self):
+        self._blocks: Dict[Tuple[Tuple[str, str], ...], str] = {}
+        self._buffer = io.StringIO()
+        self._lock = threading.Lock()
+
+    def render(self, metrics: Iterable[Metric]) -> bytes:
+        with self._lock:
+            buffer = self._buffer
+            buffer.seek(0)
+            buffer.truncate()
+            previous, blocks = self._blocks, {}
+            # id -> (labels, block); the labels are kept so an id can't be reused by another dict during the render
+            by_id: Dict[int, Tuple[Dict[str, str], str]] = {}
+            write = buffer.write
+
+            def sample_line(sample) -> str:
+                labels = sample.labels
+                if labels:
+                    known = by_id.get(id(labels))
+                    if known is None:
+                        key = tuple(labels.items())
+                        block = blocks.get(key) or previous.get(key) or render_label_block(labels)
+                        blocks[key] = block
+                        by_id[id(labels)] = (labels, block)
+                    else:
+                        block = known[1]
+                else:
+                    block = ''
+                if sample.timestamp is None:
+                    return f'{sample.name}{block} {floatToGoString(sample.value)}\n'
+                return f'{sample.name}{block} {floatToGoString(sample.value)} {int(float(sample.timestamp) * 1000):d}\n'
+
+            for metric in metrics:
+                name, metric_type = metric.name, metric.type
+                if metric_type == 'counter':
+                    name += '_total'
+                elif metric_type == 'info':
+                    name += '_info'
+                write(f'# HELP {name} {_escape_help(metric.documentation)}\n'
+                      f'# TYPE {name} {_TYPE_NAMES.get(metric_type, metric_type)}\n')
+
+                om_samples: Dict[str, List[str]] = {}
+                for sample in metric.samples:
+                    if sample.name != metric.name and sample.name.startswith(metric.name):
+                        suffix = sample.name[len(metric.name):]
+                        if suffix in _OM_SUFFIXES:
+                            om_samples.setdefault(suffix, []).append(sample_line(sample))
+                            continue
+                    write(sample_line(sample))
+
+                for suffix, lines in sorted(om_samples.items()):
+                    write(f'# HELP {metric.name}{suffix} {_escape_help(metric.documentation)}\n'
+                          f'# TYPE {metric.name}{suffix} gauge\n')
+                    write(''.join(lines))
+
+            # blocks of series that didn't show up in this render are dropped
+            self._blocks = blocks
+            return buffer.getvalue().encode('utf-8')
+
+
+class DirectExposition:
+    # The unscoped /metrics body from TextRenderer. Given the current snapshot (with `polling` or the async engine),
+    # the body is rendered once per snapshot and gzipped once per body, so repeated scrapes are served cached bytes;
+    # the collector's own metrics in the registry then lag by at most one poll. Live scrapes render every time.
+    def __init__(self,
+                 registry=REGISTRY,
+                 snapshot: Callable[[], Optional[object]] = lambda: None
+                 ):
+        self.registry = registry
+        self.snapshot = snapshot
+        self.renderer = TextRenderer()
+        self._body: Tuple[Optional[object], bytes] = (None, b'')
+        self._gzipped: Tuple[bytes, bytes] = (b'', gzip.compress(b''))
+
+    def body(self) -> bytes:
+        snapshot = self.snapshot()
+        rendered_for, body = self._body
+        if snapshot is None or rendered_for is not snapshot:
+            body = self.renderer.render(self.registry.collect())
+            EXPOSITION_BODIES.labels('rendered').inc()
+            if snapshot is not None:
+                self._body = (snapshot, body)
+        else:
+            EXPOSITION_BODIES.labels('cached').inc()
+        return body
+
+    def gzipped(self, body: bytes) -> bytes:
+        compressed_for, compressed = self._gzipped
+        if compressed_for != body:
+            compressed = gzip.compress(body)
+            self._gzipped = (body, compressed)
+        else:
+            EXPOSITION_BODIES.labels('gzip_cached').inc()
+        return compressed
+
+    def encode(self, accept_encoding: str = None) -> Tuple[List[Tuple[str, str]], bytes]:
+        body = self.body()
+        headers = [('Content-Type', CONTENT_TYPE_LATEST)]
+        if gzip_accepted(accept_encoding or ''):
+            body = self.gzipped(body)
+            headers.append(('Content-Encoding', 'gzip'))
+        return headers, body
@@ -1,83 +1,166 @@
-import dictlib
 import math
 import os
 import platform
 import re
 
+from functools import cache, lru_cache, partial
 from typing import Optional, Dict, Callable
 
+from descriptors import compile_path
+
+
+DEFAULT_CACHE_SIZE = 256
+
+_SI_SUFFIXED = re.compile(r'^\s*(\d+\.?\d*)\s*([kKmMgGtT])?\s*$')
+_EFFICIENCY = re.compile(r'^\s*(\d+\.?\d*)\s*([kKmMgGtT])?H/W\s*$')
+_WORKER_FROM_USER = re.compile(r'^[^.]+\.(.+)$')
+_WALLET_FROM_USER = re.compile(r'^([^.]+)\..+$')
+_WALLET_ADDR_FROM_USER = re.compile(r'^([^.]+)(\..*)?')
+
+SI_MULTIPLIERS = {
+    None: 1,
+    'k': 1000,
+    'm': 1000 ** 2,
+    'g': 1000 ** 3,
+    't': 1000 ** 4,
+}
+
+
+class Memoized:
+    # Bounded LRU cache over a pure transform's first argument; the trailing `*_` arguments the descriptor machinery
+    # passes (e.g. the GPU index) don't affect the result and are ignored
+    instances: Dict[str, 'Memoized'] = {}
+
+    def __init__(self, func: Callable, maxsize: int = DEFAULT_CACHE_SIZE):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+        self.resize(maxsize)
+        Memoized.instances[func.__name__] = self
+
+    def resize(self, maxsize: int) -> None:
+        self._cached = lru_cache(maxsize=maxsize)(self.func)
+
+    def __call__(self, value, *_):
+        return self._cached(value)
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+
+def memoized(func: Callable) -> Memoized:
+    return Memoized(func)
+
+
+def configure_caches(maxsize: int) -> None:
+    for memo in Memoized.instances.values():
+        memo.resize(maxsize)
+
+
+def cache_stats() -> Dict:
+    return {name: memo.cache_info() for name, memo in Memoized.instances.items()}
+
 
 if 'DEBUG_MOCK_HOSTNAME' in os.environ:
     def hostname(*_):
         return os.environ['DEBUG_MOCK_HOSTNAME']
 else:
-    def hostname(*_):
+    @cache
+    def _node() -> str:
         return platform.node()
 
+    def hostname(*_):
+        return _node()
+
 
-def mining_platform(*_):
+@cache
+def _system() -> str:
     return platform.system()
 
 
-def si_suffixed(value: str, *_) -> Optional[float]:
-    match = re.search(r'^\s*(\d+\.?\d*)\s*([kKmMgGtT])?\s*$', value)
+def mining_platform(*_):
+    return _system()
+
+
+@memoized
+def si_suffixed(value: str) -> Optional[float]:
+    match = _SI_SUFFIXED.search(value)
     if not match:
         return None
+    return float(match[1]) * SI_MULTIPLIERS[match[2] and match[2].lower()]
+
+
+@memoized
+def efficiency_str_to_hash_per_watt(value: str) -> Optional[float]:
+    # T-Rex reports GPU efficiency as e.g. "198kH/W"
+    match = _EFFICIENCY.search(value)
+    if not match:
+        return None
+    return float(match[1]) * SI_MULTIPLIERS[match[2] and match[2].lower()]
+
 
-    mult = 1
-    si_suffix = match[2].lower()
-    if si_suffix == 'k':
-        mult = 1000
-    elif si_suffix == 'm':
-        mult = 1000 ^ 2
-    elif si_suffix == 'g':
-        mult = 1000 ^ 3
-    elif si_suffix == 't':
-        mult = 1000 ^ 4
-    return float(match[1]) * mult
+def scale(factor, value, *_):
+    return factor * value
 
 
 def mul(x) -> Callable:
-    def func(y, *_):
-        return x * y
-    return func
+    return partial(scale, x)
 
 
-def worker_from_user_field(user_value: str, *_) -> str:
-    match = re.search(r'^[^.]+\.(.+)$', user_value)
+@memoized
+def worker_from_user_field(user_value: str) -> str:
+    match = _WORKER_FROM_USER.search(user_value)
     return match[1] if match else ''
 
 
-def wallet_from_user_field(user_value: str, *_) -> str:
-    match = re.search(r'^([^.]+)\..+$', user_value)
+@memoized
+def wallet_from_user_field(user_value: str) -> str:
+    match = _WALLET_FROM_USER.search(user_value)
     return match[1] if match else ''
 
 
-def wallet_addr_from_user_field(user_value: str, *_) -> str:
-    match = re.search(r'^([^.]+)(\..*)?', user_value)
+@memoized
+def wallet_addr_from_user_field(user_value: str) -> str:
+    match = _WALLET_ADDR_FROM_USER.search(user_value)
     return match[1] if match else user_value
 
 
 def pow10(value_key: str, pow_10_key: str, base: Dict, i: int = None) -> float:
-    if i is not None:
-        value_key = value_key.replace('[i]', f'[{i}]')
-        pow_10_key = pow_10_key.replace('[i]', f'[{i}]')
-    exp = round(math.log(dictlib.dig(base, pow_10_key), 10))
-    return float(f'{dictlib.dig(base, value_key)}e{exp}')
+    exp = round(math.log(compile_path(pow_10_key)(base, i), 10))
+    return float(f'{compile_path(value_key)(base, i)}e{exp}')
 
 
-def pcie_bus_slot_str_to_id(bus_slot: str, *_) -> str:
+@memoized
+def pcie_bus_slot_str_to_id(bus_slot: str) -> str:
     bus, slot = bus_slot.split(':')
     return f'{bus.zfill(2)}:{slot.zfill(2)}'
 
 
+@memoized
+def _pcie_bus_slot_ints_to_id(bus_slot: tuple) -> str:
+    bus, slot = bus_slot
+    return f'{hex(bus)[2:].zfill(2)}:{hex(slot)[2:].zfill(2)}'
+
+
+@memoized
+def pcie_address_to_id(address: str) -> str:
+    # Full addresses as in `0000:01:00.0` or `01:00.0`
+    bus, slot = address.rsplit('.', 1)[0].split(':')[-2:]
+    return f'{bus.zfill(2).lower()}:{slot.zfill(2).lower()}'
+
+
+def pcie_bus_to_id(bus: int, *_) -> str:
+    return _pcie_bus_slot_ints_to_id((bus, 0))
+
+
 def pcie_bus_slot_paths_to_id(bus_path: str, slot_path: str, base: Dict, i: int = None) -> str:
-    if i is not None:
-        bus_path = bus_path.replace('[i]', f'[{i}]')
-        slot_path = slot_path.replace('[i]', f'[{i}]')
-    bus = hex(dictlib.dig(base, bus_path))[2:].zfill(2)
-    slot = hex(dictlib.dig(base, slot_path))[2:].zfill(2)
-    return f'{bus}:{slot}'
+    return _pcie_bus_slot_ints_to_id((compile_path(bus_path)(base, i), compile_path(slot_path)(base, i)))
+
+
+def pwm_percent(pwm: Optional[int], pwm_max: Optional[int] = None, *_) -> Optional[float]:
+    if pwm is None:
+        return None
+    return pwm * 100.0 / (pwm_max or 255)
 
 
 def only_above_0(value, *_) -> Optional:
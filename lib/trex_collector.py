@@ -1,13 +1,11 @@
 import transformers
 
-from abstract_miner_collector import AbstractMinerJsonCollector
-from metric_wrappers import WrMetric
+from descriptor_collector import DescriptorMinerCollector, MinerDescriptor
 
 import platform
 
 from collections import OrderedDict
 from functools import cache, partial
-from typing import List
 
 
 xform_gpu_pci_id = partial(transformers.pcie_bus_slot_paths_to_id, 'pci_bus', 'pci_id')
@@ -213,6 +211,11 @@ GPU_GAUGE_METRICS = OrderedDict(
         'desc': 'GPU power in watts',
         'value_path': 'power',
     },
+    gpu_efficiency = {
+        'desc': 'GPU hashrate per watt reported by the miner',
+        'value_path': 'efficiency',
+        'transform': transformers.efficiency_str_to_hash_per_watt,
+    },
     gpu_power_avg = {
         'desc': 'Average GPU power in watts',
         'value_path': 'power_avr',
@@ -223,34 +226,39 @@ GPU_GAUGE_METRICS = OrderedDict(
     },
 )
 
+# Events only the log reports (see log_tailer.LOG_EVENTS), written against T-Rex 0.26 logs. `gpu` is the GPU number
+# in the log (T-Rex's gpu_id), `ms`/`sec` the event's duration.
+LOG_PATTERNS = OrderedDict(
+    share_accepted = r'\[ OK \] \d+/\d+ - [^,]*, (?P<ms>\d+)ms \.\.\. GPU #(?P<gpu>\d+)',
+    share_rejected = r'\[FAIL\] \d+/\d+ - .*, (?P<ms>\d+)ms \.\.\. GPU #(?P<gpu>\d+)',
+    lhr_unlock = r'GPU #(?P<gpu>\d+): LHR unlocked',
+    dag_build = r'GPU #(?P<gpu>\d+): DAG generated \[crc: \w+, time: (?P<ms>\d+) ms\]',
+    gpu_restart = r'WARN: GPU #(?P<gpu>\d+): restarting',
+    pool_reconnect = r'WARN: connection lost, reconnecting',
+)
+
+
+TREX = MinerDescriptor(
+    miner='t-rex',
+    process_name='t-rex',
+    miner_labels=MINER_LABELS,
+    miner_counter_metrics=MINER_COUNTER_METRICS,
+    miner_gauge_metrics=MINER_GAUGE_METRICS,
+    gpu_labels=GPU_LABELS,
+    gpu_counter_metrics=GPU_COUNTER_METRICS,
+    gpu_gauge_metrics=GPU_GAUGE_METRICS,
+    gpus_path='gpus',
+)
+
+
+class TrexCollector(DescriptorMinerCollector):
+    descriptor = TREX
+    log_patterns = LOG_PATTERNS
+    log_gpu_label = 'trex_gpu_id'
 
-class TrexCollector(AbstractMinerJsonCollector):
     @property
     @cache
-    def api_url(self) -> str:
+    def local_api_url(self) -> str:
         running_linux = platform.system() == 'Linux'
         port = '3333' if running_linux else '4068'
         return f'http://127.0.0.1:{port}/summary'
-
-    # TODO deduplicate code from lolminer
-    def json_collect(self, request_time: float, json_data) -> List[WrMetric]:
-        label_keys = list(MINER_LABELS.keys())
-        metrics = self.create_counter_gauge_metrics(MINER_COUNTER_METRICS, MINER_GAUGE_METRICS, label_keys)
-        labels = WrMetric.parse_label_values(json_data, MINER_LABELS)
-        for metric in metrics:
-            metric.add_value(base=json_data, labels=labels, timestamp=request_time)
-
-        gpu_general_label_keys = list(label_keys)
-        all_gpu_labels = OrderedDict(GPU_LABELS)
-        all_gpu_labels.update(self.addl_gpu_labels_from_config(xform_gpu_pci_id))
-        gpu_general_label_keys.extend(list(all_gpu_labels.keys()))
-
-        gpu_metrics = self.create_counter_gauge_metrics(GPU_COUNTER_METRICS, GPU_GAUGE_METRICS, gpu_general_label_keys)
-        for gpu in json_data['gpus']:
-            gpu_labels = OrderedDict(labels)
-            gpu_labels.update(WrMetric.parse_label_values(gpu, all_gpu_labels))
-            for metric in gpu_metrics:
-                metric.add_value(base=gpu, labels=gpu_labels, timestamp=request_time)
-        metrics.extend(gpu_metrics)
-
-        return metrics